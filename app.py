@@ -1,21 +1,78 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, Response
-import yt_dlp
+from flask import Flask, render_template, request, jsonify, send_file, Response
 import os
 import threading
 import time
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.http import is_resource_modified
 import sys
 import subprocess
-import requests # Add this import
 import uuid
 import shutil
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, TDRC, TCON, TRCK, TPE2, TPE3
-from mutagen.id3._util import ID3NoHeaderError
-from mutagen import File
-import io
-import instaloader
 import re
+import queue
+import itertools
+import copy
+import json
+import hashlib
+import hmac
+import socket
+import base64
+import tempfile
+import sqlite3
+import mimetypes
+import multiprocessing
+import signal
+from datetime import datetime, timezone
+from urllib.parse import quote
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from contextlib import contextmanager
+import importlib
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows: job processes run without CPU/memory limits
+
+from jobs import (JobInterrupted, DownloadPaused, DownloadCancelled, JobDetached, JOB_STATE_IMMEDIATE_FIELDS,
+                  LocalJobState, SQLiteJobState)
+from storage import StorageManager
+from proxy_cache import ProxyCache, proxy_conditional_headers, proxy_passthrough_headers, new_proxy_meta
+from downloader import (MediaDownloader, load_resume_state, save_resume_state, discard_part, claim_part, release_part,
+                        part_in_use)
+
+# Heavy third-party modules are imported on first use, so cold starts (Vercel,
+# gunicorn worker restarts) only pay for the ones a route actually needs.
+# LAZY_IMPORTS=0 imports everything up front (e.g. with gunicorn --preload).
+LAZY_IMPORTS = os.environ.get('LAZY_IMPORTS', '1') != '0'
+
+class LazyModule:
+    """
+    Stand-in that imports the real module on first attribute access
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+def lazy_import(name):
+    return LazyModule(name) if LAZY_IMPORTS else importlib.import_module(name)
+
+yt_dlp = lazy_import('yt_dlp')
+instaloader = lazy_import('instaloader')
+requests = lazy_import('requests')
+urllib3_retry = lazy_import('urllib3.util.retry')
+urllib3_pool = lazy_import('urllib3.connectionpool')
+urllib3_exceptions = lazy_import('urllib3.exceptions')
+mutagen = lazy_import('mutagen')
+mutagen_mp3 = lazy_import('mutagen.mp3')
+mutagen_id3 = lazy_import('mutagen.id3')
+mutagen_mp4 = lazy_import('mutagen.mp4')
+mutagen_flac = lazy_import('mutagen.flac')
 
 # Set environment variables for Vercel/Serverless to use /tmp for caching
 if os.environ.get('VERCEL'):
@@ -29,8 +86,10 @@ COMMON_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.3
 app = Flask(__name__)
 
 # --- Configuration ---
-# Check if running on Vercel or similar environment
-if os.environ.get('VERCEL') or not os.path.exists('D:/'):
+# Explicit folder first (state files below default to live next to it), then Vercel or similar environment
+if os.environ.get('DOWNLOAD_FOLDER'):
+    app.config['DOWNLOAD_FOLDER'] = os.environ['DOWNLOAD_FOLDER']
+elif os.environ.get('VERCEL') or not os.path.exists('D:/'):
     app.config['DOWNLOAD_FOLDER'] = '/tmp/downloads'
 else:
     app.config['DOWNLOAD_FOLDER'] = 'D:/Universal Video Downloader Downloads'
@@ -38,20 +97,154 @@ else:
 app.config['ALLOWED_EXTENSIONS'] = {'mp4', 'mp3', 'webm'}
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB
 
+# Audio mode output: 'mp3' re-encodes (the long-standing default); 'm4a', 'opus' and 'native' are
+# opt-in and keep the source codec when it matches
+app.config['DEFAULT_AUDIO_FORMAT'] = os.environ.get('DEFAULT_AUDIO_FORMAT', 'mp3')
+
+# Number of downloads that run at the same time; the rest wait in the queue
+app.config['MAX_CONCURRENT_DOWNLOADS'] = int(os.environ.get('MAX_CONCURRENT_DOWNLOADS', min(4, os.cpu_count() or 1)))
+# 'process' runs every yt-dlp download in its own process, so extraction and postprocessing
+# do not compete with the web workers for the GIL and a cancel can kill it; 'thread' runs it here
+app.config['JOB_EXECUTION'] = os.environ.get('JOB_EXECUTION', 'thread')
+app.config['JOB_PROCESS_CPU_SECONDS'] = int(os.environ.get('JOB_PROCESS_CPU_SECONDS', 0))  # RLIMIT_CPU of a job process and its ffmpeg, 0 = none
+app.config['JOB_PROCESS_MEMORY_BYTES'] = int(os.environ.get('JOB_PROCESS_MEMORY_BYTES', 0))  # RLIMIT_AS, 0 = none
+app.config['JOB_PROCESS_NICE'] = int(os.environ.get('JOB_PROCESS_NICE', 10))  # job processes yield the CPU to the web workers
+# How long finished jobs stay around so their status can still be read
+app.config['JOB_RETENTION_SECONDS'] = int(os.environ.get('JOB_RETENTION_SECONDS', 3600))
+app.config['DEFAULT_JOB_PRIORITY'] = 10
+# A paused download holds its worker this long before giving it back (partial data is kept)
+app.config['PAUSE_PARK_SECONDS'] = int(os.environ.get('PAUSE_PARK_SECONDS', 60))
+# Unfinished jobs are written here so they can be resumed after a restart
+app.config['JOB_MANIFEST_FOLDER'] = os.path.join(app.config['DOWNLOAD_FOLDER'], '.jobs')
+# Job status shared between worker processes (gunicorn -w N): 'sqlite' (a WAL database next
+# to the downloads, for workers on one host) or 'local' (this process only)
+app.config['JOB_STATE_BACKEND'] = os.environ.get('JOB_STATE_BACKEND', 'sqlite')
+app.config['JOB_STATE_PATH'] = os.environ.get('JOB_STATE_PATH', os.path.join(app.config['DOWNLOAD_FOLDER'], '.job_state.sqlite3'))
+app.config['JOB_STATE_FLUSH_INTERVAL'] = 0.5  # seconds; progress is written in batches, state changes at once
+# Server-Sent Events: coalesce progress into at most this many pushes per second
+app.config['SSE_MAX_UPDATES_PER_SECOND'] = float(os.environ.get('SSE_MAX_UPDATES_PER_SECOND', 4))
+app.config['SSE_HEARTBEAT_SECONDS'] = 15
+# Every open stream holds a server thread, so /events needs a threaded, cooperative or async worker
+# (gunicorn -k gthread/gevent/eventlet, uvicorn asgi:application); sync workers get 503 and the page polls.
+# gevent/eventlet are recognised by their monkey-patching (they report wsgi.multithread=False);
+# set SSE_ALLOW_ANY_WORKER=1 for other servers that multiplex requests.
+app.config['SSE_ALLOW_ANY_WORKER'] = os.environ.get('SSE_ALLOW_ANY_WORKER', '0') == '1'
+# Streams end after this long and the page opens a new one, so no request is held for a whole job.
+app.config['SSE_MAX_STREAM_SECONDS'] = int(os.environ.get('SSE_MAX_STREAM_SECONDS', 45))
+
+# Extracted yt-dlp info dicts are reused between fetch, verification and download
+app.config['INFO_CACHE_TTL'] = int(os.environ.get('INFO_CACHE_TTL', 600))  # seconds; format URLs expire
+app.config['INFO_CACHE_SIZE'] = int(os.environ.get('INFO_CACHE_SIZE', 256))  # entries
+
+# Playlist/channel batches: items downloaded at the same time within one batch job
+app.config['PLAYLIST_CONCURRENCY'] = int(os.environ.get('PLAYLIST_CONCURRENCY', 3))
+app.config['PLAYLIST_MAX_CONCURRENCY'] = 8  # cap for the per-request 'concurrency' field
+app.config['PLAYLIST_MAX_ITEMS'] = int(os.environ.get('PLAYLIST_MAX_ITEMS', 1000))
+
+# Instagram: long-lived Instaloader sessions and resolved posts by shortcode
+app.config['INSTALOADER_POOL_SIZE'] = int(os.environ.get('INSTALOADER_POOL_SIZE', 2))
+app.config['INSTAGRAM_POST_CACHE_TTL'] = int(os.environ.get('INSTAGRAM_POST_CACHE_TTL', 900))  # seconds, capped by CDN URL expiry
+app.config['INSTAGRAM_POST_CACHE_SIZE'] = 256  # entries
+app.config['INSTAGRAM_URL_EXPIRY_MARGIN'] = 120  # seconds; drop posts this long before their media URLs expire
+
+# Direct media downloads (Instagram CDN files, thumbnails)
+app.config['SEGMENT_MIN_SIZE'] = 8 * 1024 * 1024  # files at least this big are split into ranges
+app.config['SEGMENTS_PER_FILE'] = int(os.environ.get('SEGMENTS_PER_FILE', 4))
+app.config['PARALLEL_FILE_DOWNLOADS'] = int(os.environ.get('PARALLEL_FILE_DOWNLOADS', 4))
+app.config['DOWNLOAD_BUFFER_SIZE'] = 1024 * 1024  # 1MB reads and writes
+app.config['SEGMENT_RETRIES'] = 2
+
+# Outbound HTTP (proxies, thumbnails, direct media downloads)
+app.config['HTTP_MAX_CONNECTIONS_PER_HOST'] = int(os.environ.get('HTTP_MAX_CONNECTIONS_PER_HOST', 8))
+app.config['HTTP_MAX_HOST_POOLS'] = 32  # keep-alive pools kept for this many hosts
+# seconds a request waits for one of those connections to come free before it fails
+app.config['HTTP_POOL_TIMEOUT'] = float(os.environ.get('HTTP_POOL_TIMEOUT', 30))
+app.config['HTTP_CONNECT_TIMEOUT'] = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+app.config['HTTP_READ_TIMEOUT'] = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+app.config['HTTP_RETRIES'] = int(os.environ.get('HTTP_RETRIES', 3))
+app.config['HTTP_RETRY_BACKOFF'] = 0.5  # seconds, doubled on every retry
+
+# Bandwidth scheduler (bytes/s, 0 = unlimited); all three can be changed at runtime via /admin/scheduler
+app.config['BANDWIDTH_LIMIT'] = int(os.environ.get('BANDWIDTH_LIMIT', 0))  # shared by every active job
+app.config['JOB_BANDWIDTH_LIMIT'] = int(os.environ.get('JOB_BANDWIDTH_LIMIT', 0))  # cap for a single job
+app.config['FRAGMENT_CONCURRENCY'] = int(os.environ.get('FRAGMENT_CONCURRENCY', 8))  # yt-dlp fragment connections, split between jobs
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN', '')  # X-Admin-Token for admin routes; unset = admin routes disabled
+
+# On-disk cache for /proxy_image and /download_thumbnail_proxy
+app.config['PROXY_CACHE_FOLDER'] = os.environ.get('PROXY_CACHE_FOLDER', os.path.join(tempfile.gettempdir(), 'udl_proxy_cache'))
+app.config['PROXY_CACHE_MAX_BYTES'] = int(os.environ.get('PROXY_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+app.config['PROXY_CACHE_DEFAULT_TTL'] = 3600  # seconds, when the origin sends no max-age
+app.config['PROXY_MAX_BODY_BYTES'] = int(os.environ.get('PROXY_MAX_BODY_BYTES', 32 * 1024 * 1024))
+app.config['PROXY_CHUNK_SIZE'] = 64 * 1024  # bytes held in memory per proxied response
+
+# Finished downloads keyed by extractor + video ID + mode + quality; repeat requests reuse the file
+app.config['DOWNLOAD_INDEX_PATH'] = os.environ.get('DOWNLOAD_INDEX_PATH', os.path.join(app.config['DOWNLOAD_FOLDER'], '.download_index.sqlite3'))
+
+# Storage quota for DOWNLOAD_FOLDER (0 = no quota). Above the high watermark the least
+# recently served downloads are deleted until usage is back under the low watermark.
+app.config['STORAGE_QUOTA_BYTES'] = int(os.environ.get('STORAGE_QUOTA_BYTES', 0))
+app.config['STORAGE_HIGH_WATERMARK'] = float(os.environ.get('STORAGE_HIGH_WATERMARK', 0.9))  # fraction of the quota
+app.config['STORAGE_LOW_WATERMARK'] = float(os.environ.get('STORAGE_LOW_WATERMARK', 0.7))
+app.config['STORAGE_EVICT_MIN_AGE'] = 600  # seconds; files served or written this recently are never evicted
+# Jobs only start when their estimated size fits in the free disk space (minus this) and the quota
+app.config['STORAGE_MIN_FREE_BYTES'] = int(os.environ.get('STORAGE_MIN_FREE_BYTES', 256 * 1024 * 1024))
+app.config['STORAGE_DEFAULT_JOB_BYTES'] = 100 * 1024 * 1024  # assumed size when a job has no estimate
+app.config['STORAGE_RETRY_SECONDS'] = 5  # a job waiting for space is looked at again after this long
+# .part/.ytdl/.info.json files (and their stray thumbnails) untouched this long are removed
+app.config['STORAGE_ORPHAN_AGE'] = int(os.environ.get('STORAGE_ORPHAN_AGE', 6 * 3600))
+app.config['STORAGE_SWEEP_INTERVAL'] = 300  # seconds between orphan sweeps
+app.config['STORAGE_STATS_TTL'] = 10  # seconds /metrics and job listings may report an older usage total
+
+# Serving finished files from /downloads/<filename>
+# '' streams from this process (os.sendfile under gunicorn); 'nginx' answers with
+# X-Accel-Redirect under SENDFILE_NGINX_PREFIX; 'apache' answers with X-Sendfile
+app.config['SENDFILE_BACKEND'] = os.environ.get('SENDFILE_BACKEND', '')
+app.config['SENDFILE_NGINX_PREFIX'] = os.environ.get('SENDFILE_NGINX_PREFIX', '/protected-downloads')
+app.config['FILE_CHUNK_SIZE'] = 1024 * 1024
+
+# /stream: formats that need no merge are piped straight to the client, optionally
+# written to DOWNLOAD_FOLDER on the way so the download index can reuse them
+app.config['STREAM_CHUNK_SIZE'] = 256 * 1024  # bytes held in memory per stream
+app.config['STREAM_TEE_TO_DISK'] = os.environ.get('STREAM_TEE_TO_DISK', '1') == '1'  # default for the 'tee' parameter
+
+# asgi.py: threads for blocking yt-dlp/instaloader calls made from the event loop
+app.config['ASYNC_BLOCKING_WORKERS'] = int(os.environ.get('ASYNC_BLOCKING_WORKERS', 16))
+# asgi.py: threads for the Flask routes it hands over (each open /events or /downloads response holds one)
+app.config['ASYNC_WSGI_WORKERS'] = int(os.environ.get('ASYNC_WSGI_WORKERS', 32))
+
 # --- Global Variables ---
-download_status = {
+# Status reported when no job is known (same shape as a job status)
+IDLE_STATUS = {
+    'job_id': None,
+    'state': 'idle',
     'is_paused': False,
     'is_downloading': False,
     'progress': 0,
     'current_file': None,
     'message': 'Ready to download',
     'title': '',
-    'download_thread': None
 }
 
-# Generate a unique ID for the device
+# All known download jobs, keyed by job ID
+jobs = {}
+jobs_lock = threading.Lock()
+# Entries are (priority, sequence, job_id, target, args); lower priority runs first
+job_queue = queue.PriorityQueue()
+_job_sequence = itertools.count()
+_job_workers = []
+# Queue entries of jobs waiting for disk space, put back (same sequence) when space may be free
+_storage_waiting = []
+_storage_retry_timer = None
+_jobs_restored = False
+
+# Generate a unique ID for the device (read on first use, not at import)
 DEVICE_ID_FILE = os.path.join(app.config['DOWNLOAD_FOLDER'], 'device_id.txt')
+_device_id = None
+
 def get_device_id():
+    global _device_id
+    if _device_id is not None:
+        return _device_id
     try:
         if not os.path.exists(app.config['DOWNLOAD_FOLDER']):
             os.makedirs(app.config['DOWNLOAD_FOLDER'])
@@ -63,39 +256,219 @@ def get_device_id():
         else:
             with open(DEVICE_ID_FILE, 'r') as f:
                 device_id = f.read().strip()
+        _device_id = device_id
         return device_id
     except Exception as e:
         print(f"Error getting device ID: {e}")
         return "unknown-device-id"
 
-DEVICE_ID = get_device_id()
+# --- Metrics ---
+# Upper bounds (seconds) of the stage duration histogram buckets; +Inf is implied
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Stage -> {'buckets': [count per bound], 'count', 'sum'}
+stage_timings = {}
+# Extractor -> {'bytes', 'seconds'} for finished transfers
+transfer_totals = {}
+metrics_lock = threading.Lock()
+
+def observe_stage(stage, seconds):
+    with metrics_lock:
+        timing = stage_timings.setdefault(stage, {'buckets': [0] * len(STAGE_BUCKETS), 'count': 0, 'sum': 0.0})
+        for index, bound in enumerate(STAGE_BUCKETS):
+            if seconds <= bound:
+                timing['buckets'][index] += 1
+        timing['count'] += 1
+        timing['sum'] += seconds
+
+@contextmanager
+def timed_stage(stage):
+    """
+    Time the block (or decorated function) into the stage histogram, failures included
+    """
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.monotonic() - started)
+
+def record_transfer(extractor, size, seconds):
+    observe_stage('transfer', seconds)
+    with metrics_lock:
+        totals = transfer_totals.setdefault(extractor or 'unknown', {'bytes': 0, 'seconds': 0.0})
+        totals['bytes'] += size
+        totals['seconds'] += seconds
+
+def merge_metrics(timings, transfers):
+    """
+    Add the stage timings and transfer totals recorded in a job process
+    """
+    with metrics_lock:
+        for stage, timing in timings.items():
+            totals = stage_timings.setdefault(stage, {'buckets': [0] * len(STAGE_BUCKETS), 'count': 0, 'sum': 0.0})
+            totals['buckets'] = [mine + theirs for mine, theirs in zip(totals['buckets'], timing['buckets'])]
+            totals['count'] += timing['count']
+            totals['sum'] += timing['sum']
+        for extractor, theirs in transfers.items():
+            totals = transfer_totals.setdefault(extractor, {'bytes': 0, 'seconds': 0.0})
+            totals['bytes'] += theirs['bytes']
+            totals['seconds'] += theirs['seconds']
+
+def metric_labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+def render_metrics():
+    """
+    Everything /metrics reports, in the Prometheus text exposition format
+    """
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for suffix, labels, value in samples:
+            lines.append(f'{name}{suffix}{labels} {value}')
+
+    with metrics_lock:
+        timings = {stage: copy.deepcopy(timing) for stage, timing in stage_timings.items()}
+        transfers = {extractor: dict(totals) for extractor, totals in transfer_totals.items()}
+
+    samples = []
+    for stage, timing in sorted(timings.items()):
+        for bound, count in zip(STAGE_BUCKETS, timing['buckets']):
+            samples.append(('_bucket', metric_labels(stage=stage, le=bound), count))
+        samples.append(('_bucket', metric_labels(stage=stage, le='+Inf'), timing['count']))
+        samples.append(('_sum', metric_labels(stage=stage), round(timing['sum'], 6)))
+        samples.append(('_count', metric_labels(stage=stage), timing['count']))
+    metric('udl_stage_duration_seconds', 'histogram',
+           'Time spent in each pipeline stage (extraction, transfer, ffmpeg_postprocess, tagging, proxy)', samples)
+
+    metric('udl_transfer_bytes_total', 'counter', 'Bytes of finished transfers by extractor',
+           [('', metric_labels(extractor=extractor), totals['bytes']) for extractor, totals in sorted(transfers.items())])
+    metric('udl_transfer_seconds_total', 'counter', 'Time spent on finished transfers by extractor',
+           [('', metric_labels(extractor=extractor), round(totals['seconds'], 6))
+            for extractor, totals in sorted(transfers.items())])
+    metric('udl_transfer_throughput_bytes_per_second', 'gauge', 'Average throughput of finished transfers by extractor',
+           [('', metric_labels(extractor=extractor), round(totals['bytes'] / totals['seconds'], 2))
+            for extractor, totals in sorted(transfers.items()) if totals['seconds']])
+
+    with jobs_lock:
+        states = {}
+        for job in jobs.values():
+            states[job['state']] = states.get(job['state'], 0) + 1
+    metric('udl_job_queue_depth', 'gauge', 'Jobs waiting for a worker', [('', '', job_queue.qsize())])
+    metric('udl_active_jobs', 'gauge', 'Jobs currently running', [('', '', states.get('running', 0))])
+    metric('udl_jobs', 'gauge', 'Known jobs by state',
+           [('', metric_labels(state=state), count) for state, count in sorted(states.items())])
+
+    with http_stats_lock:
+        hosts = {host: dict(counts) for host, counts in http_stats.items()}
+    for event, help_text in (('requests', 'Outbound HTTP requests'),
+                             ('errors', 'Outbound HTTP requests that failed or returned 4xx/5xx'),
+                             ('retries', 'Outbound HTTP retries')):
+        metric(f'udl_http_{event}_total', 'counter', help_text,
+               [('', metric_labels(host=host), counts[event]) for host, counts in sorted(hosts.items())])
+
+    cache = proxy_cache.stats()
+    lookups = cache['hits'] + cache['revalidated'] + cache['misses']
+    metric('udl_proxy_cache_hits_total', 'counter', 'Proxy responses served from the cache without revalidation',
+           [('', '', cache['hits'])])
+    metric('udl_proxy_cache_revalidated_total', 'counter', 'Stale proxy cache entries confirmed with a 304',
+           [('', '', cache['revalidated'])])
+    metric('udl_proxy_cache_misses_total', 'counter', 'Proxy responses fetched from the origin',
+           [('', '', cache['misses'])])
+    metric('udl_proxy_cache_hit_ratio', 'gauge', 'Share of proxy responses served from the cache (revalidated included)',
+           [('', '', round((cache['hits'] + cache['revalidated']) / lookups, 4) if lookups else 0)])
+    metric('udl_proxy_cache_bytes', 'gauge', 'Bytes held by the proxy cache', [('', '', cache['bytes'])])
+
+    disk = storage.stats()
+    metric('udl_storage_used_bytes', 'gauge', 'Bytes in DOWNLOAD_FOLDER', [('', '', disk['used_bytes'])])
+    metric('udl_storage_reserved_bytes', 'gauge', 'Bytes reserved by running jobs', [('', '', disk['reserved_bytes'])])
+    metric('udl_storage_evicted_bytes_total', 'counter', 'Bytes of downloads evicted for the quota',
+           [('', '', disk['evicted_bytes'])])
+    return '\n'.join(lines) + '\n'
 
 # --- Helper Functions ---
+# Common Windows ffmpeg locations, tried when ffmpeg is not in PATH
+FFMPEG_COMMON_PATHS = [
+    r"C:\ffmpeg\bin",  # Found location!
+    r"C:\ffmpeg-8.0-essentials_build\bin",
+    r"C:\Users\MAHMOUD SABRY\ffmpeg\bin",
+    r"C:\Program Files\ffmpeg\bin",
+    r"C:\Program Files (x86)\ffmpeg\bin",
+]
+
+# Encoders that decide which audio/video outputs are possible
+FFMPEG_CAPABILITY_ENCODERS = {
+    'mp3': ('libmp3lame',),
+    'aac': ('aac', 'libfdk_aac'),
+    'opus': ('libopus', 'opus'),
+    'vorbis': ('libvorbis', 'vorbis'),
+    'h264': ('libx264', 'h264_nvenc', 'h264_qsv', 'h264_videotoolbox'),
+}
+
+_toolchain = None
+_toolchain_lock = threading.Lock()
+
+def find_ffmpeg_binary(name):
+    path = shutil.which(name)
+    if path:
+        return path
+    for folder in FFMPEG_COMMON_PATHS:
+        candidate = os.path.join(folder, name + '.exe')
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def run_ffmpeg_query(binary, *args):
+    try:
+        result = subprocess.run([binary, '-hide_banner', *args], capture_output=True, text=True, timeout=10)
+        return result.stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"⚠️ Could not run {binary}: {e}")
+        return ''
+
+def probe_toolchain():
+    """
+    Locate ffmpeg/ffprobe and read their version and encoders once per
+    process; later calls return the cached result
+    """
+    global _toolchain
+    if _toolchain is not None:
+        return _toolchain
+    with _toolchain_lock:
+        if _toolchain is not None:
+            return _toolchain
+
+        ffmpeg = find_ffmpeg_binary('ffmpeg')
+        toolchain = {
+            'ffmpeg': ffmpeg,
+            'ffprobe': find_ffmpeg_binary('ffprobe'),
+            'location': os.path.dirname(ffmpeg) if ffmpeg else None,
+            'version': None,
+            'capabilities': {name: False for name in FFMPEG_CAPABILITY_ENCODERS},
+        }
+        if ffmpeg:
+            version_line = run_ffmpeg_query(ffmpeg, '-version').split('\n', 1)[0]
+            match = re.match(r'ffmpeg version (\S+)', version_line)
+            toolchain['version'] = match.group(1) if match else None
+            # Encoder lines look like " A....D libmp3lame   libmp3lame MP3 ..."
+            encoders = {line.split()[1] for line in run_ffmpeg_query(ffmpeg, '-encoders').splitlines()
+                        if len(line.split()) > 1 and re.match(r'^ [VAS][\.A-Z]{5} ', line)}
+            toolchain['capabilities'] = {name: any(encoder in encoders for encoder in candidates)
+                                         for name, candidates in FFMPEG_CAPABILITY_ENCODERS.items()}
+            print(f"✅ Found ffmpeg {toolchain['version']} at: {toolchain['location']}")
+        else:
+            print("❌ ffmpeg not found in any expected location")
+        _toolchain = toolchain
+        return _toolchain
+
 def get_ffmpeg_location():
     """
-    Find ffmpeg location with fallback options
+    Folder holding ffmpeg, or None (probed once, see probe_toolchain)
     """
-    # First check if ffmpeg is in PATH
-    ffmpeg_path = shutil.which('ffmpeg')
-    if ffmpeg_path:
-        return os.path.dirname(ffmpeg_path)
-    
-    # Common Windows ffmpeg locations as fallback
-    common_paths = [
-        r"C:\ffmpeg\bin",  # Found location!
-        r"C:\ffmpeg-8.0-essentials_build\bin",
-        r"C:\Users\MAHMOUD SABRY\ffmpeg\bin",
-        r"C:\Program Files\ffmpeg\bin",
-        r"C:\Program Files (x86)\ffmpeg\bin",
-    ]
-    
-    for path in common_paths:
-        if os.path.exists(os.path.join(path, 'ffmpeg.exe')):
-            print(f"✅ Found ffmpeg at: {path}")  # للـ debugging
-            return path
-    
-    print("❌ ffmpeg not found in any expected location")  # للـ debugging
-    return None
+    return probe_toolchain()['location']
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
@@ -118,23 +491,31 @@ def create_download_folder():
 def get_available_formats():
     return ['Video', 'Audio']
 
+# Audio mode outputs: value -> (label, yt-dlp format selector, FFmpegExtractAudio codec)
+AUDIO_FORMATS = {
+    'mp3': ('MP3 192 kbps (re-encode)', 'bestaudio/best', 'mp3'),
+    'm4a': ('M4A / AAC (no re-encode)', 'bestaudio[ext=m4a]/bestaudio/best', 'm4a'),
+    'opus': ('Opus (no re-encode)', 'bestaudio[acodec=opus]/bestaudio/best', 'opus'),
+    'native': ('Original codec (no re-encode)', 'bestaudio/best', 'best'),
+}
+
+def get_available_audio_formats():
+    return {value: label for value, (label, _, _) in AUDIO_FORMATS.items()}
+
+def get_audio_format(source):
+    audio_format = source.get('audio_format') or app.config['DEFAULT_AUDIO_FORMAT']
+    return audio_format if audio_format in AUDIO_FORMATS else 'mp3'
+
 def get_available_qualities():
     return ['144p', '240p', '360p', '480p', '720p', '1080p', '1440p', '2160p']
 
-def add_metadata_to_audio(file_path, video_info, thumbnail_data=None):
+@timed_stage('tagging')
+def add_metadata_to_audio(file_path, video_info, thumbnail_data=None, thumbnail_mime='image/jpeg'):
     """
-    Add metadata to audio file using information from video_info
+    Add metadata to audio file using information from video_info: ID3 for
+    MP3, MP4 atoms for M4A, Vorbis comments for Opus/Ogg. One save per file.
     """
     try:
-        # Load the audio file
-        audio_file = MP3(file_path, ID3=ID3)
-        
-        # Try to load existing tags, if not create new ones
-        try:
-            audio_file.add_tags()
-        except ID3NoHeaderError:
-            pass
-        
         # Extract information from video_info
         title = video_info.get('title', '')
         uploader = video_info.get('uploader', '') or video_info.get('artist', '') or video_info.get('creator', '')
@@ -148,45 +529,109 @@ def add_metadata_to_audio(file_path, video_info, thumbnail_data=None):
         else:
             year = ''
         
-        # Set basic metadata
-        if title:
-            audio_file.tags.add(TIT2(encoding=3, text=title))  # Title
-        
-        if uploader:
-            audio_file.tags.add(TPE1(encoding=3, text=uploader))  # Artist
-            audio_file.tags.add(TPE2(encoding=3, text=uploader))  # Album Artist
-        
-        if album:
-            audio_file.tags.add(TALB(encoding=3, text=album))  # Album
-        
-        if year:
-            audio_file.tags.add(TDRC(encoding=3, text=year))  # Year
-        
         # Try to determine genre from title or description
         genre = determine_genre(title, description)
-        if genre:
-            audio_file.tags.add(TCON(encoding=3, text=genre))  # Genre
-        
-        # Add track number (default to 1)
-        audio_file.tags.add(TRCK(encoding=3, text="1"))
-        
-        # Add thumbnail as album art if available
-        if thumbnail_data:
-            audio_file.tags.add(APIC(
-                encoding=3,
-                mime='image/jpeg',
-                type=3,  # Cover (front)
-                desc='Cover',
-                data=thumbnail_data
-            ))
-        
-        # Save the changes
-        audio_file.save()
+
+        tags = {'title': title, 'artist': uploader, 'album': album, 'year': year, 'genre': genre}
+        ext = os.path.splitext(file_path)[1].lower()
+        if ext in ('.m4a', '.mp4', '.aac'):
+            write_mp4_tags(file_path, tags, thumbnail_data, thumbnail_mime)
+        elif ext in ('.opus', '.ogg', '.oga', '.flac'):
+            write_vorbis_tags(file_path, tags, thumbnail_data, thumbnail_mime)
+        else:
+            write_id3_tags(file_path, tags, thumbnail_data, thumbnail_mime)
         print(f"✅ Metadata added to: {file_path}")
         
     except Exception as e:
         print(f"❌ Error adding metadata to {file_path}: {str(e)}")
 
+def write_id3_tags(file_path, tags, thumbnail_data=None, thumbnail_mime='image/jpeg'):
+    # Load the audio file
+    audio_file = mutagen_mp3.MP3(file_path, ID3=mutagen_id3.ID3)
+    
+    # Try to load existing tags, if not create new ones
+    try:
+        audio_file.add_tags()
+    except mutagen_id3.ID3NoHeaderError:
+        pass
+    
+    # Set basic metadata
+    if tags['title']:
+        audio_file.tags.add(mutagen_id3.TIT2(encoding=3, text=tags['title']))  # Title
+    
+    if tags['artist']:
+        audio_file.tags.add(mutagen_id3.TPE1(encoding=3, text=tags['artist']))  # Artist
+        audio_file.tags.add(mutagen_id3.TPE2(encoding=3, text=tags['artist']))  # Album Artist
+    
+    if tags['album']:
+        audio_file.tags.add(mutagen_id3.TALB(encoding=3, text=tags['album']))  # Album
+    
+    if tags['year']:
+        audio_file.tags.add(mutagen_id3.TDRC(encoding=3, text=tags['year']))  # Year
+    
+    if tags['genre']:
+        audio_file.tags.add(mutagen_id3.TCON(encoding=3, text=tags['genre']))  # Genre
+    
+    # Add track number (default to 1)
+    audio_file.tags.add(mutagen_id3.TRCK(encoding=3, text="1"))
+    
+    # Add thumbnail as album art if available
+    if thumbnail_data:
+        audio_file.tags.add(mutagen_id3.APIC(
+            encoding=3,
+            mime=thumbnail_mime,
+            type=3,  # Cover (front)
+            desc='Cover',
+            data=thumbnail_data
+        ))
+    
+    # Save the changes
+    audio_file.save()
+
+def write_mp4_tags(file_path, tags, thumbnail_data=None, thumbnail_mime='image/jpeg'):
+    audio_file = mutagen_mp4.MP4(file_path)
+    if audio_file.tags is None:
+        audio_file.add_tags()
+
+    atoms = {'\xa9nam': tags['title'], '\xa9ART': tags['artist'], 'aART': tags['artist'],
+             '\xa9alb': tags['album'], '\xa9day': tags['year'], '\xa9gen': tags['genre']}
+    for atom, value in atoms.items():
+        if value:
+            audio_file.tags[atom] = [value]
+    audio_file.tags['trkn'] = [(1, 0)]
+
+    if thumbnail_data:
+        image_format = (mutagen_mp4.MP4Cover.FORMAT_PNG if thumbnail_mime == 'image/png'
+                        else mutagen_mp4.MP4Cover.FORMAT_JPEG)
+        audio_file.tags['covr'] = [mutagen_mp4.MP4Cover(thumbnail_data, imageformat=image_format)]
+
+    audio_file.save()
+
+def write_vorbis_tags(file_path, tags, thumbnail_data=None, thumbnail_mime='image/jpeg'):
+    audio_file = mutagen.File(file_path)
+    if audio_file is None:
+        raise ValueError("Unsupported audio file")
+    if audio_file.tags is None:
+        audio_file.add_tags()
+
+    comments = {'title': tags['title'], 'artist': tags['artist'], 'albumartist': tags['artist'],
+                'album': tags['album'], 'date': tags['year'], 'genre': tags['genre']}
+    for name, value in comments.items():
+        if value:
+            audio_file.tags[name] = [value]
+    audio_file.tags['tracknumber'] = ['1']
+
+    if thumbnail_data:
+        # Ogg has no picture frame; covers are a base64 FLAC picture block
+        picture = mutagen_flac.Picture()
+        picture.type = 3  # Cover (front)
+        picture.mime = thumbnail_mime
+        picture.desc = 'Cover'
+        picture.data = thumbnail_data
+        audio_file.tags['metadata_block_picture'] = [base64.b64encode(picture.write()).decode('ascii')]
+
+    audio_file.save()
+
 def determine_genre(title, description):
     """
     Try to determine genre based on title and description
@@ -214,44 +659,1482 @@ def determine_genre(title, description):
     else:
         return 'Music'  # Default genre
 
+# --- Job Queue ---
+def new_job(job_id, kind, title='', target=None, args=(), priority=None):
+    """
+    Build the status record of a freshly queued job
+    """
+    job = dict(IDLE_STATUS)
+    job.update({
+        'job_id': job_id,
+        'kind': kind,
+        'state': 'queued',
+        'message': 'Waiting in queue...',
+        'title': title or '',
+        'created_at': time.time(),
+        'finished_at': None,
+        'result': None,
+        '_done': threading.Event(),
+        # Bumped on every update; SSE streams wait on _changed for a new version
+        '_version': 0,
+        '_changed': threading.Condition(jobs_lock),
+        # What to run, kept so a paused job can be queued again
+        '_target': target,
+        '_args': tuple(args),
+        '_priority': app.config['DEFAULT_JOB_PRIORITY'] if priority is None else priority,
+        # Batch job this job is an item of (see download_playlist)
+        '_parent': None,
+        # Bytes the job is expected to write, reserved by the storage manager while it runs
+        '_estimated_size': None,
+        # Set by cancel_job; running jobs stop at their next progress callback (or are killed)
+        '_cancelled': False,
+        # Inside a job process: JobUpdatePipe forwarding updates to the web process that owns the job
+        '_pipe': None,
+    })
+    return job
+
+def job_snapshot(job):
+    """
+    Public view of a job (internal keys start with an underscore)
+    """
+    with jobs_lock:
+        # Nested values (playlist items, results) are copied so they can be serialized outside the lock
+        return {key: copy.deepcopy(value) if isinstance(value, (list, dict)) else value
+                for key, value in job.items() if not key.startswith('_')}
+
+def update_job(job, **fields):
+    with jobs_lock:
+        job.update(fields)
+        job['_version'] += 1
+        job['_changed'].notify_all()
+    if job['_pipe'] is not None:
+        job['_pipe'].send(fields)
+    else:
+        # Other workers must see state changes right away; progress can wait for the next batch
+        publish_job(job, immediate=bool(JOB_STATE_IMMEDIATE_FIELDS.intersection(fields)))
+
+def job_is_active(job):
+    return job['finished_at'] is None
+
+def get_job(job_id):
+    with jobs_lock:
+        return jobs.get(job_id)
+
+def get_latest_job():
+    """
+    Most recently created job, used when a client does not send a job_id
+    """
+    with jobs_lock:
+        top_level = [job for job in jobs.values() if job['_parent'] is None]
+        if not top_level:
+            return None
+        return max(top_level, key=lambda job: job['created_at'])
+
+def prune_jobs():
+    """
+    Forget finished jobs older than JOB_RETENTION_SECONDS (caller holds jobs_lock)
+    """
+    cutoff = time.time() - app.config['JOB_RETENTION_SECONDS']
+    for job_id in [job_id for job_id, job in jobs.items()
+                   if job['finished_at'] and job['finished_at'] < cutoff]:
+        del jobs[job_id]
+        bandwidth.forget(job_id)
+
+def job_manifest_path(job_id):
+    return os.path.join(app.config['JOB_MANIFEST_FOLDER'], f'{job_id}.json')
+
+def save_job_manifest(job):
+    """
+    Persist what is needed to resume an unfinished job after a restart.
+    The partial data itself lives in yt-dlp's .part/.ytdl files.
+    """
+    if job['_parent'] is not None:
+        return  # playlist items are queued again by their batch
+    try:
+        os.makedirs(app.config['JOB_MANIFEST_FOLDER'], exist_ok=True)
+        with jobs_lock:
+            manifest = {
+                'job_id': job['job_id'],
+                'kind': job['kind'],
+                'title': job['title'],
+                'state': job['state'],
+                'is_paused': job['is_paused'],
+                'progress': job['progress'],
+                'created_at': job['created_at'],
+                'priority': job['_priority'],
+                'target': job['_target'].__name__,
+                'args': list(job['_args']),
+            }
+        path = job_manifest_path(job['job_id'])
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+    except (OSError, TypeError) as e:
+        print(f"⚠️ Could not save manifest for job {job['job_id']}: {e}")
+
+def remove_job_manifest(job):
+    try:
+        os.remove(job_manifest_path(job['job_id']))
+    except OSError:
+        pass
+
+def restore_jobs():
+    """
+    Re-register jobs left unfinished by a previous run. Queued and running
+    jobs are queued again (yt-dlp continues from the .part files); paused
+    jobs wait for the user to resume them.
+    """
+    global _jobs_restored
+    with jobs_lock:
+        if _jobs_restored:
+            return
+        _jobs_restored = True
+
+    folder = app.config['JOB_MANIFEST_FOLDER']
+    if not os.path.isdir(folder):
+        return
+    for name in os.listdir(folder):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(folder, name)
+        claimed = f'{path}.{os.getpid()}.restoring'
+        try:
+            # Only one process (e.g. gunicorn worker) gets to restore each job
+            os.rename(path, claimed)
+            with open(claimed, 'r') as f:
+                manifest = json.load(f)
+            os.remove(claimed)
+        except (OSError, ValueError):
+            continue
+
+        target = globals().get(manifest['target'])
+        if not callable(target):
+            continue
+        job = new_job(manifest['job_id'], manifest['kind'], manifest['title'],
+                      target, manifest['args'], manifest['priority'])
+        job.update(created_at=manifest['created_at'], progress=manifest['progress'])
+        with jobs_lock:
+            jobs[job['job_id']] = job
+        publish_job(job, immediate=True)  # this process is the job's owner now
+        if manifest['state'] == 'paused' or manifest['is_paused']:
+            update_job(job, state='paused', is_paused=True, message='Download paused')
+            save_job_manifest(job)
+        else:
+            enqueue_job(job)
+        print(f"♻️ Restored job {job['job_id']} ({manifest['state']})")
+
+def park_for_storage(entry):
+    """
+    Hold a queue entry until a running job releases its space (or
+    STORAGE_RETRY_SECONDS pass), without keeping a worker busy
+    """
+    global _storage_retry_timer
+    with jobs_lock:
+        _storage_waiting.append(entry)
+        if _storage_retry_timer is None:
+            _storage_retry_timer = threading.Timer(app.config['STORAGE_RETRY_SECONDS'], requeue_storage_waiting)
+            _storage_retry_timer.daemon = True
+            _storage_retry_timer.start()
+
+def requeue_storage_waiting():
+    global _storage_retry_timer
+    with jobs_lock:
+        waiting = list(_storage_waiting)
+        _storage_waiting.clear()
+        if _storage_retry_timer is not None:
+            _storage_retry_timer.cancel()
+            _storage_retry_timer = None
+    # Original sequence numbers: they stay ahead of later jobs of the same priority
+    for entry in waiting:
+        job_queue.put(entry)
+
+def job_worker():
+    while True:
+        entry = job_queue.get()
+        _, _, job_id, target, args = entry
+        job = get_job(job_id)
+        if job is None or job['state'] != 'queued':
+            job_queue.task_done()
+            continue
+        parent = job['_parent']
+        if parent is not None and parent['is_paused']:
+            # Held back with the rest of its paused playlist; resuming the batch queues it again
+            update_job(job, state='paused', message='Download paused')
+            settle_job(job)
+            job_queue.task_done()
+            continue
+        verdict = storage.admit(job)
+        if verdict == 'wait':
+            # Space is promised to running jobs; look again once some have finished
+            update_job(job, message='Waiting for storage space...')
+            park_for_storage(entry)
+            job_queue.task_done()
+            continue
+        detached = False
+        try:
+            update_job(job, state='running', is_downloading=True, message='Starting download...')
+            if verdict == 'reject':
+                raise IOError('Not enough storage space for this download')
+            save_job_manifest(job)
+            run_job_target(job, target, args)
+        except JobDetached:
+            detached = True
+        except DownloadCancelled:
+            update_job(job, state='cancelled', message='Download cancelled')
+        except DownloadPaused:
+            update_job(job, state='paused', message='Download paused')
+        except Exception as e:
+            print(f"❌ Job {job_id} failed: {e}")
+            update_job(job, state='error', message=f"Error: {str(e)}")
+        finally:
+            if not detached:
+                settle_job(job)
+            storage.release(job)
+            storage.enforce()
+            requeue_storage_waiting()
+            job_queue.task_done()
+
+def settle_job(job):
+    """
+    Record where a job stopped once no worker runs it any more
+    """
+    if job['state'] == 'paused':
+        # Keeps its partial data; toggle_pause queues it again
+        update_job(job, is_downloading=False)
+        if claim_paused(job):
+            # Resumed while its worker was letting go (a playlist item keeps its place in the batch)
+            enqueue_job(job)
+            return
+        save_job_manifest(job)
+    else:
+        # One final update so observers never see a half-finished job
+        state = job['state']
+        if state == 'running':
+            state = 'cancelled' if job['_cancelled'] else 'finished'
+        update_job(job, state=state, is_downloading=False, finished_at=time.time())
+        remove_job_manifest(job)
+        job['_done'].set()
+    if job['_parent'] is not None:
+        settle_playlist(job['_parent'], job)
+
+def start_job_workers():
+    """
+    Start the worker pool on first use (after gunicorn has forked)
+    """
+    with jobs_lock:
+        while len(_job_workers) < app.config['MAX_CONCURRENT_DOWNLOADS']:
+            worker = threading.Thread(target=job_worker, daemon=True,
+                                      name=f'download-worker-{len(_job_workers) + 1}')
+            worker.start()
+            _job_workers.append(worker)
+
+def enqueue_job(job):
+    update_job(job, state='queued', is_paused=False, message='Waiting in queue...')
+    save_job_manifest(job)
+    start_job_workers()
+    job_queue.put((job['_priority'], next(_job_sequence), job['job_id'], job['_target'], job['_args']))
+
+def submit_job(target, args=(), kind='video', title='', priority=None, estimated_size=None):
+    """
+    Queue target(job, *args) to run on the worker pool and return the job
+    """
+    job = new_job(uuid.uuid4().hex, kind, title, target, args, priority)
+    job['_estimated_size'] = estimated_size
+    with jobs_lock:
+        prune_jobs()
+        jobs[job['job_id']] = job
+    publish_job(job, immediate=True)
+    enqueue_job(job)
+    return job
+
+def wait_if_paused(job):
+    """
+    Called from progress callbacks: stop a cancelled job and hold the
+    transfer while the job is paused. After PAUSE_PARK_SECONDS the worker
+    is given back by raising DownloadPaused; partial files stay on disk
+    for the resume.
+    """
+    if job['_cancelled']:
+        raise DownloadCancelled()
+    if not job['is_paused']:
+        return
+    update_job(job, message='Download paused')
+    with jobs_lock:
+        resumed = job['_changed'].wait_for(lambda: not job['is_paused'] or job['_cancelled'],
+                                           timeout=app.config['PAUSE_PARK_SECONDS'])
+    if job['_cancelled']:
+        raise DownloadCancelled()
+    if not resumed:
+        raise DownloadPaused()
+    update_job(job, message='Resuming download...')
+
+@app.before_request
+def restore_unfinished_jobs():
+    if not _jobs_restored:
+        restore_jobs()
+        download_index.prune()
+
+def finished_job(kind, title='', **fields):
+    """
+    Register a job that is already complete (nothing to queue)
+    """
+    job = new_job(uuid.uuid4().hex, kind, title)
+    job.update(fields, state='finished', progress=100, finished_at=time.time())
+    job['_done'].set()
+    with jobs_lock:
+        prune_jobs()
+        jobs[job['job_id']] = job
+    publish_job(job, immediate=True)
+    return job
+
+def get_request_priority(source):
+    """
+    Read an optional integer 'priority' field (lower runs first)
+    """
+    try:
+        return int(source.get('priority', app.config['DEFAULT_JOB_PRIORITY']))
+    except (TypeError, ValueError):
+        return app.config['DEFAULT_JOB_PRIORITY']
+
+def get_request_job(source):
+    """
+    Resolve the job named by 'job_id', falling back to the latest job.
+    None when the job runs in another worker process (see get_remote_status).
+    """
+    job_id = source.get('job_id') or job_state.latest_id()
+    if job_id:
+        return get_job(job_id)
+    return get_latest_job()
+
+def get_remote_status(source):
+    """
+    Status of the requested job from the shared backend, for jobs owned by another worker
+    """
+    job_id = source.get('job_id') or job_state.latest_id()
+    return job_state.read(job_id) if job_id else None
+
+def claim_paused(job):
+    """
+    Take a paused job to queue it again: True once neither a pause (its own
+    or its playlist's) nor a worker still letting go holds it. Resumes and
+    workers race for it; only one caller gets True.
+    """
+    parent = job['_parent']
+    with jobs_lock:
+        if (job['state'] != 'paused' or job['is_downloading'] or job['is_paused']
+                or (parent is not None and parent['is_paused'])):
+            return False
+        job['state'] = 'queued'
+        return True
+
+def requeue_paused(job):
+    """
+    Queue a job taken by claim_paused; playlist items go back in line in their batch
+    """
+    parent = job['_parent']
+    if parent is None:
+        enqueue_job(job)
+        return
+    update_job(job, state='queued', message='Waiting in queue...')
+    with jobs_lock:
+        parent['_batch']['backlog'].appendleft(job)
+    feed_playlist(parent)
+
+def set_job_paused(job, paused):
+    update_job(job, is_paused=paused)
+    if not paused and claim_paused(job):
+        # The worker was given back; queue the job again to continue from its partial data
+        requeue_paused(job)
+    elif job_is_active(job):
+        save_job_manifest(job)
+        if not paused and job.get('_batch'):
+            resume_playlist(job)
+
+def cancel_job(job):
+    """
+    Stop job for good; False when it already finished. Jobs waiting in the
+    queue or parked by a pause end right away, running ones at their next
+    progress callback (or, in a job process, by killing it). Partial files
+    are left to the storage manager's orphan sweep.
+    """
+    with jobs_lock:
+        if job['finished_at'] is not None:
+            return False
+        job['_cancelled'] = True
+        job['_changed'].notify_all()  # wakes a transfer held by wait_if_paused
+    if job['state'] in ('queued', 'paused'):
+        # No worker holds it; the queue entry is skipped since the job is no longer queued
+        update_job(job, state='cancelled', is_paused=False, message='Download cancelled')
+        settle_job(job)
+    else:
+        update_job(job, message='Cancelling...')
+    for child in list((job.get('_children') or {}).values()):
+        cancel_job(child)
+    return True
+
+# --- Job State Backend ---
+def create_job_state_backend():
+    if app.config['JOB_STATE_BACKEND'] == 'sqlite':
+        return SQLiteJobState(app.config['JOB_STATE_PATH'])
+    return LocalJobState()
+
+job_state = create_job_state_backend()
+JOB_STATE_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+_dirty_jobs = {}  # job_id -> job waiting for the next batched write
+_dirty_lock = threading.Lock()
+_job_state_thread = None
+
+def shared_snapshot(job):
+    snapshot = job_snapshot(job)
+    snapshot['parent'] = job['_parent']['job_id'] if job['_parent'] else None
+    snapshot['_version'] = job['_version']
+    return snapshot
+
+def publish_job(job, immediate=False):
+    """
+    Make job's status visible to other workers: now, or with the next batch
+    """
+    if not job_state.shared:
+        return
+    if immediate:
+        with _dirty_lock:
+            _dirty_jobs.pop(job['job_id'], None)
+        try:
+            job_state.write([shared_snapshot(job)], current_job_state_owner())
+        except sqlite3.Error as e:
+            print(f"⚠️ Could not publish job {job['job_id']}: {e}")
+    else:
+        with _dirty_lock:
+            _dirty_jobs[job['job_id']] = job
+    start_job_state_sync()
+
+def current_job_state_owner():
+    # Recomputed after fork (gunicorn --preload) so every worker has its own identity
+    global JOB_STATE_OWNER
+    if not JOB_STATE_OWNER.endswith(f':{os.getpid()}'):
+        JOB_STATE_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+    return JOB_STATE_OWNER
+
+def flush_job_state():
+    with _dirty_lock:
+        dirty = list(_dirty_jobs.values())
+        _dirty_jobs.clear()
+    job_state.write([shared_snapshot(job) for job in dirty], current_job_state_owner())
+
+def job_state_sync():
+    """
+    Owner loop: write batched progress, apply pause and cancel requests
+    from other workers and drop expired jobs from the backend
+    """
+    last_prune = 0
+    while True:
+        time.sleep(app.config['JOB_STATE_FLUSH_INTERVAL'])
+        try:
+            flush_job_state()
+            for job_id, paused in job_state.take_pause_requests(current_job_state_owner()).items():
+                job = get_job(job_id)
+                if job is not None and job['is_paused'] != paused:
+                    set_job_paused(job, paused)
+            for job_id in job_state.take_cancel_requests(current_job_state_owner()):
+                job = get_job(job_id)
+                if job is not None:
+                    # Kills the job process (or stops the thread at its next progress callback)
+                    cancel_job(job)
+            if time.time() - last_prune > 60:
+                job_state.prune(time.time() - app.config['JOB_RETENTION_SECONDS'])
+                last_prune = time.time()
+        except sqlite3.Error as e:
+            print(f"⚠️ Job state sync failed: {e}")
+
+def start_job_state_sync():
+    """
+    Start the sync thread on first use (after gunicorn has forked)
+    """
+    global _job_state_thread
+    if _job_state_thread is not None and _job_state_thread.is_alive():
+        return
+    with _dirty_lock:
+        if _job_state_thread is None or not _job_state_thread.is_alive():
+            _job_state_thread = threading.Thread(target=job_state_sync, daemon=True, name='job-state-sync')
+            _job_state_thread.start()
+
+# --- Info Cache ---
+# yt-dlp options that affect what extract_info returns; downloads reuse the result
+INFO_EXTRACT_OPTS = {
+    'quiet': True,
+    'noplaylist': True,
+    'extract_flat': 'in_playlist',
+    'user_agent': COMMON_USER_AGENT,
+    'nocheckcertificate': True,
+}
+
+# Query parameters that only track where a link was shared from
+TRACKING_PARAMS = {'si', 'feature', 'fbclid', 'igshid', 'igsh', 'is_from_webapp', 'sender_device', 'pp'}
+
+class InfoCache:
+    """
+    LRU cache of extracted info dicts with a TTL; concurrent misses for the
+    same key share a single extraction. ttl_for(info) may shorten the TTL of
+    an entry (e.g. when the info holds URLs that expire sooner).
+    """
+    def __init__(self, max_entries, ttl, ttl_for=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.ttl_for = ttl_for
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, info)
+        self._inflight = {}  # key -> {'event', 'info', 'error'}
+        self._lock = threading.Lock()
+
+    def get_or_extract(self, key, extract):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(key, None)
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = {'event': threading.Event(), 'info': None, 'error': None}
+                self._inflight[key] = flight
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if not leader:
+            flight['event'].wait()
+            if flight['error'] is not None:
+                raise flight['error']
+            return flight['info']
+
+        try:
+            info = extract()
+            flight['info'] = info
+            if info:
+                self.put(key, info)
+            return info
+        except Exception as e:
+            flight['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight['event'].set()
+
+    def put(self, key, info):
+        ttl = self.ttl if self.ttl_for is None else min(self.ttl, self.ttl_for(info))
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, info)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def peek(self, key):
+        """
+        Fresh (expires_at, info) entry for key without extracting, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry if entry and entry[0] > time.time() else None
+
+    def seed(self, key, entry):
+        """
+        Add an entry taken from peek() in another process, keeping its expiry
+        """
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'inflight': len(self._inflight),
+                    'hits': self.hits, 'misses': self.misses}
+
+info_cache = InfoCache(app.config['INFO_CACHE_SIZE'], app.config['INFO_CACHE_TTL'])
+
+def normalize_url(url):
+    """
+    Canonical form of a media URL for cache keys
+    """
+    parts = urlsplit(url.strip())
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if key not in TRACKING_PARAMS and not key.startswith('utm_'))
+    netloc = parts.netloc.lower()
+    if netloc.startswith('m.') or netloc.startswith('www.'):
+        netloc = netloc.split('.', 1)[1]
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme.lower() or 'https', netloc, path, urlencode(query), ''))
+
+def info_cache_key(url, ydl_opts):
+    return (normalize_url(url), tuple(sorted((key, repr(value)) for key, value in ydl_opts.items())))
+
+def extract_video_info(url, extra_opts=None):
+    """
+    Extract (or reuse) the yt-dlp info dict for url. Returns a private copy
+    the caller may hand to YoutubeDL.process_ie_result.
+    """
+    ydl_opts = dict(INFO_EXTRACT_OPTS, **(extra_opts or {}))
+
+    @timed_stage('extraction')
+    def extract():
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            return ydl.extract_info(url, download=False)
+
+    info = info_cache.get_or_extract(info_cache_key(url, ydl_opts), extract)
+    return copy.deepcopy(info)
+
+# --- Format Selection ---
+# Containers that go into merge_output_format='mp4' without re-muxing surprises
+MP4_VIDEO_EXTS = {'mp4', 'm4v'}
+MP4_AUDIO_EXTS = {'m4a', 'mp4'}
+
+def format_height(f):
+    return f.get('height') or 0
+
+def estimate_format_size(f, duration):
+    """
+    Bytes for a format: exact size, yt-dlp's estimate, or bitrate x duration
+    """
+    size = f.get('filesize') or f.get('filesize_approx')
+    if not size and f.get('tbr') and duration:
+        size = int(f['tbr'] * 1000 / 8 * duration)
+    return size
+
+def usable_formats(info):
+    # No storyboards, manifests-of-images or DRM-protected formats
+    return [f for f in info.get('formats') or []
+            if f.get('format_id') and not f.get('has_drm') and f.get('ext') != 'mhtml'
+            and not (f.get('vcodec') == 'none' and f.get('acodec') == 'none')]
+
+def best_audio_format(formats, preferred_exts=MP4_AUDIO_EXTS, preferred_codec=None):
+    audio = [f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') != 'none']
+    if not audio:
+        return None
+    return max(audio, key=lambda f: (
+        bool(preferred_codec) and (f.get('acodec') or '').startswith(preferred_codec),
+        f.get('ext') in preferred_exts,
+        f.get('abr') or f.get('tbr') or 0,
+    ))
+
+def select_format(info, mode, quality, audio_format='mp3'):
+    """
+    Choose exact yt-dlp format IDs from an extracted info dict.
+
+    Video: the tallest video at or under the quality cap. A pre-muxed
+    (progressive) format wins when it is as tall as the best separate
+    video stream, so no merge is needed; otherwise MP4/M4A streams are
+    preferred so the merge into mp4 is a plain stream copy.
+    Audio: the audio-only stream matching audio_format.
+
+    Returns None when the info has no format list (yt-dlp then picks).
+    """
+    formats = usable_formats(info)
+    if not formats:
+        return None
+    duration = info.get('duration')
+
+    if mode == 'Audio':
+        preferred_codec = 'opus' if audio_format == 'opus' else ('mp4a' if audio_format == 'm4a' else None)
+        audio = best_audio_format(formats, preferred_codec=preferred_codec)
+        if audio is None:
+            return None
+        return {'format': audio['format_id'], 'progressive': False, 'height': None,
+                'ext': audio.get('ext'), 'vcodec': None, 'acodec': audio.get('acodec'),
+                'estimated_size': estimate_format_size(audio, duration)}
+
+    cap = int(quality) if quality and str(quality).isdigit() else None
+    # Formats with unknown codecs (e.g. direct links) are treated as progressive
+    progressive = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') != 'none']
+    video_only = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') == 'none']
+
+    def within_cap(candidates):
+        if cap is None:
+            return candidates
+        capped = [f for f in candidates if format_height(f) <= cap]
+        # Nothing small enough: settle for the smallest there is
+        if not capped and candidates:
+            smallest = min(format_height(f) for f in candidates)
+            capped = [f for f in candidates if format_height(f) == smallest]
+        return capped
+
+    def rank(f):
+        return (format_height(f), f.get('ext') in MP4_VIDEO_EXTS, f.get('tbr') or 0)
+
+    best_progressive = max(within_cap(progressive), key=rank, default=None)
+    best_video = max(within_cap(video_only), key=rank, default=None)
+    audio = best_audio_format(formats)
+
+    if best_progressive and (best_video is None or audio is None or
+                             format_height(best_progressive) >= format_height(best_video)):
+        return {'format': best_progressive['format_id'], 'progressive': True,
+                'height': best_progressive.get('height'), 'ext': best_progressive.get('ext'),
+                'vcodec': best_progressive.get('vcodec'), 'acodec': best_progressive.get('acodec'),
+                'estimated_size': estimate_format_size(best_progressive, duration)}
+    if best_video is None or audio is None:
+        return None
+
+    sizes = [estimate_format_size(best_video, duration), estimate_format_size(audio, duration)]
+    return {'format': f"{best_video['format_id']}+{audio['format_id']}", 'progressive': False,
+            'height': best_video.get('height'), 'ext': 'mp4',
+            'vcodec': best_video.get('vcodec'), 'acodec': audio.get('acodec'),
+            'estimated_size': sum(sizes) if all(sizes) else None}
+
+# --- HTTP Client ---
+# Counters per host: requests, errors (exceptions and 4xx/5xx), retries
+http_stats = {}
+http_stats_lock = threading.Lock()
+_http_adapter = None
+_http_adapter_generation = 0  # bumped when the pool settings change at runtime
+_http_local = threading.local()
+
+def record_http_event(host, event):
+    with http_stats_lock:
+        host_stats = http_stats.setdefault(host or 'unknown', {'requests': 0, 'errors': 0, 'retries': 0})
+        host_stats[event] += 1
+
+def get_http_adapter():
+    """
+    The adapter owns the keep-alive pools, so it is shared by every session.
+    pool_block makes callers wait instead of opening more than
+    HTTP_MAX_CONNECTIONS_PER_HOST connections to one host, for at most
+    HTTP_POOL_TIMEOUT; then the request fails with a ConnectionError.
+    """
+    global _http_adapter
+    if _http_adapter is None:
+        with http_stats_lock:
+            if _http_adapter is None:
+                # Defined here so urllib3 is only imported once HTTP is needed
+                class CountingRetry(urllib3_retry.Retry):
+                    """
+                    urllib3 Retry that records every retry in http_stats
+                    """
+                    def increment(self, method=None, url=None, response=None, error=None,
+                                  _pool=None, _stacktrace=None):
+                        record_http_event(getattr(_pool, 'host', None), 'retries')
+                        return super().increment(method, url, response=response, error=error,
+                                                 _pool=_pool, _stacktrace=_stacktrace)
+
+                def bounded_pool(base):
+                    class BoundedPool(base):
+                        """
+                        Pool whose blocking wait for a free connection ends after
+                        HTTP_POOL_TIMEOUT (requests never passes urllib3 a pool timeout)
+                        """
+                        def _get_conn(self, timeout=None):
+                            if timeout is None:
+                                timeout = app.config['HTTP_POOL_TIMEOUT']
+                            return super()._get_conn(timeout=timeout)
+                    return BoundedPool
+
+                class BoundedPoolAdapter(requests.adapters.HTTPAdapter):
+                    def init_poolmanager(self, *args, **kwargs):
+                        super().init_poolmanager(*args, **kwargs)
+                        self.poolmanager.pool_classes_by_scheme = {
+                            'http': bounded_pool(urllib3_pool.HTTPConnectionPool),
+                            'https': bounded_pool(urllib3_pool.HTTPSConnectionPool),
+                        }
+
+                    def send(self, request, **kwargs):
+                        try:
+                            return super().send(request, **kwargs)
+                        except urllib3_exceptions.EmptyPoolError as e:
+                            # requests passes this one through as is; callers catch RequestException
+                            raise requests.exceptions.ConnectionError(e, request=request)
+
+                retry = CountingRetry(
+                    total=app.config['HTTP_RETRIES'],
+                    backoff_factor=app.config['HTTP_RETRY_BACKOFF'],
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset({'GET', 'HEAD'}),
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                _http_adapter = BoundedPoolAdapter(
+                    pool_connections=app.config['HTTP_MAX_HOST_POOLS'],
+                    pool_maxsize=app.config['HTTP_MAX_CONNECTIONS_PER_HOST'],
+                    pool_block=True,
+                    max_retries=retry,
+                )
+    return _http_adapter
+
+def reset_http_adapter():
+    """
+    Build a new adapter with the current pool settings on next use. Requests
+    already in flight finish on the old pools.
+    """
+    global _http_adapter, _http_adapter_generation
+    with http_stats_lock:
+        _http_adapter = None
+        _http_adapter_generation += 1
+
+def get_http_session():
+    """
+    Per-thread Session (cookies are not thread-safe) on the shared adapter
+    """
+    session = getattr(_http_local, 'session', None)
+    if session is None or _http_local.generation != _http_adapter_generation:
+        session = requests.Session()
+        session.headers['User-Agent'] = COMMON_USER_AGENT
+        _http_local.generation = _http_adapter_generation
+        adapter = get_http_adapter()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _http_local.session = session
+    return session
+
+def http_request(method, url, **kwargs):
+    """
+    Outbound request through the shared pools with default timeouts
+    """
+    kwargs.setdefault('timeout', (app.config['HTTP_CONNECT_TIMEOUT'], app.config['HTTP_READ_TIMEOUT']))
+    host = urlsplit(url).hostname
+    record_http_event(host, 'requests')
+    try:
+        response = get_http_session().request(method, url, **kwargs)
+    except requests.exceptions.RequestException:
+        record_http_event(host, 'errors')
+        raise
+    if response.status_code >= 400:
+        record_http_event(host, 'errors')
+    return response
+
+def http_get(url, **kwargs):
+    return http_request('GET', url, **kwargs)
+
+def close_after(response, chunks):
+    """
+    Yield chunks and always hand the connection back to the pool, even
+    when the client disconnects mid-stream
+    """
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        response.close()
+
+def get_http_pool_stats():
+    pools = []
+    if _http_adapter is not None:
+        pool_manager = _http_adapter.poolmanager
+        for key in list(pool_manager.pools.keys()):
+            pool = pool_manager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                'host': f"{pool.scheme}://{pool.host}:{pool.port}",
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle_connections': pool.pool.qsize() if pool.pool else 0,
+                'max_connections': pool_manager.connection_pool_kw.get('maxsize'),
+            })
+    with http_stats_lock:
+        hosts = {host: dict(counts) for host, counts in http_stats.items()}
+    return {'pools': pools, 'hosts': hosts}
+
+# --- Bandwidth Scheduler ---
+class TokenBucket:
+    """
+    Byte-rate limiter refilled continuously at `rate` bytes/s with one second
+    of burst; a rate of 0 means unlimited. A take may overdraw the bucket,
+    the caller then waits until it is back at zero, so chunk sizes larger
+    than the rate still work.
+    """
+    def __init__(self, rate=0):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate
+            self._tokens = min(self._tokens, rate)
+
+    def reserve(self, amount):
+        """
+        Take amount bytes and return how many seconds to wait before using them
+        """
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+class BandwidthScheduler:
+    """
+    Shares BANDWIDTH_LIMIT and FRAGMENT_CONCURRENCY between the jobs that are
+    currently transferring. Shares are max-min fair: a job capped below its
+    share (JOB_BANDWIDTH_LIMIT or a per-job override) leaves the rest to the
+    others. Our own transfer loops take from the buckets in consume(); yt-dlp
+    downloads get their share pushed into the live YoutubeDL params
+    (ratelimit, concurrent_fragment_downloads), which yt-dlp re-reads while
+    downloading.
+    """
+    def __init__(self):
+        self.global_bucket = TokenBucket(app.config['BANDWIDTH_LIMIT'])
+        self._transfers = {}  # job_id -> {'bucket', 'ydl_params', 'depth', 'rate', 'fragments'}
+        self._overrides = {}  # job_id -> {'bandwidth_limit', 'fragment_concurrency'}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transfer(self, job, ydl_params=None):
+        """
+        Count job as active for the duration of the block. Nested blocks for
+        the same job share one entry.
+        """
+        job_id = job['job_id'] if job else None
+        if job_id is None:
+            yield
+            return
+        with self._lock:
+            entry = self._transfers.setdefault(job_id, {'bucket': TokenBucket(), 'ydl_params': None, 'depth': 0,
+                                                        'rate': 0, 'fragments': None})
+            entry['depth'] += 1
+            if ydl_params is not None:
+                entry['ydl_params'] = ydl_params
+            self._rebalance()
+        try:
+            yield
+        finally:
+            with self._lock:
+                entry['depth'] -= 1
+                if ydl_params is not None:
+                    entry['ydl_params'] = None
+                if not entry['depth']:
+                    del self._transfers[job_id]
+                self._rebalance()
+
+    def consume(self, amount, job=None):
+        """
+        Block until amount bytes fit in the global bucket and the job's bucket
+        """
+        wait = self.global_bucket.reserve(amount)
+        entry = self._transfers.get(job['job_id']) if job else None
+        if entry is not None:
+            wait = max(wait, entry['bucket'].reserve(amount))
+        if wait:
+            time.sleep(wait)
+
+    def set_override(self, job_id, **limits):
+        """
+        Per-job bandwidth_limit / fragment_concurrency; None removes the override
+        """
+        with self._lock:
+            overrides = self._overrides.setdefault(job_id, {})
+            for key, value in limits.items():
+                if value is None:
+                    overrides.pop(key, None)
+                else:
+                    overrides[key] = value
+            if not overrides:
+                del self._overrides[job_id]
+            self._rebalance()
+
+    def forget(self, job_id):
+        with self._lock:
+            self._overrides.pop(job_id, None)
+
+    def rebalance(self):
+        with self._lock:
+            self._rebalance()
+
+    def _rebalance(self):
+        # Caller holds self._lock
+        global_rate = app.config['BANDWIDTH_LIMIT']
+        self.global_bucket.set_rate(global_rate)
+
+        def cap(job_id):
+            limits = [limit for limit in (app.config['JOB_BANDWIDTH_LIMIT'],
+                                          self._overrides.get(job_id, {}).get('bandwidth_limit')) if limit]
+            return min(limits) if limits else float('inf')
+
+        # Water-filling: the lowest caps are served first, what they leave is split among the rest
+        remaining = global_rate or float('inf')
+        ordered = sorted(self._transfers, key=cap)
+        for index, job_id in enumerate(ordered):
+            rate = min(cap(job_id), remaining / (len(ordered) - index))
+            remaining -= rate
+            entry = self._transfers[job_id]
+            entry['rate'] = 0 if rate == float('inf') else int(rate)
+            entry['bucket'].set_rate(entry['rate'])
+
+        ydl_jobs = [job_id for job_id, entry in self._transfers.items() if entry['ydl_params'] is not None]
+        fair_fragments = max(1, app.config['FRAGMENT_CONCURRENCY'] // max(len(ydl_jobs), 1))
+        for job_id in ydl_jobs:
+            entry = self._transfers[job_id]
+            entry['fragments'] = self._overrides.get(job_id, {}).get('fragment_concurrency') or fair_fragments
+            entry['ydl_params']['ratelimit'] = entry['rate'] or None
+            entry['ydl_params']['concurrent_fragment_downloads'] = entry['fragments']
+
+    def stats(self):
+        with self._lock:
+            return {
+                'bandwidth_limit': app.config['BANDWIDTH_LIMIT'],
+                'job_bandwidth_limit': app.config['JOB_BANDWIDTH_LIMIT'],
+                'fragment_concurrency': app.config['FRAGMENT_CONCURRENCY'],
+                'max_connections_per_host': app.config['HTTP_MAX_CONNECTIONS_PER_HOST'],
+                'active_jobs': {job_id: {'rate': entry['rate'], 'fragments': entry['fragments'],
+                                         'yt_dlp': entry['ydl_params'] is not None}
+                                for job_id, entry in self._transfers.items()},
+                'overrides': {job_id: dict(overrides) for job_id, overrides in self._overrides.items()},
+            }
+
+bandwidth = BandwidthScheduler()
+
+# --- Proxy Cache ---
+proxy_cache = ProxyCache(app.config['PROXY_CACHE_FOLDER'], app.config['PROXY_CACHE_MAX_BYTES'],
+                         app.config['PROXY_CACHE_DEFAULT_TTL'])
+
+def send_cached_file(meta, download_name=None):
+    """
+    Serve a cache entry with validators so browsers can revalidate (304)
+    """
+    response = send_file(meta['body_path'], mimetype=meta['content_type'],
+                         as_attachment=download_name is not None, download_name=download_name,
+                         conditional=True, etag=meta['digest'],
+                         last_modified=meta['stored_at'],
+                         max_age=max(0, round(meta['expires_at'] - time.time())))
+    return response
+
+@timed_stage('proxy')
+def serve_proxied_image(url, download_name=None):
+    """
+    Serve url through the disk cache, revalidating stale entries with
+    ETag/Last-Modified against the origin. The proxy stage is timed until
+    the response starts; the body then streams to the client.
+    """
+    meta = proxy_cache.lookup(url)
+    if meta and meta['expires_at'] > time.time():
+        proxy_cache.count('hits')
+        proxy_cache.touch(url)
+        return send_cached_file(meta, download_name)
+
+    resp = http_get(url, stream=True, headers=proxy_conditional_headers(meta))
+    if meta and resp.status_code == 304:
+        resp.close()
+        proxy_cache.count('revalidated')
+        meta['expires_at'] = time.time() + (proxy_cache.lifetime(resp.headers) or 0)
+        proxy_cache.save_meta(url, meta)
+        return send_cached_file(meta, download_name)
+
+    max_bytes = app.config['PROXY_MAX_BODY_BYTES']
+    headers, content_length = proxy_passthrough_headers(resp.headers, download_name)
+    if content_length is not None and content_length > max_bytes:
+        resp.close()
+        return f"Upstream body too large ({content_length} bytes)", 502
+    content_type = resp.headers.get('Content-Type', 'image/jpeg')
+
+    if resp.status_code != 200:
+        body = close_after(resp, stream_limited(resp, max_bytes))
+        return Response(body, resp.status_code, headers=headers, content_type=content_type)
+
+    proxy_cache.count('misses')
+    lifetime = proxy_cache.lifetime(resp.headers)
+    if lifetime is None:
+        response = Response(close_after(resp, stream_limited(resp, max_bytes)),
+                            headers=headers, content_type=content_type)
+        response.cache_control.no_store = True
+        return response
+
+    meta = new_proxy_meta(url, resp.headers, lifetime)
+    response = Response(close_after(resp, stream_into_cache(url, resp, meta, content_length)),
+                        headers=headers, content_type=content_type)
+    response.cache_control.public = True
+    response.cache_control.max_age = lifetime
+    return response
+
+def stream_limited(resp, max_bytes):
+    """
+    Yield the upstream body in bounded chunks. Going past max_bytes aborts
+    the response so a truncated body is never mistaken for a complete one.
+    """
+    sent = 0
+    for chunk in resp.iter_content(app.config['PROXY_CHUNK_SIZE']):
+        sent += len(chunk)
+        if sent > max_bytes:
+            raise IOError(f"Proxy body exceeded {max_bytes} bytes: {resp.url}")
+        bandwidth.consume(len(chunk))
+        yield chunk
+
+def stream_into_cache(url, resp, meta, content_length=None):
+    """
+    Send chunks to the client as they arrive while writing them to a temp
+    file; the entry is only committed if the whole body came through
+    """
+    tmp_path = proxy_cache.new_temp_path()
+    digest = hashlib.sha256()
+    received = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in stream_limited(resp, app.config['PROXY_MAX_BODY_BYTES']):
+                f.write(chunk)
+                digest.update(chunk)
+                received += len(chunk)
+                yield chunk
+        if content_length is None or received == content_length:
+            meta['digest'] = digest.hexdigest()[:32]
+            proxy_cache.store(url, tmp_path, meta)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+# --- Media Downloader ---
+media_downloader = MediaDownloader(app.config, http_get, bandwidth, record_transfer)
+
+# --- File Serving ---
+def read_file_range(f, length):
+    """
+    Yield length bytes from the current position of f in large blocks
+    """
+    try:
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(app.config['FILE_CHUNK_SIZE'], remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+def file_response_body(path, start, length, size):
+    f = open(path, 'rb')
+    f.seek(start)
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    # gunicorn's wrapper sendfile()s exactly Content-Length bytes from the
+    # current offset; other wrappers may read to EOF, so they only get
+    # responses that end at the end of the file
+    if file_wrapper and (start + length == size or
+                         request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn')):
+        return file_wrapper(f, app.config['FILE_CHUNK_SIZE'])
+    return read_file_range(f, length)
+
+def serve_download(path, filename):
+    """
+    Send a finished download as an attachment with Range/If-Range support,
+    or hand it to the front proxy when SENDFILE_BACKEND is set
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = f'{int(stat.st_mtime)}-{size}'
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    response = Response(mimetype=mimetype, direct_passthrough=True)
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.set_etag(etag)
+    response.last_modified = last_modified
+
+    backend = app.config['SENDFILE_BACKEND']
+    if backend == 'nginx':
+        # nginx does its own Range handling on the internal location
+        response.headers['X-Accel-Redirect'] = f"{app.config['SENDFILE_NGINX_PREFIX'].rstrip('/')}/{quote(filename)}"
+        return response
+    if backend == 'apache':
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+        return response
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response.status_code = 304
+        return response
+
+    start, length = 0, size
+    range_header = request.range
+    # A Range with a stale If-Range validator gets the whole file instead
+    if_range = request.if_range
+    range_valid = ((if_range.etag is None and if_range.date is None) or
+                   (if_range.etag is not None and if_range.etag == etag) or
+                   (if_range.date is not None and last_modified <= if_range.date))
+    if range_header and range_valid and len(range_header.ranges) == 1:
+        byte_range = range_header.range_for_length(size)
+        if byte_range is None:
+            response.status_code = 416
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+        start, stop = byte_range
+        length = stop - start
+        response.status_code = 206
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+    response.response = file_response_body(path, start, length, size)
+    response.content_length = length
+    return response
+
+# --- Download Index ---
+class DownloadIndex:
+    """
+    SQLite index of finished downloads keyed by (extractor, video_id, mode,
+    quality). Rows whose file was deleted or changed are dropped on lookup.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+        self._local = threading.local()  # sqlite3 connections are per thread
+
+    def _count(self, event):
+        with self._counter_lock:
+            setattr(self, event, getattr(self, event) + 1)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS downloads (
+                extractor TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                quality TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                checksum TEXT NOT NULL,
+                title TEXT,
+                created_at REAL NOT NULL,
+                last_hit_at REAL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (extractor, video_id, mode, quality))''')
+            conn.execute('CREATE INDEX IF NOT EXISTS downloads_path ON downloads (path)')
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, key):
+        """
+        Row for key if its file is still on disk and unchanged, else None
+        """
+        conn = self._connection()
+        row = conn.execute('SELECT * FROM downloads WHERE extractor=? AND video_id=? AND mode=? AND quality=?',
+                           key).fetchone()
+        if row is None:
+            self._count('misses')
+            return None
+
+        entry = dict(row)
+        if not self._still_valid(conn, entry):
+            self.forget(key)
+            self._count('misses')
+            return None
+
+        self._count('hits')
+        conn.execute('UPDATE downloads SET last_hit_at=?, hits=hits+1 WHERE extractor=? AND video_id=? AND mode=? AND quality=?',
+                     (time.time(),) + tuple(key))
+        return entry
+
+    def _still_valid(self, conn, entry):
+        try:
+            stat = os.stat(entry['path'])
+        except OSError:
+            return False
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime != entry['mtime']:
+            # Touched but maybe not changed: only the checksum can tell
+            if file_checksum(entry['path']) != entry['checksum']:
+                return False
+            conn.execute('UPDATE downloads SET mtime=? WHERE path=?', (stat.st_mtime, entry['path']))
+            entry['mtime'] = stat.st_mtime
+        return True
+
+    def record(self, key, path, title=''):
+        stat = os.stat(path)
+        entry = {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime,
+                 'checksum': file_checksum(path), 'title': title}
+        self._connection().execute(
+            '''INSERT OR REPLACE INTO downloads
+               (extractor, video_id, mode, quality, path, size, mtime, checksum, title, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            tuple(key) + (entry['path'], entry['size'], entry['mtime'], entry['checksum'], title, time.time()))
+        return entry
+
+    def forget(self, key):
+        self._connection().execute('DELETE FROM downloads WHERE extractor=? AND video_id=? AND mode=? AND quality=?', key)
+
+    def forget_path(self, path):
+        """
+        Drop every row pointing at path (call after deleting a download)
+        """
+        self._connection().execute('DELETE FROM downloads WHERE path=?', (os.path.abspath(path),))
+
+    def prune(self):
+        """
+        Drop rows whose file no longer exists
+        """
+        try:
+            conn = self._connection()
+            missing = [row['path'] for row in conn.execute('SELECT DISTINCT path FROM downloads')
+                       if not os.path.isfile(row['path'])]
+            conn.executemany('DELETE FROM downloads WHERE path=?', [(path,) for path in missing])
+            return len(missing)
+        except sqlite3.Error as e:
+            print(f"⚠️ Could not prune download index: {e}")
+            return 0
+
+    def stats(self):
+        count = self._connection().execute('SELECT COUNT(*) FROM downloads').fetchone()[0]
+        return {'entries': count, 'hits': self.hits, 'misses': self.misses}
+
+download_index = DownloadIndex(app.config['DOWNLOAD_INDEX_PATH'])
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(app.config['DOWNLOAD_BUFFER_SIZE']), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def download_index_key(info, mode, quality, audio_format='mp3'):
+    """
+    Index key for a download, or None when the info dict has no stable ID
+    """
+    if not info or not info.get('id') or not info.get('extractor_key'):
+        return None
+    # Audio output depends on the audio format, not on the video quality
+    if mode == 'Audio':
+        quality = audio_format
+    return (info['extractor_key'], str(info['id']), mode or 'Video', quality or '')
+
+def lookup_download(info, mode, quality, audio_format='mp3'):
+    key = download_index_key(info, mode, quality, audio_format)
+    if key is None:
+        return None
+    try:
+        return download_index.lookup(key)
+    except sqlite3.Error as e:
+        print(f"⚠️ Download index lookup failed: {e}")
+        return None
+
+def record_download(info, mode, quality, path, audio_format='mp3'):
+    key = download_index_key(info, mode, quality, audio_format)
+    if key is None or not os.path.isfile(path):
+        return None
+    try:
+        return download_index.record(key, path, info.get('title', ''))
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️ Could not index {path}: {e}")
+        return None
+
+def reuse_indexed_file(entry, download_folder):
+    """
+    Make an indexed file available in download_folder (hard link, or copy
+    across filesystems) and return its path there
+    """
+    if os.path.dirname(entry['path']) == os.path.abspath(download_folder):
+        return entry['path']
+    os.makedirs(download_folder, exist_ok=True)
+    target = os.path.join(download_folder, os.path.basename(entry['path']))
+    if os.path.isfile(target) and os.path.getsize(target) == entry['size']:
+        return target
+    try:
+        os.link(entry['path'], target)
+    except OSError:
+        shutil.copy2(entry['path'], target)
+    return target
+
+def download_result(entry, path, reused):
+    return {'file': os.path.basename(path), 'size': entry['size'],
+            'checksum': entry['checksum'], 'reused': reused}
+
+# --- Storage Quota ---
+storage = StorageManager(app.config['DOWNLOAD_FOLDER'], app.config, on_evict=download_index.forget_path)
+
 # --- Download Functions ---
-def progress_hook(d):
-    if download_status['is_paused']:
-        raise Exception("Download paused")
-    
-    if d['status'] == 'downloading':
-        total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
-        downloaded_bytes = d.get('downloaded_bytes')
-        if total_bytes and downloaded_bytes:
-            percentage = (downloaded_bytes / total_bytes) * 100
-            download_status['progress'] = percentage
-            download_status['message'] = f"Downloading... {percentage:.1f}%"
-    
-    elif d['status'] == 'finished':
-        download_status['progress'] = 100
-        download_status['message'] = "Finalizing..."
-    
-    elif d['status'] == 'error':
-        download_status['message'] = "Error occurred during download"
+def make_progress_hook(job):
+    parent = job['_parent']
 
-def download_video(url, quality, mode, download_folder, platform=None):
-    global download_status
-    
+    def progress_hook(d):
+        wait_if_paused(job)
+        if parent is not None:
+            # Pausing a playlist pauses the items it is downloading
+            wait_if_paused(parent)
+
+        if d['status'] == 'downloading':
+            total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
+            downloaded_bytes = d.get('downloaded_bytes')
+            if total_bytes and downloaded_bytes:
+                percentage = (downloaded_bytes / total_bytes) * 100
+                update_job(job, progress=percentage, message=f"Downloading... {percentage:.1f}%")
+
+        elif d['status'] == 'finished':
+            update_job(job, progress=100, message="Finalizing...")
+            if d.get('elapsed') is not None:
+                size = d.get('total_bytes') or d.get('downloaded_bytes') or 0
+                record_transfer((d.get('info_dict') or {}).get('extractor_key'), size, d['elapsed'])
+
+        elif d['status'] == 'error':
+            update_job(job, message="Error occurred during download")
+
+        if parent is not None:
+            refresh_playlist(parent)
+    return progress_hook
+
+def make_postprocessor_hook():
+    """
+    yt-dlp postprocessor hook timing the ffmpeg steps (merge, audio
+    extraction, thumbnail conversion) into the ffmpeg_postprocess stage
+    """
+    started = {}
+
+    def postprocessor_hook(d):
+        name = d.get('postprocessor') or ''
+        if not name.startswith('FFmpeg'):
+            return
+        if d['status'] == 'started':
+            started[name] = time.monotonic()
+        elif d['status'] == 'finished' and name in started:
+            observe_stage('ffmpeg_postprocess', time.monotonic() - started.pop(name))
+    return postprocessor_hook
+
+def make_audio_tagger(job):
+    """
+    yt-dlp postprocessor that tags the converted audio file in one save,
+    using the cover yt-dlp already wrote with writethumbnail. The class is
+    built on first use because yt_dlp is imported lazily.
+    """
+    class AudioTagger(yt_dlp.postprocessor.PostProcessor):
+        def run(self, info):
+            update_job(job, message='Adding metadata...')
+            # Thumbnails are ordered worst to best; the best one on disk becomes the cover
+            covers = [thumbnail['filepath'] for thumbnail in reversed(info.get('thumbnails') or [])
+                      if thumbnail.get('filepath') and os.path.exists(thumbnail['filepath'])]
+            cover_data, cover_mime = None, 'image/jpeg'
+            if covers:
+                with open(covers[0], 'rb') as f:
+                    cover_data = f.read()
+                cover_mime = mimetypes.guess_type(covers[0])[0] or cover_mime
+            add_metadata_to_audio(info['filepath'], info, cover_data, cover_mime)
+            # yt-dlp deletes the returned files (the cover is now inside the audio file)
+            return covers, info
+
+    return AudioTagger()
+
+def download_video(job, url, quality, mode, download_folder, platform=None, audio_format='mp3'):
     try:
-        download_status.update({
-            'is_downloading': True,
-            'is_paused': False,
-            'progress': 0,
-            'message': 'Starting download...',
-            'current_file': None
-        })
-        
+        update_job(job, progress=0, message='Starting download...', current_file=None)
+
         processed_quality = quality[:-1] if quality.endswith('p') else quality
-        
-        # Use the title from download_status if available, otherwise fallback to yt-dlp's title
-        if download_status.get('title'):
+
+        # Use the title sent with the job if available, otherwise fallback to yt-dlp's title
+        if job.get('title'):
             # Sanitize the title to be used as a filename
-            sanitized_title = secure_filename(download_status['title'])
+            sanitized_title = secure_filename(job['title'])
             outtmpl_path = os.path.join(download_folder, f'{sanitized_title}.%(ext)s')
         else:
             outtmpl_path = os.path.join(download_folder, '%(title)s.%(ext)s')
@@ -259,7 +2142,8 @@ def download_video(url, quality, mode, download_folder, platform=None):
         ydl_opts_base = {
             'outtmpl': outtmpl_path,
             'noplaylist': True,
-            'progress_hooks': [progress_hook],
+            'progress_hooks': [make_progress_hook(job)],
+            'postprocessor_hooks': [make_postprocessor_hook()],
             'postprocessors': [],
             'quiet': True,
             'merge_output_format': 'mp4',
@@ -278,87 +2162,528 @@ def download_video(url, quality, mode, download_folder, platform=None):
         else:
             print("⚠️ ffmpeg not found - download quality may be limited")
 
-        if mode == "Audio":
-            ydl_opts = ydl_opts_base.copy()
-            ydl_opts['format'] = 'bestaudio/best'
-            ydl_opts['writethumbnail'] = True
-            ydl_opts['postprocessors'].append({
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            })
-            ydl_opts['postprocessors'].append({
-                'key': 'EmbedThumbnail',
-            })
-            if download_status.get('title'):
-                sanitized_title = secure_filename(download_status['title'])
-                ydl_opts['outtmpl'] = os.path.join(download_folder, f'{sanitized_title}.mp3')
-            else:
-                ydl_opts['outtmpl'] = os.path.join(download_folder, '%(title)s.mp3')
-        else:  # Video
-            ydl_opts = ydl_opts_base.copy()
+        if mode == "Audio":
+            _, audio_selector, audio_codec = AUDIO_FORMATS[audio_format]
+            ydl_opts = ydl_opts_base.copy()
+            ydl_opts['format'] = audio_selector
+            ydl_opts['writethumbnail'] = True
+            ydl_opts['postprocessors'].append({
+                # Cover art as JPEG, converted once right after it is written
+                'key': 'FFmpegThumbnailsConvertor',
+                'format': 'jpg',
+                'when': 'before_dl',
+            })
+            # Same codec in and out is a stream copy; only mp3 (or a mismatch) re-encodes
+            ydl_opts['postprocessors'].append({
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': audio_codec,
+                'preferredquality': '192',
+            })
+            # Tags and cover are written by AudioTagger (see below) in a single save
+            # The extension is whatever FFmpegExtractAudio produces
+            if job.get('title'):
+                sanitized_title = secure_filename(job['title'])
+                ydl_opts['outtmpl'] = os.path.join(download_folder, f'{sanitized_title}.%(ext)s')
+            else:
+                ydl_opts['outtmpl'] = os.path.join(download_folder, '%(title)s.%(ext)s')
+        else:  # Video
+            ydl_opts = ydl_opts_base.copy()
+
+        update_job(job, message='Extracting video information...')
+        cached_info = extract_video_info(url)
+
+        indexed = lookup_download(cached_info, mode, processed_quality, audio_format)
+        if indexed:
+            filename = reuse_indexed_file(indexed, download_folder)
+            print(f"♻️ Reusing {indexed['path']}")
+            update_job(job, current_file=os.path.basename(filename), message="Already downloaded",
+                       progress=100, result=download_result(indexed, filename, True))
+            return
+
+        # Exact format IDs picked from the extracted info (see select_format)
+        plan = select_format(cached_info, mode, processed_quality, audio_format)
+        if plan:
+            ydl_opts['format'] = plan['format']
+            update_job(job, format=plan)
+        elif mode != "Audio" and processed_quality.isdigit():
+            ydl_opts['format'] = f'bv*[height<={processed_quality}]+ba/b[height<={processed_quality}]/b'
+
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            if mode == "Audio":
+                ydl.add_post_processor(make_audio_tagger(job), when='post_process')
+
+            # Reuse the already extracted info instead of extracting again;
+            # the scheduler keeps ratelimit/fragments in ydl.params at this job's share
+            with bandwidth.transfer(job, ydl.params):
+                info = ydl.process_ie_result(cached_info, download=True)
+            filename = ydl.prepare_filename(info)
+            
+            if mode == "Audio":
+                # The converted file (its extension changed after prepare_filename)
+                downloads = info.get('requested_downloads') or [{}]
+                filename = downloads[-1].get('filepath') or filename
+                
+                if os.path.exists(filename):
+                    # Clean up info.json file if it exists
+                    info_json_path = os.path.splitext(filename)[0] + '.info.json'
+                    if os.path.exists(info_json_path):
+                        os.remove(info_json_path)
+                else:
+                    print(f"⚠️ Could not find converted audio file. Expected: {filename}")
+            
+            entry = record_download(info, mode, processed_quality, filename, audio_format)
+            update_job(job, current_file=os.path.basename(filename), message="Download complete!", progress=100,
+                       result=download_result(entry, filename, False) if entry else None)
+
+    except Exception as e:
+        error_message = str(e).splitlines()[0]
+        if job['_cancelled']:
+            update_job(job, state='cancelled', message="Download cancelled")
+        elif "Download paused" in error_message:
+            # The .part file and fragment state are kept for the resume
+            update_job(job, state='paused', message="Download paused")
+        else:
+            update_job(job, state='error', message=f"Error: {error_message}")
+
+# --- Job Processes ---
+# Job targets that run in a job process when JOB_EXECUTION is 'process'
+PROCESS_JOB_TARGETS = {'download_video'}
+_process_context = None
+_process_context_lock = threading.Lock()
+
+def get_process_context():
+    """
+    Job processes are forked from a forkserver that imported this module
+    once, not from the threaded web process: cheap to start and free of
+    locks held by other threads at fork time.
+    """
+    global _process_context
+    with _process_context_lock:
+        if _process_context is None:
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload([__name__])
+            _process_context = context
+    return _process_context
+
+def run_job_target(job, target, args):
+    """
+    Run target(job, *args) on this thread, or in a job process for PROCESS_JOB_TARGETS
+    """
+    if app.config['JOB_EXECUTION'] == 'process' and target.__name__ in PROCESS_JOB_TARGETS:
+        run_in_job_process(job, target, args)
+    else:
+        target(job, *args)
+
+class JobUpdatePipe:
+    """
+    Job process end of the pipe to the web process. update_job() fields are
+    sent as they come, except progress-only updates, which are coalesced to
+    one per interval (yt-dlp calls its progress hook for every block).
+    """
+    PROGRESS_FIELDS = {'progress', 'message'}
+
+    def __init__(self, conn, interval=0.1):
+        self.conn = conn
+        self.interval = interval
+        self._pending = {}
+        self._sent_at = 0.0
+        self._lock = threading.Lock()
+
+    def send(self, fields):
+        with self._lock:
+            self._pending.update(fields)
+            if self.PROGRESS_FIELDS.issuperset(fields) and time.monotonic() - self._sent_at < self.interval:
+                return
+            self._flush()
+
+    def send_message(self, name, value):
+        with self._lock:
+            self._flush()
+            self.conn.send((name, value))
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        # Caller holds self._lock
+        if self._pending:
+            self.conn.send(('update', self._pending))
+            self._pending = {}
+            self._sent_at = time.monotonic()
+
+def job_process_seeds(target, args):
+    """
+    Info cache entries the job process would otherwise extract again
+    """
+    if target is download_video:
+        key = info_cache_key(args[0], INFO_EXTRACT_OPTS)
+        entry = info_cache.peek(key)
+        if entry:
+            return {key: entry}
+    return {}
+
+def apply_job_process_limits():
+    # Inherited by ffmpeg, so transcodes are niced and limited as well
+    os.nice(app.config['JOB_PROCESS_NICE'])
+    if resource is None:
+        return
+    cpu_seconds = app.config['JOB_PROCESS_CPU_SECONDS']
+    if cpu_seconds:
+        # SIGXCPU at the soft limit, SIGKILL a little later if it is ignored
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 5))
+    memory_bytes = app.config['JOB_PROCESS_MEMORY_BYTES']
+    if memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+
+def apply_bandwidth_share(job_id, share):
+    bandwidth.set_override(job_id, bandwidth_limit=share.get('ratelimit'),
+                           fragment_concurrency=share.get('concurrent_fragment_downloads'))
+
+def job_process_commands(conn, job, pipe):
+    """
+    Job process thread applying pause and bandwidth changes sent by the
+    web process; also sends coalesced progress that is still pending
+    """
+    while True:
+        try:
+            command = conn.recv() if conn.poll(pipe.interval) else None
+        except (EOFError, OSError):
+            return
+        if command is not None:
+            name, value = command
+            if name == 'pause':
+                with jobs_lock:
+                    job['is_paused'] = value
+                    job['_changed'].notify_all()
+            elif name == 'bandwidth':
+                apply_bandwidth_share(job['job_id'], value)
+        try:
+            pipe.flush()
+        except OSError:
+            return
+
+def job_process_main(conn, fields, target_name, args, config, seeds, share):
+    """
+    Entry point of a job process: run one job target with the web
+    process's settings and report back through conn
+    """
+    os.setpgrp()  # a cancel kills the whole group, ffmpeg included
+    app.config.update(config)
+    # Only this job runs here; the web process hands out its share of the limits
+    app.config.update(BANDWIDTH_LIMIT=0, JOB_BANDWIDTH_LIMIT=0)
+    apply_job_process_limits()
+
+    job = new_job(fields['job_id'], fields['kind'], fields['title'])
+    job.update(state='running', is_downloading=True, is_paused=fields['is_paused'])
+    pipe = JobUpdatePipe(conn)
+    job['_pipe'] = pipe
+    with jobs_lock:
+        jobs[job['job_id']] = job
+    for key, entry in seeds.items():
+        info_cache.seed(key, entry)
+
+    try:
+        apply_bandwidth_share(job['job_id'], share)
+        threading.Thread(target=job_process_commands, args=(conn, job, pipe), daemon=True, name='job-commands').start()
+        globals()[target_name](job, *args)
+    except DownloadPaused:
+        update_job(job, state='paused', message='Download paused')
+    except (MemoryError, RuntimeError) as e:
+        # Thread or allocation failures under RLIMIT_AS
+        update_job(job, state='error', message=f"Error: {str(e) or 'out of memory'} (JOB_PROCESS_MEMORY_BYTES)")
+    except Exception as e:
+        update_job(job, state='error', message=f"Error: {str(e)}")
+    finally:
+        with metrics_lock:
+            recorded = (stage_timings, transfer_totals)
+            pipe.send_message('metrics', recorded)
+        conn.close()
+
+def kill_job_process(process):
+    if process.exitcode is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        # Killed before it got its own process group
+        process.kill()
+
+def describe_process_exit(exitcode):
+    if exitcode == -signal.SIGXCPU:
+        return 'the download exceeded JOB_PROCESS_CPU_SECONDS'
+    if exitcode < 0:
+        return f'the download process was killed ({signal.Signals(-exitcode).name})'
+    return f'the download process exited with status {exitcode}'
+
+def run_in_job_process(job, target, args):
+    """
+    Run target in a job process and mirror its updates into job. Pauses and
+    the job's bandwidth share are passed down the pipe; a cancel kills the
+    process group.
+    """
+    context = get_process_context()
+    conn, child_conn = context.Pipe()
+    parent = job['_parent']
+    share = {}  # ratelimit / concurrent_fragment_downloads, kept at this job's share by the scheduler
+
+    with bandwidth.transfer(job, share):
+        sent_share = dict(share)
+        sent_paused = job['is_paused'] or bool(parent and parent['is_paused'])
+        fields = {'job_id': job['job_id'], 'kind': job['kind'], 'title': job['title'], 'is_paused': sent_paused}
+        process = context.Process(target=job_process_main, name=f"job-{job['job_id'][:8]}", daemon=True,
+                                  args=(child_conn, fields, target.__name__, args, dict(app.config),
+                                        job_process_seeds(target, args), sent_share))
+        process.start()
+        child_conn.close()
+        try:
+            while True:
+                if job['_cancelled']:
+                    kill_job_process(process)
+                    update_job(job, state='cancelled', message='Download cancelled')
+                    break
+                try:
+                    message = conn.recv() if conn.poll(0.1) else None
+                except EOFError:
+                    break
+                if message is not None:
+                    name, value = message
+                    if name == 'update':
+                        update_job(job, **value)
+                        if parent is not None:
+                            refresh_playlist(parent)
+                    elif name == 'metrics':
+                        merge_metrics(*value)
+
+                # Pausing a playlist pauses the items it is downloading
+                paused = job['is_paused'] or bool(parent and parent['is_paused'])
+                try:
+                    if paused != sent_paused:
+                        conn.send(('pause', paused))
+                        sent_paused = paused
+                    if share != sent_share:
+                        sent_share = dict(share)
+                        conn.send(('bandwidth', sent_share))
+                except OSError:
+                    pass  # exiting; the EOF ends the loop
+        finally:
+            kill_job_process(process)
+            process.join()
+            conn.close()
+
+    if process.exitcode and job['state'] == 'running':
+        update_job(job, state='error', message=f"Error: {describe_process_exit(process.exitcode)}")
+
+# --- Playlist Downloads ---
+def iter_entries(entries):
+    """
+    Iterate playlist entries as yt-dlp produces them (generators and paged
+    lists fetch one page at a time)
+    """
+    if isinstance(entries, yt_dlp.utils.PagedList):
+        for page_number in itertools.count():
+            page = entries.getpage(page_number)
+            if not page:
+                return
+            yield from page
+    else:
+        yield from entries or []
+
+def expand_playlist(url):
+    """
+    Yield flat entries (url, id, ie_key, title) of a playlist or channel
+    without extracting the videos themselves
+    """
+    ydl_opts = dict(INFO_EXTRACT_OPTS, noplaylist=False, extract_flat=True)
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False, process=False)
+        if info.get('_type') not in ('playlist', 'multi_video'):
+            yield {'url': info.get('webpage_url') or url, 'id': info.get('id'),
+                   'ie_key': info.get('extractor_key'), 'title': info.get('title')}
+            return
+
+        pending = [(info, 0)]
+        while pending:
+            playlist, depth = pending.pop(0)
+            for entry in iter_entries(playlist.get('entries')):
+                if not entry:
+                    continue
+                # Channels list their tabs (videos, shorts, ...) as nested playlists
+                nested = entry.get('_type') == 'playlist' or (
+                    entry.get('_type') == 'url' and entry.get('ie_key') == playlist.get('extractor_key'))
+                if nested and depth < 2:
+                    if entry.get('_type') == 'url':
+                        entry = ydl.extract_info(entry['url'], download=False, process=False)
+                    pending.append((entry, depth + 1))
+                    continue
+                entry_url = entry.get('url') or entry.get('webpage_url')
+                if not entry_url and entry.get('formats'):
+                    # Media embedded in the page itself has no page of its own
+                    entry_url = entry['formats'][-1].get('url')
+                if entry_url:
+                    yield {'url': entry_url, 'id': entry.get('id'),
+                           'ie_key': entry.get('ie_key') or entry.get('extractor_key'),
+                           'title': entry.get('title')}
+
+def refresh_playlist(job):
+    """
+    Copy item progress into the batch job and recompute the totals
+    """
+    with jobs_lock:
+        children = job['_children']
+        for item in job['items']:
+            child = children.get(item['job_id'])
+            if child is not None:
+                item.update(state=child['state'], progress=child['progress'], message=child['message'],
+                            file=child['current_file'])
+        items = job['items']
+        counts = {state: sum(1 for item in items if item['state'] == state)
+                  for state in ('finished', 'skipped', 'error')}
+        progress = sum(item['progress'] for item in items) / len(items) if items else 0
+    done = counts['finished'] + counts['skipped'] + counts['error']
+    message = job['message']
+    if job['state'] == 'running' and not job['is_paused']:
+        message = f"Downloading playlist: {done}/{len(items)} items ({progress:.1f}%)"
+    update_job(job, progress=progress, total=len(items), completed=counts['finished'],
+               skipped=counts['skipped'], failed=counts['error'], message=message)
+
+def download_playlist_item(job, url, item_id, ie_key, quality, mode, download_folder, platform,
+                           skip_existing, audio_format):
+    """
+    Job target of one playlist item: reuse an indexed copy, or download it
+    """
+    indexed = None
+    if skip_existing:
+        indexed = lookup_download({'extractor_key': ie_key, 'id': item_id}, mode, quality, audio_format)
+    if indexed:
+        filename = reuse_indexed_file(indexed, download_folder)
+        update_job(job, state='skipped', progress=100, message='Already downloaded',
+                   current_file=os.path.basename(filename), result=download_result(indexed, filename, True))
+        return
+    run_job_target(job, download_video, (url, quality, mode, download_folder, platform, audio_format))
+
+def feed_playlist(job):
+    """
+    Hand the batch's next items to the job queue, keeping at most its
+    concurrency of them queued or running
+    """
+    batch = job['_batch']
+    ready = []
+    with jobs_lock:
+        while (batch['backlog'] and len(batch['queued']) < batch['concurrency']
+               and not job['is_paused'] and not job['_cancelled']):
+            child = batch['backlog'].popleft()
+            if child['state'] == 'queued':
+                batch['queued'].add(child['job_id'])
+                ready.append(child)
+    for child in ready:
+        enqueue_job(child)
+
+def resume_playlist(job):
+    """
+    Put the items parked while the batch was paused back in line
+    """
+    with jobs_lock:
+        children = list(job['_children'].values())
+    for child in reversed(children):
+        if claim_paused(child):
+            requeue_paused(child)
+
+def finish_playlist(job):
+    """
+    Sum up a batch with no item queued or running; DownloadPaused when
+    some are left for a resume
+    """
+    refresh_playlist(job)
+    if not job['_cancelled'] and any(item['state'] in ('queued', 'paused') for item in job['items']):
+        raise DownloadPaused()
+
+    total, failed = job['total'], job['failed']
+    summary = {'total': total, 'completed': job['completed'], 'skipped': job['skipped'], 'failed': failed}
+    message = f"Playlist complete: {job['completed']} downloaded, {job['skipped']} skipped, {failed} failed"
+    update_job(job, state='error' if total and failed == total else job['state'],
+               message=message, progress=100, result=summary)
+
+def settle_playlist(job, child):
+    """
+    Called once an item stopped (finished, failed, cancelled or parked):
+    queue the next one, and complete a batch that gave its worker back
+    when nothing is left to run
+    """
+    batch = job['_batch']
+    with jobs_lock:
+        batch['queued'].discard(child['job_id'])
+    feed_playlist(job)
+    refresh_playlist(job)
+    with jobs_lock:
+        # A cancel reaches the items one at a time; wait for the last of them
+        busy = batch['queued'] or (job['_cancelled'] and
+                                   any(other['state'] == 'queued' for other in batch['backlog']))
+        if not batch['detached'] or busy:
+            return
+        batch['detached'] = False
+    try:
+        finish_playlist(job)
+    except DownloadPaused:
+        update_job(job, state='paused', message='Download paused')
+    settle_job(job)
+
+def download_playlist(job, url, quality, mode, download_folder, platform=None,
+                      concurrency=None, skip_existing=True, audio_format='mp3'):
+    """
+    Expand a playlist or channel and queue its items as jobs of their own
+    (readable through /get_status), at most concurrency of them at a time.
+    Items share the worker pool, priorities and storage admission with all
+    other jobs; their progress is summed up in this job, which gives its
+    worker back once the playlist is expanded.
+    """
+    concurrency = max(1, min(concurrency or app.config['PLAYLIST_CONCURRENCY'],
+                             app.config['PLAYLIST_MAX_CONCURRENCY']))
+    processed_quality = quality[:-1] if quality and quality.endswith('p') else quality
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            download_status['message'] = 'Extracting video information...'
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-            
-            if mode == "Audio":
-                # Get the actual output filename after conversion
-                base_filename = os.path.splitext(filename)[0]
-                mp3_filename = base_filename + '.mp3'
-                
-                # Check if the file exists with different possible names
-                possible_files = [
-                    mp3_filename,
-                    filename.replace('.webm', '.mp3').replace('.m4a', '.mp3'),
-                    os.path.join(download_folder, os.path.basename(base_filename) + '.mp3')
-                ]
-                
-                actual_file = None
-                for possible_file in possible_files:
-                    if os.path.exists(possible_file):
-                        actual_file = possible_file
-                        break
-                
-                if actual_file:
-                    filename = actual_file
-                    
-                    # Add metadata to audio file
-                    download_status['message'] = 'Adding metadata...'
-                    
-                    # Download thumbnail data for album art
-                    thumbnail_data = None
-                    if info.get('thumbnail'):
-                        try:
-                            thumbnail_response = requests.get(info['thumbnail'], timeout=10)
-                            if thumbnail_response.status_code == 200:
-                                thumbnail_data = thumbnail_response.content
-                        except Exception as e:
-                            print(f"⚠️ Could not download thumbnail: {e}")
-                    
-                    # Add metadata to the audio file
-                    add_metadata_to_audio(filename, info, thumbnail_data)
-                    
-                    # Clean up info.json file if it exists
-                    info_json_path = os.path.splitext(filename)[0] + '.info.json'
-                    if os.path.exists(info_json_path):
-                        os.remove(info_json_path)
-                else:
-                    print(f"⚠️ Could not find converted audio file. Expected: {mp3_filename}")
-            
-            download_status['current_file'] = os.path.basename(filename)
-            download_status['message'] = "Download complete!"
-            download_status['progress'] = 100
+    # Items from before a pause are kept so finished ones are not redone
+    known = {item['key']: item for item in job.get('items') or []}
+    job.setdefault('_children', {})
+    with jobs_lock:
+        job['_batch'] = batch = {'concurrency': concurrency, 'backlog': deque(), 'queued': set(), 'detached': False}
+    update_job(job, items=[], message='Expanding playlist...')
 
-    except Exception as e:
-        error_message = str(e).splitlines()[0]
-        if "Download paused" in error_message:
-            download_status['message'] = "Download paused"
+    entries = itertools.islice(expand_playlist(url), app.config['PLAYLIST_MAX_ITEMS'])
+    for index, entry in enumerate(entries):
+        if job['_cancelled']:
+            break
+        key = f"{entry['ie_key']}:{entry['id']}" if entry['id'] else entry['url']
+        item = known.get(key)
+        child = job['_children'].get(item['job_id']) if item else None
+        if item and child and child['state'] in ('finished', 'skipped'):
+            with jobs_lock:
+                job['items'].append(item)
+            continue
+
+        if child is None:
+            child = new_job(uuid.uuid4().hex, 'playlist_item', entry['title'] or '', download_playlist_item,
+                            (entry['url'], entry['id'], entry['ie_key'], processed_quality, mode,
+                             download_folder, platform, skip_existing, audio_format), job['_priority'])
+            child['_parent'] = job
+            with jobs_lock:
+                jobs[child['job_id']] = child
+                job['_children'][child['job_id']] = child
         else:
-            download_status['message'] = f"Error: {error_message}"
-    finally:
-        download_status['is_downloading'] = False
+            update_job(child, state='queued', is_paused=False, message='Waiting in queue...')
+        item = {'key': key, 'index': index, 'id': entry['id'], 'ie_key': entry['ie_key'],
+                'title': entry['title'], 'url': entry['url'], 'job_id': child['job_id'],
+                'state': 'queued', 'progress': 0, 'message': child['message'], 'file': None}
+        with jobs_lock:
+            job['items'].append(item)
+            batch['backlog'].append(child)
+        feed_playlist(job)
+    refresh_playlist(job)
+
+    with jobs_lock:
+        batch['detached'] = bool(batch['queued'])
+    if batch['detached']:
+        raise JobDetached()
+    finish_playlist(job)
 
 @app.route('/download_thumbnail_proxy')
 def download_thumbnail_proxy():
@@ -367,19 +2692,321 @@ def download_thumbnail_proxy():
         return "Missing URL parameter", 400
 
     try:
-        response = requests.get(thumbnail_url, stream=True)
-        response.raise_for_status() # Raise an exception for bad status codes
+        return serve_proxied_image(thumbnail_url, download_name='thumbnail.jpg')
+    except requests.exceptions.RequestException as e:
+        return str(e), 500
+
+# --- Direct Streaming ---
+# Protocols a single GET can fetch; manifests (HLS/DASH) need yt-dlp
+STREAMABLE_PROTOCOLS = {'http', 'https'}
+# Audio stream output ext -> (ffmpeg muxer, source codec that is copied as is, encoder args otherwise)
+AUDIO_STREAM_OUTPUTS = {
+    'mp3': ('mp3', 'mp3', ['-c:a', 'libmp3lame', '-b:a', '192k']),
+    'm4a': ('ipod', 'mp4a', ['-c:a', 'aac', '-b:a', '192k']),
+    'opus': ('opus', 'opus', ['-c:a', 'libopus', '-b:a', '128k']),
+}
+
+def audio_stream_ext(source, audio_format):
+    if audio_format in AUDIO_STREAM_OUTPUTS:
+        return audio_format
+    # 'native' keeps the source codec
+    acodec = source.get('acodec') or ''
+    for ext, (_, copy_codec, _) in AUDIO_STREAM_OUTPUTS.items():
+        if acodec.startswith(copy_codec):
+            return ext
+    return None
+
+def stream_source(info, mode, quality, audio_format):
+    """
+    (source format, output ext) when the request can be served from one
+    source stream, or None when it needs a merge (or yt-dlp's downloader)
+    """
+    plan = select_format(info, mode, quality, audio_format)
+    if plan is None or (mode != 'Audio' and not plan['progressive']):
+        return None
+    source = next((f for f in info.get('formats') or [] if f.get('format_id') == plan['format']), None)
+    if source is None or not source.get('url') or source.get('protocol', 'https') not in STREAMABLE_PROTOCOLS:
+        return None
+    ext = audio_stream_ext(source, audio_format) if mode == 'Audio' else source.get('ext') or 'mp4'
+    return (source, ext) if ext else None
+
+def ffmpeg_audio_command(ffmpeg, source, ext, info):
+    """
+    ffmpeg reading the source URL and writing ext to stdout: a stream copy
+    when the codec already matches, otherwise an encode
+    """
+    muxer, copy_codec, encode = AUDIO_STREAM_OUTPUTS[ext]
+    command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin']
+    headers = ''.join(f'{name}: {value}\r\n' for name, value in (source.get('http_headers') or {}).items())
+    if headers:
+        command += ['-headers', headers]
+    command += ['-i', source['url'], '-vn', '-map_metadata', '-1']
+    command += ['-c:a', 'copy'] if (source.get('acodec') or '').startswith(copy_codec) else encode
+    command += ['-metadata', f"title={info.get('title') or ''}",
+                '-metadata', f"artist={info.get('uploader') or info.get('artist') or ''}"]
+    if muxer == 'ipod':
+        # MP4 needs its index up front when the output cannot be seeked
+        command += ['-movflags', 'frag_keyframe+empty_moov']
+    return command + ['-f', muxer, 'pipe:1']
+
+def ffmpeg_chunks(command):
+    """
+    Yield ffmpeg's stdout. The pipe is the backpressure: ffmpeg blocks
+    while the client is not reading. Closing the generator kills ffmpeg.
+    """
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, stdin=subprocess.DEVNULL)
+        try:
+            while True:
+                chunk = process.stdout.read1(app.config['STREAM_CHUNK_SIZE'])
+                if not chunk:
+                    break
+                bandwidth.consume(len(chunk))
+                yield chunk
+            if process.wait() != 0:
+                stderr.seek(0)
+                raise IOError(f"ffmpeg exited with {process.returncode}: {stderr.read().decode(errors='replace')[-500:]}")
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+
+def upstream_chunks(resp):
+    for chunk in resp.iter_content(app.config['STREAM_CHUNK_SIZE']):
+        bandwidth.consume(len(chunk))
+        yield chunk
+
+def tee_chunks(chunks, path, expected_size=None, extractor=None, on_complete=None, offset=0):
+    """
+    Pass chunks through while writing them to path + '.part' (claimed with
+    claim_part and reserved with the storage manager by the caller),
+    appending after offset bytes already there.
+    Only a stream that ended normally (with expected_size bytes, when known)
+    takes the final name and is handed to on_complete. A stream cut short
+    keeps its .part for the next /stream (or download) of the file when
+    expected_size is known; anything else is deleted. With path None the
+    chunks are only counted for the transfer metrics.
+    """
+    part_path = path + '.part' if path else None
+    started = time.monotonic()
+    received = offset
+    f = open(part_path, 'ab' if offset else 'wb') if part_path else None
+    try:
+        for chunk in chunks:
+            if f:
+                f.write(chunk)
+            received += len(chunk)
+            yield chunk
+        record_transfer(extractor, received - offset, time.monotonic() - started)
+        if f:
+            f.close()
+            if expected_size is None or received == expected_size:
+                os.replace(part_path, path)
+                discard_part(part_path)
+                print(f"💾 Kept streamed copy {path}")
+                if on_complete:
+                    on_complete(path)
+    finally:
+        if f:
+            f.close()
+            if os.path.exists(part_path):
+                if expected_size and received < expected_size:
+                    save_resume_state(part_path, expected_size, [[0, expected_size - 1, received]])
+                else:
+                    discard_part(part_path)
+            release_part(part_path)
+            storage.unreserve(part_path)
+
+def part_chunks(part_path, length):
+    """
+    The first length bytes of a kept .part file, in STREAM_CHUNK_SIZE reads
+    """
+    with open(part_path, 'rb') as f:
+        while length > 0:
+            chunk = f.read(min(app.config['STREAM_CHUNK_SIZE'], length))
+            if not chunk:
+                raise IOError(f"{part_path} is shorter than its resume state")
+            length -= len(chunk)
+            yield chunk
+
+def tee_path_for(filename):
+    """
+    Free path in DOWNLOAD_FOLDER for a streamed copy: 'Title.mp4', else
+    'Title_1.mp4' and so on. A .part left by an interrupted stream of the
+    same name is not in use, so that stream can be resumed.
+    """
+    stem, ext = os.path.splitext(filename)
+    for number in itertools.count():
+        path = os.path.join(app.config['DOWNLOAD_FOLDER'], f'{stem}_{number}{ext}' if number else filename)
+        if not part_in_use(path + '.part') and not os.path.exists(path):
+            return path
+
+def reserve_tee(part_path, need):
+    """
+    Reserve the space of a streamed copy like job_worker does for a job;
+    False (no copy is kept) when it does not fit right now
+    """
+    if storage.reserve(part_path, need or app.config['STORAGE_DEFAULT_JOB_BYTES']) == 'start':
+        return True
+    print(f"⚠️ Not keeping a streamed copy of {os.path.basename(part_path)}: not enough storage space")
+    return False
+
+def stream_response(chunks, filename, status=200, headers=None):
+    response = Response(chunks, status, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                        direct_passthrough=True)
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    response.headers.update(headers or {})
+    response.cache_control.no_store = True
+    return response
+
+def stream_upstream(url, headers, filename, tee_path=None, extractor=None, on_complete=None):
+    """
+    Relay one upstream GET. A client Range is passed through (and then
+    nothing is written to disk); otherwise the body can be teed to tee_path.
+    When an earlier stream of the same file was cut short, its .part is
+    sent first and only the rest is requested upstream with Range.
+    """
+    headers = dict(headers or {})
+    if request.headers.get('Range'):
+        headers['Range'] = request.headers['Range']
+        tee_path = None
+    part_path = tee_path + '.part' if tee_path else None
+    if part_path and not claim_part(part_path):
+        # Another stream or download is writing this file right now
+        tee_path = part_path = None
+
+    try:
+        resume = load_resume_state(part_path) if part_path else None
+        offset = 0
+        if resume and len(resume[1]) == 1 and resume[1][0][0] == 0:
+            offset = resume[1][0][2]
+            resp = http_get(url, headers=dict(headers, Range=f'bytes={offset}-'), stream=True)
+            total = resp.headers.get('Content-Range', '').rpartition('/')[2]
+            if resp.status_code != 206 or total != str(resume[0]):
+                # Changed upstream or no range support: start over
+                resp.close()
+                offset = 0
+        if not offset:
+            if part_path:
+                discard_part(part_path)
+            resp = http_get(url, headers=headers, stream=True)
+    except BaseException:
+        if part_path:
+            release_part(part_path)
+        raise
+
+    length = resp.headers.get('Content-Length')
+    expected_size = int(length) + offset if length and length.isdigit() else None
+    if part_path and (resp.status_code not in (200, 206) or not reserve_tee(part_path, expected_size and expected_size - offset)):
+        release_part(part_path)
+        tee_path = part_path = None
+        if offset:
+            # The kept .part stays for a later stream; this one starts over without a copy
+            resp.close()
+            offset = 0
+            resp = http_get(url, headers=headers, stream=True)
+            length = resp.headers.get('Content-Length')
+            expected_size = int(length) if length and length.isdigit() else None
+    if resp.status_code not in (200, 206):
+        resp.close()
+        return jsonify(success=False, message=f'Upstream answered HTTP {resp.status_code}'), 502
+
+    response_headers = {'Accept-Ranges': 'bytes'}
+    if expected_size is not None:
+        response_headers['Content-Length'] = str(expected_size)
+    if resp.headers.get('Content-Range') and not offset:
+        response_headers['Content-Range'] = resp.headers['Content-Range']
+    if tee_path:
+        os.makedirs(os.path.dirname(tee_path), exist_ok=True)
+    chunks = tee_chunks(upstream_chunks(resp), tee_path, expected_size, extractor, on_complete, offset)
+    if offset:
+        print(f"⏯️ Resuming streamed copy {tee_path} at byte {offset}")
+        chunks = itertools.chain(part_chunks(part_path, offset), chunks)
+    return stream_response(close_after(resp, chunks), filename, 200 if offset else resp.status_code, response_headers)
+
+def stream_video(url, mode, quality, audio_format, tee):
+    processed_quality = quality[:-1] if quality.endswith('p') else quality
+    info = extract_video_info(url)
+
+    indexed = lookup_download(info, mode, processed_quality, audio_format)
+    if indexed:
+        storage.touch(indexed['path'])
+        return serve_download(indexed['path'], os.path.basename(indexed['path']))
+
+    picked = stream_source(info, mode, processed_quality, audio_format)
+    if picked is None:
+        return jsonify(success=False, message='This format cannot be streamed directly (it needs a merge); use /start_download instead'), 409
+    source, ext = picked
+    filename = f"{secure_filename(info.get('title') or '') or info.get('id')}.{ext}"
+    estimated_size = estimate_format_size(source, info.get('duration'))
+    tee_path = tee_path_for(filename) if tee else None
+
+    def on_complete(path):
+        record_download(info, mode, processed_quality, path, audio_format)
 
-        # Get the content type from the original response
-        content_type = response.headers.get('content-type', 'image/jpeg')
+    extractor = info.get('extractor_key')
+    if mode != 'Audio':
+        return stream_upstream(source['url'], source.get('http_headers'), filename, tee_path, extractor, on_complete)
 
-        # Create a streaming response to send to the client
-        return Response(response.iter_content(chunk_size=8192),
-                        content_type=content_type,
-                        headers={"Content-Disposition": "attachment; filename=thumbnail.jpg"})
+    ffmpeg = probe_toolchain()['ffmpeg']
+    if not ffmpeg:
+        if source.get('ext') == ext:
+            return stream_upstream(source['url'], source.get('http_headers'), filename, tee_path, extractor, on_complete)
+        return jsonify(success=False, message='ffmpeg is needed to stream this audio format'), 409
+    if tee_path and not claim_part(tee_path + '.part'):
+        tee_path = None
+    if tee_path and not reserve_tee(tee_path + '.part', estimated_size):
+        release_part(tee_path + '.part')
+        tee_path = None
+    if tee_path:
+        os.makedirs(os.path.dirname(tee_path), exist_ok=True)
+    chunks = tee_chunks(ffmpeg_chunks(ffmpeg_audio_command(ffmpeg, source, ext, info)), tee_path,
+                        extractor=extractor, on_complete=on_complete)
+    return stream_response(chunks, filename)
 
+def stream_instagram(url, index, tee):
+    if is_instagram_story(url):
+        return jsonify(success=False, message=STORY_LOGIN_MESSAGE), 400
+    shortcode = extract_instagram_shortcode(url)
+    if not shortcode:
+        return jsonify(success=False, message='Invalid Instagram URL'), 400
+    items = instagram_media_items(get_instagram_post(shortcode), app.config['DOWNLOAD_FOLDER'])
+    if not 1 <= index <= len(items):
+        return jsonify(success=False, message=f'This post has {len(items)} media file(s)'), 404
+
+    media_url, path = items[index - 1]
+    # Same file names as /download_instagram, so either one reuses the other's files
+    if os.path.isfile(path):
+        storage.touch(path)
+        return serve_download(path, os.path.basename(path))
+    tee_path = path if tee else None
+    return stream_upstream(media_url, None, os.path.basename(path), tee_path, 'Instagram')
+
+@app.route('/stream')
+def stream_media():
+    """
+    Send a video, audio track or Instagram media file to the client while
+    it is being fetched (time to first byte is one upstream round trip).
+    Query: url, mode (Video/Audio), quality, audio_format, index (Instagram
+    sidecars, 1-based), tee=0/1 to keep a copy for the download index.
+    Anything that needs a merge is refused with 409.
+    """
+    url = request.args.get('url')
+    if not url:
+        return jsonify(success=False, message='URL is required'), 400
+    tee = request.args.get('tee', '1' if app.config['STREAM_TEE_TO_DISK'] else '0') == '1'
+
+    try:
+        if 'instagram.com' in url:
+            return stream_instagram(url, request.args.get('index', 1, type=int), tee)
+        return stream_video(url, request.args.get('mode', 'Video'), request.args.get('quality', ''),
+                            get_audio_format(request.args), tee)
     except requests.exceptions.RequestException as e:
-        return str(e), 500
+        return jsonify(success=False, message=f'Error: {e}'), 502
+    except Exception as e:
+        print(f"❌ Stream failed for {url}: {e}")
+        return jsonify(success=False, message=f'Error: {str(e)}'), 500
 
 # --- Routes ---
 @app.route('/')
@@ -388,44 +3015,48 @@ def index():
     return render_template('index.html', 
                          formats=get_available_formats(),
                          qualities=get_available_qualities(),
+                         audio_formats=get_available_audio_formats(),
+                         default_audio_format=app.config['DEFAULT_AUDIO_FORMAT'],
                          default_folder=app.config['DOWNLOAD_FOLDER'])
 
-@app.route('/fetch_title', methods=['POST'])
-def fetch_title():
-    url = request.form.get('url')
+def fetch_title_info(url):
+    """
+    Title and thumbnail for the Fetch Info button (shared with asgi.py)
+    """
     if not url:
-        return jsonify({'success': False, 'title': 'Please enter a video URL', 'thumbnail': None})
-    
+        return {'success': False, 'title': 'Please enter a video URL', 'thumbnail': None}
+
     try:
-        ydl_opts = {
-            'quiet': True,
-            'extract_flat': 'in_playlist',
-            'force_generic_extractor': True,
-            'user_agent': COMMON_USER_AGENT,
-            'nocheckcertificate': True,
-            'ignoreerrors': True,
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            if not info:
-                return jsonify({'success': False, 'title': 'Could not fetch video info', 'thumbnail': None})
-                
-            title = info.get('title', 'No title found')
-            thumbnail = info.get('thumbnail', None)
-            download_status['title'] = title
-            return jsonify({'success': True, 'title': title, 'thumbnail': thumbnail})
+        info = extract_video_info(url)
+        if not info:
+            return {'success': False, 'title': 'Could not fetch video info', 'thumbnail': None}
+
+        title = info.get('title', 'No title found')
+        thumbnail = info.get('thumbnail', None)
+        result = {'success': True, 'title': title, 'thumbnail': thumbnail, 'is_playlist': False}
+        if info.get('_type') in ('playlist', 'multi_video'):
+            entries = info.get('entries') or []
+            result.update(is_playlist=True,
+                          playlist_count=info.get('playlist_count') or (len(entries) if isinstance(entries, list) else None))
+            if not thumbnail and info.get('thumbnails'):
+                result['thumbnail'] = info['thumbnails'][-1].get('url')
+        return result
     except Exception as e:
-        return jsonify({'success': False, 'title': f'Error fetching title: {str(e)}', 'thumbnail': None})
+        return {'success': False, 'title': f'Error fetching title: {str(e)}', 'thumbnail': None}
+
+@app.route('/fetch_title', methods=['POST'])
+def fetch_title():
+    return jsonify(fetch_title_info(request.form.get('url')))
 
 @app.route('/start_download', methods=['POST'])
 def start_download():
-    global download_status
-    
     url = request.form.get('url')
     quality = request.form.get('quality')
     mode = request.form.get('mode')
     download_folder = request.form.get('download_folder')
     platform = request.form.get('platform')
+    title = request.form.get('title', '')
+    audio_format = get_audio_format(request.form)
     
     if not url:
         return jsonify(success=False, message='URL is required')
@@ -435,38 +3066,91 @@ def start_download():
     except ValueError as e:
         return jsonify(success=False, message=str(e))
 
+    info = None
     if platform != 'other':
         try:
-            ydl_opts = {
-                'quiet': True,
-                'extract_flat': 'in_playlist',
-                'force_generic_extractor': True,
-                'user_agent': COMMON_USER_AGENT,
-                'nocheckcertificate': True,
-                'ignoreerrors': True,
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                if info:
-                    extractor = info.get('extractor_key', '').lower()
-                    if platform.lower() not in extractor:
-                        # Just a warning, don't block
-                        print(f"Warning: URL might not be a valid {platform} link. Extractor: {extractor}")
+            # Also warms the info cache for the download itself
+            info = extract_video_info(url)
+            if info:
+                extractor = info.get('extractor_key', '').lower()
+                if platform.lower() not in extractor:
+                    # Just a warning, don't block
+                    print(f"Warning: URL might not be a valid {platform} link. Extractor: {extractor}")
         except Exception as e:
             print(f"Error verifying URL: {str(e)}")
             # Continue anyway, don't block download on verification error
 
-    if download_status['is_downloading']:
-        return jsonify(success=False, message='Another download is already in progress')
-    
-    download_status['download_thread'] = threading.Thread(
-        target=download_video, 
-        args=(url, quality, mode, download_folder, platform)
-    )
-    download_status['download_thread'].start()
-    
-    return jsonify(success=True)
+    # Already downloaded into this folder: answer with a finished job right away
+    processed_quality = quality[:-1] if quality and quality.endswith('p') else quality
+    indexed = lookup_download(info, mode, processed_quality, audio_format)
+    if indexed and os.path.dirname(indexed['path']) == os.path.abspath(download_folder):
+        job = finished_job('video', title, current_file=os.path.basename(indexed['path']),
+                           message="Already downloaded",
+                           result=download_result(indexed, indexed['path'], True))
+        return jsonify(success=True, job_id=job['job_id'])
+
+    plan = select_format(info, mode, processed_quality, audio_format) if info else None
+    job = submit_job(download_video,
+                     args=(url, quality, mode, download_folder, platform, audio_format),
+                     kind='video', title=title,
+                     priority=get_request_priority(request.form),
+                     estimated_size=plan and plan['estimated_size'])
+
+    return jsonify(success=True, job_id=job['job_id'])
+
+
+@app.route('/format_info', methods=['POST'])
+def format_info():
+    """
+    The format a download would use and its estimated size, without downloading
+    """
+    url = request.form.get('url')
+    quality = request.form.get('quality') or ''
+    mode = request.form.get('mode') or 'Video'
+    if not url:
+        return jsonify(success=False, message='URL is required')
+
+    try:
+        info = extract_video_info(url)
+    except Exception as e:
+        return jsonify(success=False, message=f'Error fetching formats: {str(e)}')
+    if not info:
+        return jsonify(success=False, message='Could not fetch video info')
+
+    processed_quality = quality[:-1] if quality.endswith('p') else quality
+    plan = select_format(info, mode, processed_quality, get_audio_format(request.form))
+    return jsonify(success=True, title=info.get('title'), format=plan)
+
+@app.route('/start_playlist_download', methods=['POST'])
+def start_playlist_download():
+    url = request.form.get('url')
+    quality = request.form.get('quality')
+    mode = request.form.get('mode')
+    download_folder = request.form.get('download_folder')
+    platform = request.form.get('platform')
+    title = request.form.get('title', '')
+    audio_format = get_audio_format(request.form)
+    skip_existing = request.form.get('skip_existing', 'true').lower() not in ('0', 'false', 'no', 'off')
+
+    if not url:
+        return jsonify(success=False, message='URL is required')
+
+    try:
+        download_folder = secure_path(download_folder)
+    except ValueError as e:
+        return jsonify(success=False, message=str(e))
+
+    try:
+        concurrency = int(request.form.get('concurrency') or app.config['PLAYLIST_CONCURRENCY'])
+    except ValueError:
+        concurrency = app.config['PLAYLIST_CONCURRENCY']
+
+    job = submit_job(download_playlist,
+                     args=(url, quality, mode, download_folder, platform, concurrency, skip_existing, audio_format),
+                     kind='playlist', title=title,
+                     priority=get_request_priority(request.form))
 
+    return jsonify(success=True, job_id=job['job_id'])
 
 @app.route('/download_thumbnail', methods=['POST'])
 def download_thumbnail():
@@ -487,8 +3171,9 @@ def download_thumbnail():
                 'format': 'jpg',
             }],
         }
+        info = extract_video_info(url)
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.extract_info(url, download=True)
+            ydl.process_ie_result(info, download=True)
         
         return jsonify(success=True, message='Thumbnail downloaded successfully!')
     except Exception as e:
@@ -497,23 +3182,221 @@ def download_thumbnail():
 
 @app.route('/toggle_pause', methods=['POST'])
 def toggle_pause():
-    download_status['is_paused'] = not download_status['is_paused']
-    if download_status['is_paused']:
-        return jsonify({'success': True, 'is_paused': True, 'message': 'Download paused'})
+    job = get_request_job(request.form)
+    if job is not None:
+        job_id = job['job_id']
+        paused = not job['is_paused']
+        set_job_paused(job, paused)
+    else:
+        # Running in another worker: its owner picks the request up within JOB_STATE_FLUSH_INTERVAL
+        status = get_remote_status(request.form)
+        if status is None:
+            return jsonify({'success': False, 'message': 'No download to pause'})
+        job_id = status['job_id']
+        paused = not status['is_paused']
+        if not job_state.request_pause(job_id, paused):
+            return jsonify({'success': False, 'message': 'Download already finished'})
+
+    if paused:
+        return jsonify({'success': True, 'job_id': job_id, 'is_paused': True, 'message': 'Download paused'})
     else:
-        return jsonify({'success': True, 'is_paused': False, 'message': 'Download resumed'})
+        return jsonify({'success': True, 'job_id': job_id, 'is_paused': False, 'message': 'Download resumed'})
+
+@app.route('/cancel_download', methods=['POST'])
+def cancel_download():
+    job = get_request_job(request.form)
+    if job is not None:
+        job_id = job['job_id']
+        cancelled = cancel_job(job)
+    else:
+        # Running in another worker: its owner picks the request up within JOB_STATE_FLUSH_INTERVAL
+        status = get_remote_status(request.form)
+        if status is None:
+            return jsonify({'success': False, 'message': 'No download to cancel'})
+        job_id = status['job_id']
+        cancelled = job_state.request_cancel(job_id)
+    if not cancelled:
+        return jsonify({'success': False, 'job_id': job_id, 'message': 'Download already finished'})
+    return jsonify({'success': True, 'job_id': job_id, 'message': 'Download cancelled'})
 
 @app.route('/get_status', methods=['GET'])
 def get_status():
+    job = get_request_job(request.args)
+    if job is None:
+        status = get_remote_status(request.args)
+        if status is not None:
+            return jsonify(status)
+        if request.args.get('job_id'):
+            return jsonify(dict(IDLE_STATUS, job_id=request.args['job_id'], state='unknown',
+                                message='Unknown or expired job')), 404
+        return jsonify(IDLE_STATUS)
+    return jsonify(job_snapshot(job))
+
+def worker_can_stream(environ):
+    """
+    Whether a long-lived response leaves the worker free for other requests:
+    threaded servers say so in the environ; gevent and eventlet workers
+    report wsgi.multithread=False but run requests as greenlets once they
+    have patched threading
+    """
+    if environ.get('wsgi.multithread') or app.config['SSE_ALLOW_ANY_WORKER']:
+        return True
+    gevent_monkey = sys.modules.get('gevent.monkey')
+    if gevent_monkey is not None and gevent_monkey.is_module_patched('threading'):
+        return True
+    eventlet_patcher = sys.modules.get('eventlet.patcher')
+    return eventlet_patcher is not None and eventlet_patcher.is_monkey_patched('thread')
+
+@app.route('/events/<job_id>')
+def job_events(job_id):
+    """
+    Stream status changes of a job as Server-Sent Events. Each stream lasts
+    at most SSE_MAX_STREAM_SECONDS and then sends a 'reconnect' event.
+    Refused (503) under sync workers, where it would block a whole worker.
+    """
+    if not worker_can_stream(request.environ):
+        return jsonify(success=False, message='Status streaming needs a threaded or async worker; poll /get_status'), 503
+    job = get_job(job_id)
+    remote = job_state.read(job_id) if job is None else None
+    if job is None and remote is None:
+        return jsonify(dict(IDLE_STATUS, job_id=job_id, state='unknown', message='Unknown or expired job')), 404
+
+    min_interval = 1.0 / app.config['SSE_MAX_UPDATES_PER_SECOND']
+    heartbeat = app.config['SSE_HEARTBEAT_SECONDS']
+    deadline = time.monotonic() + app.config['SSE_MAX_STREAM_SECONDS']
+
+    def remote_stream():
+        # Job owned by another worker: poll the shared backend instead of waiting on _changed
+        last_status, last_sent = None, time.monotonic()
+        yield 'retry: 2000\n\n'
+        while time.monotonic() < deadline:
+            status = job_state.read(job_id)
+            if status is None:
+                yield 'event: done\ndata: {}\n\n'
+                return
+            if status != last_status:
+                last_status, last_sent = status, time.monotonic()
+                yield f"data: {json.dumps(status)}\n\n"
+                if status.get('finished_at'):
+                    yield 'event: done\ndata: {}\n\n'
+                    return
+            elif time.monotonic() - last_sent > heartbeat:
+                last_sent = time.monotonic()
+                yield ': keep-alive\n\n'
+            time.sleep(max(min_interval, app.config['JOB_STATE_FLUSH_INTERVAL']))
+        yield 'event: reconnect\ndata: {}\n\n'
+
+    def stream():
+        last_version = None
+        yield 'retry: 2000\n\n'
+        while time.monotonic() < deadline:
+            with jobs_lock:
+                job['_changed'].wait_for(lambda: job['_version'] != last_version,
+                                         timeout=max(0, min(heartbeat, deadline - time.monotonic())))
+                changed = job['_version'] != last_version
+                last_version = job['_version']
+                active = job_is_active(job)
+
+            if not changed:
+                yield ': keep-alive\n\n'
+                continue
+
+            yield f"data: {json.dumps(job_snapshot(job))}\n\n"
+            if not active:
+                yield 'event: done\ndata: {}\n\n'
+                return
+            # Updates arriving meanwhile are merged into the next message
+            time.sleep(min_interval)
+        yield 'event: reconnect\ndata: {}\n\n'
+
+    return Response(stream() if job is not None else remote_stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/http_stats', methods=['GET'])
+def http_stats_route():
+    return jsonify(dict(get_http_pool_stats(), proxy_cache=proxy_cache.stats(),
+                        instagram_posts=instagram_post_cache.stats()))
+
+@app.route('/toolchain', methods=['GET'])
+def toolchain_route():
+    return jsonify(probe_toolchain())
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    with jobs_lock:
+        job_list = list(jobs.values())
     return jsonify({
-        'is_downloading': download_status['is_downloading'],
-        'is_paused': download_status['is_paused'],
-        'progress': download_status['progress'],
-        'message': download_status['message'],
-        'current_file': download_status['current_file'],
-        'title': download_status['title']
+        'queued': job_queue.qsize(),
+        'workers': len(_job_workers),
+        'execution': app.config['JOB_EXECUTION'],
+        'download_index': download_index.stats(),
+        'storage': storage.stats(),
+        'job_state': job_state.stats(),
+        'jobs': [job_snapshot(job) for job in sorted(job_list, key=lambda job: job['created_at'])]
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def admin_allowed():
+    """
+    ADMIN_TOKEN must match the X-Admin-Token header. There is no fallback
+    for local clients: behind nginx/apache every client looks local.
+    """
+    token = app.config['ADMIN_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+
+# Runtime-adjustable scheduler settings: JSON field -> app.config key
+SCHEDULER_SETTINGS = {
+    'bandwidth_limit': 'BANDWIDTH_LIMIT',
+    'job_bandwidth_limit': 'JOB_BANDWIDTH_LIMIT',
+    'fragment_concurrency': 'FRAGMENT_CONCURRENCY',
+    'max_connections_per_host': 'HTTP_MAX_CONNECTIONS_PER_HOST',
+}
+
+@app.route('/admin/scheduler', methods=['GET', 'POST'])
+def admin_scheduler():
+    """
+    GET shows the limits and each active job's share. POST changes them:
+    global fields from SCHEDULER_SETTINGS, or with job_id the per-job
+    bandwidth_limit / fragment_concurrency (null clears an override).
+    """
+    if not app.config['ADMIN_TOKEN']:
+        return jsonify(success=False, message='Admin routes are disabled (set ADMIN_TOKEN)'), 404
+    if not admin_allowed():
+        return jsonify(success=False, message='Forbidden'), 403
+    if request.method == 'GET':
+        return jsonify(bandwidth.stats())
+
+    data = request.get_json(silent=True) or {}
+    job_id = data.get('job_id')
+    allowed = ('bandwidth_limit', 'fragment_concurrency') if job_id else tuple(SCHEDULER_SETTINGS)
+    values = {}
+    for key in allowed:
+        if key not in data:
+            continue
+        value = data[key]
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 0):
+            return jsonify(success=False, message=f'{key} must be a non-negative integer'), 400
+        values[key] = value
+
+    if job_id:
+        if get_job(job_id) is None:
+            return jsonify(success=False, message='Job not found'), 404
+        bandwidth.set_override(job_id, **values)
+    else:
+        values = {key: value for key, value in values.items() if value is not None}
+        if values.get('fragment_concurrency') == 0 or values.get('max_connections_per_host') == 0:
+            return jsonify(success=False, message='Concurrency limits must be at least 1'), 400
+        for key, value in values.items():
+            app.config[SCHEDULER_SETTINGS[key]] = value
+        if 'max_connections_per_host' in values:
+            reset_http_adapter()
+        bandwidth.rebalance()
+    print(f"🎚️ Scheduler updated{f' for job {job_id}' if job_id else ''}: {values}")
+    return jsonify(success=True, message='Scheduler updated', scheduler=bandwidth.stats())
+
 @app.route('/browse_folder', methods=['POST'])
 def browse_folder():
     try:
@@ -553,97 +3436,206 @@ def open_folder():
 
 @app.route('/downloads/<filename>')
 def download_file(filename):
-    return send_from_directory(app.config['DOWNLOAD_FOLDER'], filename, as_attachment=True)
+    path = safe_join(app.config['DOWNLOAD_FOLDER'], filename)
+    if path is None or not os.path.isfile(path):
+        return "File not found", 404
+    storage.touch(path)
+    return serve_download(path, filename)
 
 @app.route('/get_device_id', methods=['GET'])
 def get_device_id_route():
-    return jsonify({'device_id': DEVICE_ID})
+    return jsonify({'device_id': get_device_id()})
 
 # --- Instagram Download Functions ---
-def download_instagram_media(url, download_folder):
-    """
-    Download photos/videos from Instagram posts, reels, or stories
-    """
-    try:
-        # Create an Instaloader instance
-        L = instaloader.Instaloader(
-            download_pictures=True,
-            download_videos=True,
-            download_video_thumbnails=False,
-            download_geotags=False,
-            download_comments=False,
-            save_metadata=False,
-            compress_json=False,
-            dirname_pattern=download_folder,
-            filename_pattern='{date_utc}_UTC_{typename}',
-        )
-        
+class InstaloaderPool:
+    """
+    Long-lived Instaloader instances lent out one at a time, so their HTTP
+    sessions (cookies, keep-alive connections) survive between requests
+    """
+    def __init__(self, size):
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create(self):
+        # Only used for metadata; media files are fetched by media_downloader
+        return instaloader.Instaloader(quiet=True, download_video_thumbnails=False,
+                                       save_metadata=False, compress_json=False)
+
+    @contextmanager
+    def borrow(self):
+        with self._lock:
+            create = self._idle.empty() and self._created < self.size
+            if create:
+                self._created += 1
+        loader = self._create() if create else self._idle.get()
+        try:
+            yield loader
+        finally:
+            self._idle.put(loader)
+
+instaloader_pool = InstaloaderPool(app.config['INSTALOADER_POOL_SIZE'])
+
+def cdn_url_expiry(url):
+    """
+    Expiry time of an Instagram CDN URL (the oe= parameter is a hex Unix time)
+    """
+    match = re.search(r'[?&]oe=([0-9A-Fa-f]+)', url or '')
+    return int(match.group(1), 16) if match else None
+
+def instagram_post_ttl(post_info):
+    """
+    Seconds until the first media URL of a resolved post expires
+    """
+    urls = [post_info['url'], post_info['video_url']]
+    urls += [url for node in post_info['nodes'] for url in (node['display_url'], node['video_url'])]
+    expiries = [expiry for expiry in map(cdn_url_expiry, urls) if expiry]
+    if not expiries:
+        return app.config['INSTAGRAM_POST_CACHE_TTL']
+    return min(expiries) - app.config['INSTAGRAM_URL_EXPIRY_MARGIN'] - time.time()
+
+instagram_post_cache = InfoCache(app.config['INSTAGRAM_POST_CACHE_SIZE'], app.config['INSTAGRAM_POST_CACHE_TTL'],
+                                 ttl_for=instagram_post_ttl)
+
+@timed_stage('extraction')
+def resolve_instagram_post(shortcode):
+    with instaloader_pool.borrow() as L:
+        post = instaloader.Post.from_shortcode(L.context, shortcode)
+        nodes = []
+        if post.typename == 'GraphSidecar':
+            nodes = [{'is_video': node.is_video, 'video_url': node.video_url, 'display_url': node.display_url}
+                     for node in post.get_sidecar_nodes()]
+        return {
+            'shortcode': shortcode,
+            'typename': post.typename,
+            'is_video': post.is_video,
+            'video_url': post.video_url if post.is_video else None,
+            'url': post.url,
+            'caption': post.caption,
+            'date_utc': post.date_utc,
+            'nodes': nodes,
+        }
+
+def get_instagram_post(shortcode):
+    """
+    Resolved post metadata for shortcode, shared between preview and download
+    """
+    return instagram_post_cache.get_or_extract(shortcode, lambda: resolve_instagram_post(shortcode))
+
+def instagram_file_base(post):
+    """
+    File name stem for a resolved post, like Instaloader's {date_utc}_UTC_{typename} pattern
+    """
+    return f"{post['date_utc'].strftime('%Y-%m-%d_%H-%M-%S')}_UTC_{post['typename']}"
+
+def instagram_media_items(post, download_folder):
+    """
+    (url, path) of every media file of a resolved post
+    """
+    base = instagram_file_base(post)
+    if post['nodes']:
+        media = [(node['video_url'] if node['is_video'] else node['display_url'], f'{base}_{index}')
+                 for index, node in enumerate(post['nodes'], start=1)]
+    else:
+        media = [(post['video_url'] if post['is_video'] else post['url'], base)]
+
+    items = []
+    for url, name in media:
+        ext = os.path.splitext(urlsplit(url).path)[1] or '.jpg'
+        items.append((url, os.path.join(download_folder, name + ext)))
+    return items
+
+def download_instagram_media(url, download_folder, on_progress=None, job=None):
+    """
+    Download photos/videos from Instagram posts or reels
+    """
+    try:
+        if is_instagram_story(url):
+            return {'success': False, 'message': STORY_LOGIN_MESSAGE}
+
         # Extract shortcode from URL
         shortcode = extract_instagram_shortcode(url)
         if not shortcode:
             return {'success': False, 'message': 'Invalid Instagram URL'}
         
-        # Get the post
-        post = instaloader.Post.from_shortcode(L.context, shortcode)
-        
-        # Download the post
-        L.download_post(post, target=download_folder)
-        
-        # Get downloaded files
+        # Get the post (cached when it was just previewed)
+        post = get_instagram_post(shortcode)
+        os.makedirs(download_folder, exist_ok=True)
+
+        # Sidecar nodes are fetched in parallel; files kept from a paused run are not fetched again
+        items = instagram_media_items(post, download_folder)
+        pending = [(media_url, path) for media_url, path in items if not os.path.exists(path)]
+        results = media_downloader.download_files(pending, on_progress=on_progress, job=job, extractor='Instagram')
+        failed = [result for result in results if not result['success']]
+        if failed:
+            return {'success': False, 'message': f"Error: {failed[0]['error']}"}
+
+        # Same modification time Instaloader gives its files
+        post_time = post['date_utc'].replace(tzinfo=timezone.utc).timestamp()
         downloaded_files = []
-        for file in os.listdir(download_folder):
-            if file.startswith(post.date_utc.strftime('%Y-%m-%d_%H-%M-%S')):
-                downloaded_files.append(file)
+        for _, path in items:
+            os.utime(path, (post_time, post_time))
+            downloaded_files.append(os.path.basename(path))
+
+        if post['caption']:
+            caption_path = os.path.join(download_folder, instagram_file_base(post) + '.txt')
+            with open(caption_path, 'w', encoding='utf-8') as f:
+                f.write(post['caption'])
+            downloaded_files.append(os.path.basename(caption_path))
         
         return {
             'success': True, 
-            'message': f'Downloaded {len(downloaded_files)} file(s) successfully!',
+            'message': f'Downloaded {len(items)} file(s) successfully!',
             'files': downloaded_files,
-            'caption': post.caption if post.caption else 'No caption'
+            'caption': post['caption'] if post['caption'] else 'No caption'
         }
         
+    except JobInterrupted:
+        raise
     except Exception as e:
         return {'success': False, 'message': f'Error: {str(e)}'}
 
 def fetch_instagram_media_info(url):
     try:
-        L = instaloader.Instaloader()
+        if is_instagram_story(url):
+            return {'success': False, 'message': STORY_LOGIN_MESSAGE}
         shortcode = extract_instagram_shortcode(url)
         if not shortcode:
             return {'success': False, 'message': 'Invalid Instagram URL'}
         
-        post = instaloader.Post.from_shortcode(L.context, shortcode)
+        post = get_instagram_post(shortcode)
         
         media_list = []
         
-        if post.typename == 'GraphSidecar':
-            for node in post.get_sidecar_nodes():
-                if node.is_video:
+        if post['typename'] == 'GraphSidecar':
+            for node in post['nodes']:
+                if node['is_video']:
                     media_list.append({
                         'type': 'video',
-                        'url': node.video_url,
-                        'thumbnail': node.display_url,
+                        'url': node['video_url'],
+                        'thumbnail': node['display_url'],
                         'shortcode': shortcode
                     })
                 else:
                     media_list.append({
                         'type': 'image',
-                        'url': node.display_url,
-                        'thumbnail': node.display_url,
+                        'url': node['display_url'],
+                        'thumbnail': node['display_url'],
                         'shortcode': shortcode
                     })
-        elif post.is_video:
+        elif post['is_video']:
             media_list.append({
                 'type': 'video',
-                'url': post.video_url,
-                'thumbnail': post.url,
+                'url': post['video_url'],
+                'thumbnail': post['url'],
                 'shortcode': shortcode
             })
         else:
             media_list.append({
                 'type': 'image',
-                'url': post.url,
-                'thumbnail': post.url,
+                'url': post['url'],
+                'thumbnail': post['url'],
                 'shortcode': shortcode
             })
             
@@ -656,18 +3648,83 @@ def extract_instagram_shortcode(url):
     Extract shortcode from various Instagram URL formats
     """
     patterns = [
-        r'instagram\.com/p/([^/?]+)',
-        r'instagram\.com/reel/([^/?]+)',
-        r'instagram\.com/tv/([^/?]+)',
+        r'instagram\.com/(?:[^/?#]+/)?p/([^/?#]+)',
+        r'instagram\.com/(?:[^/?#]+/)?reels?/([^/?#]+)',
+        r'instagram\.com/(?:[^/?#]+/)?tv/([^/?#]+)',
     ]
     
     for pattern in patterns:
         match = re.search(pattern, url)
         if match:
             return match.group(1)
-    
+
     return None
 
+def is_instagram_story(url):
+    """
+    Story links are StoryItems, which Instagram only serves to a logged-in
+    session; the pooled loaders are anonymous, so these are refused up front
+    """
+    return bool(re.search(r'instagram\.com/stories/', url))
+
+STORY_LOGIN_MESSAGE = 'Instagram stories require a logged-in session and are not supported'
+
+def download_instagram_task(job, url, download_folder):
+    update_job(job, progress=0, message='Downloading from Instagram...')
+
+    def on_progress(percentage):
+        wait_if_paused(job)
+        update_job(job, progress=percentage, message=f'Downloading from Instagram... {percentage:.1f}%')
+
+    result = download_instagram_media(url, download_folder, on_progress, job=job)
+    update_job(job, result=result, message=result['message'],
+               state='finished' if result['success'] else 'error',
+               progress=100 if result['success'] else job['progress'])
+
+def download_instagram_files_task(job, urls, download_folder, timestamp=None):
+    update_job(job, progress=0, message='Starting download...')
+
+    try:
+        safe_download_folder = secure_path(download_folder)
+        if not os.path.exists(safe_download_folder):
+            os.makedirs(safe_download_folder)
+
+        total_files = len(urls)
+        timestamp = timestamp or int(time.time())
+        items = []
+        already_downloaded = []
+        for i, url in enumerate(urls):
+            # Determine extension
+            ext = 'jpg'
+            if 'mp4' in url:
+                ext = 'mp4'
+            filename = f"instagram_{timestamp}_{i}.{ext}"
+            file_path = os.path.join(safe_download_folder, filename)
+            # Files finished before a pause or restart are not fetched again
+            if os.path.exists(file_path):
+                already_downloaded.append(filename)
+            else:
+                items.append((url, file_path))
+
+        update_job(job, message=f'Downloading {total_files} file(s)...')
+
+        def on_progress(percentage):
+            wait_if_paused(job)
+            percentage = (len(already_downloaded) + percentage / 100 * len(items)) / total_files * 100
+            update_job(job, progress=percentage, message=f'Downloading {total_files} file(s)... {percentage:.1f}%')
+
+        results = media_downloader.download_files(items, on_progress=on_progress, job=job, extractor='Instagram')
+        downloaded_files = already_downloaded + [os.path.basename(result['path']) for result in results if result['success']]
+        downloaded_count = len(downloaded_files)
+
+        update_job(job, progress=100, message=f'Downloaded {downloaded_count} files successfully.',
+                   result={'success': True, 'files': downloaded_files})
+
+    except JobInterrupted:
+        raise
+    except Exception as e:
+        update_job(job, state='error', message=f'Error: {str(e)}')
+
 @app.route('/download_instagram', methods=['POST'])
 def download_instagram():
     url = request.form.get('url')
@@ -685,17 +3742,11 @@ def download_instagram():
     except ValueError as e:
         return jsonify({'success': False, 'message': str(e)})
     
-    # Download in a separate thread to avoid blocking
-    def download_thread():
-        result = download_instagram_media(url, download_folder)
-        # Store result for the next status check
-        download_status['instagram_result'] = result
-    
-    thread = threading.Thread(target=download_thread)
-    thread.start()
-    thread.join()  # Wait for download to complete
-    
-    return jsonify(download_status.get('instagram_result', {'success': False, 'message': 'Download failed'}))
+    # Runs on the worker pool; files and caption end up in the job's result
+    job = submit_job(download_instagram_task, args=(url, download_folder),
+                     kind='instagram', priority=get_request_priority(request.form))
+
+    return jsonify({'success': True, 'message': 'Download started', 'job_id': job['job_id']})
 
 @app.route('/fetch_instagram_info', methods=['POST'])
 def fetch_instagram_info_route():
@@ -715,55 +3766,10 @@ def download_instagram_files():
     if not urls:
         return jsonify({'success': False, 'message': 'No files selected'})
 
-    def download_task():
-        global download_status
-        download_status['is_downloading'] = True
-        download_status['progress'] = 0
-        download_status['message'] = 'Starting download...'
-        
-        try:
-            safe_download_folder = secure_path(download_folder)
-            if not os.path.exists(safe_download_folder):
-                os.makedirs(safe_download_folder)
-                
-            total_files = len(urls)
-            downloaded_count = 0
-            
-            for i, url in enumerate(urls):
-                download_status['message'] = f'Downloading file {i+1} of {total_files}'
-                download_status['progress'] = int((i / total_files) * 100)
-                
-                # Determine extension
-                ext = 'jpg'
-                if 'mp4' in url:
-                    ext = 'mp4'
-                
-                filename = f"instagram_{int(time.time())}_{downloaded_count}.{ext}"
-                
-                # Use requests to download
-                try:
-                    response = requests.get(url, stream=True)
-                    if response.status_code == 200:
-                        file_path = os.path.join(safe_download_folder, filename)
-                        with open(file_path, 'wb') as f:
-                            for chunk in response.iter_content(1024):
-                                f.write(chunk)
-                        downloaded_count += 1
-                except Exception as e:
-                    print(f"Error downloading {url}: {e}")
-                    
-            download_status['progress'] = 100
-            download_status['message'] = f'Downloaded {downloaded_count} files successfully.'
-            
-        except Exception as e:
-            download_status['message'] = f'Error: {str(e)}'
-        finally:
-            download_status['is_downloading'] = False
+    job = submit_job(download_instagram_files_task, args=(urls, download_folder, int(time.time())),
+                     kind='instagram_files', priority=get_request_priority(data))
 
-    thread = threading.Thread(target=download_task)
-    thread.start()
-        
-    return jsonify({'success': True, 'message': 'Download started'})
+    return jsonify({'success': True, 'message': 'Download started', 'job_id': job['job_id']})
 
 @app.route('/download_instagram_single', methods=['POST'])
 def download_instagram_single():
@@ -785,12 +3791,7 @@ def download_instagram_single():
         filepath = os.path.join(download_folder, filename)
         
         # Download the media
-        response = requests.get(media_url, stream=True)
-        response.raise_for_status()
-        
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        media_downloader.download_file(media_url, filepath, extractor='Instagram')
         
         return jsonify({
             'success': True,
@@ -808,15 +3809,7 @@ def proxy_image():
         return "URL required", 400
     
     try:
-        # Fetch the image from the external URL
-        resp = requests.get(url, stream=True)
-        
-        # Pass along the content type and the content
-        excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-        headers = [(name, value) for (name, value) in resp.raw.headers.items()
-                   if name.lower() not in excluded_headers]
-        
-        return Response(resp.content, resp.status_code, headers)
+        return serve_proxied_image(url)
     except Exception as e:
         return str(e), 500
 
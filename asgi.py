@@ -0,0 +1,383 @@
+"""
+Async serving mode for the Universal Downloader.
+
+The I/O-bound routes (/proxy_image, /download_thumbnail_proxy, /fetch_title,
+/fetch_instagram_info) run on the event loop: proxying uses an async HTTP
+client and the blocking yt-dlp/instaloader calls run on a bounded thread pool.
+Every other route is handed to the Flask app in app.py.
+
+Run with:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from werkzeug.formparser import parse_form_data
+from werkzeug.http import http_date, is_resource_modified
+
+import app as core
+from app import app as flask_app
+from proxy_cache import new_proxy_meta, proxy_conditional_headers, proxy_passthrough_headers
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+wsgi_executor = ThreadPoolExecutor(max_workers=flask_app.config['ASYNC_WSGI_WORKERS'],
+                                   thread_name_prefix='asgi-wsgi')
+
+
+class PooledWsgiToAsgiInstance(WsgiToAsgiInstance):
+    """
+    asgiref runs WSGI requests thread-sensitively, i.e. all on one shared
+    thread, so one open /events stream or /downloads transfer would hold up
+    every other Flask route. Each request gets a thread of its own here.
+    """
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.run_wsgi_app.__wrapped__, thread_sensitive=False,
+                                 executor=wsgi_executor)
+
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await PooledWsgiToAsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+wsgi_application = PooledWsgiToAsgi(flask_app)
+blocking_executor = ThreadPoolExecutor(max_workers=flask_app.config['ASYNC_BLOCKING_WORKERS'],
+                                       thread_name_prefix='asgi-blocking')
+_http_client = None
+_host_slots = OrderedDict()  # host -> {'limit', 'semaphore', 'users'}, least recently used first
+
+
+# --- HTTP Client ---
+def get_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            headers={'User-Agent': core.COMMON_USER_AGENT},
+            timeout=httpx.Timeout(flask_app.config['HTTP_READ_TIMEOUT'],
+                                  connect=flask_app.config['HTTP_CONNECT_TIMEOUT']),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=100),
+            follow_redirects=True,
+        )
+    return _http_client
+
+
+@asynccontextmanager
+async def host_slot(url):
+    """
+    Cap concurrent connections to one host, like the pool in app.py. Only
+    HTTP_MAX_HOST_POOLS hosts are remembered; idle ones are dropped first.
+    """
+    host = urlsplit(url).hostname
+    limit = flask_app.config['HTTP_MAX_CONNECTIONS_PER_HOST']
+    slot = _host_slots.get(host)
+    # A new semaphore when /admin/scheduler changed the limit; holders of the old one finish normally
+    if slot is None or slot['limit'] != limit:
+        slot = {'limit': limit, 'semaphore': asyncio.Semaphore(limit), 'users': 0}
+        _host_slots[host] = slot
+    _host_slots.move_to_end(host)
+    slot['users'] += 1
+    try:
+        async with slot['semaphore']:
+            yield
+    finally:
+        slot['users'] -= 1
+        idle = [name for name, entry in _host_slots.items() if not entry['users']]
+        for name in idle[:max(0, len(_host_slots) - flask_app.config['HTTP_MAX_HOST_POOLS'])]:
+            del _host_slots[name]
+
+
+async def http_get_stream(url, headers=None):
+    """
+    Streamed GET with the same retry/backoff policy as app.http_request.
+    The caller must aclose() the returned response.
+    """
+    host = urlsplit(url).hostname
+    client = get_http_client()
+    attempts = flask_app.config['HTTP_RETRIES'] + 1
+    for attempt in range(attempts):
+        core.record_http_event(host, 'requests')
+        try:
+            response = await client.send(client.build_request('GET', url, headers=headers), stream=True)
+        except httpx.HTTPError:
+            core.record_http_event(host, 'errors')
+            if attempt == attempts - 1:
+                raise
+        else:
+            if response.status_code >= 400:
+                core.record_http_event(host, 'errors')
+            if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                return response
+            await response.aclose()
+        core.record_http_event(host, 'retries')
+        await asyncio.sleep(flask_app.config['HTTP_RETRY_BACKOFF'] * (2 ** attempt))
+
+
+# --- Responses ---
+async def send_response(send, status, headers, body=b''):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.lower().encode('latin-1'), str(value).encode('latin-1'))
+                            for name, value in headers.items()]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, data, status=200):
+    await send_response(send, status, {'Content-Type': 'application/json'}, json.dumps(data).encode('utf-8'))
+
+
+async def send_text(send, text, status):
+    await send_response(send, status, {'Content-Type': 'text/plain; charset=utf-8'}, text.encode('utf-8'))
+
+
+async def send_stream(send, status, headers, chunks):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.lower().encode('latin-1'), str(value).encode('latin-1'))
+                            for name, value in headers.items()]})
+    async for chunk in chunks:
+        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def request_header(scope, name):
+    name = name.lower().encode('latin-1')
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+async def read_form(scope, receive):
+    """
+    Parse a urlencoded or multipart body with werkzeug, like request.form
+    """
+    body = bytearray()
+    while True:
+        message = await receive()
+        body.extend(message.get('body', b''))
+        if len(body) > flask_app.config['MAX_CONTENT_LENGTH']:
+            return None
+        if not message.get('more_body'):
+            break
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'CONTENT_TYPE': request_header(scope, 'content-type') or '',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(bytes(body)),
+    }
+    _, form, _ = parse_form_data(environ)
+    return form
+
+
+# --- Proxy Routes ---
+async def run_blocking(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(blocking_executor, function, *args)
+
+
+async def file_chunks(path):
+    """
+    Read path in PROXY_CHUNK_SIZE pieces off the event loop
+    """
+    f = await run_blocking(open, path, 'rb')
+    try:
+        while True:
+            chunk = await run_blocking(f.read, flask_app.config['PROXY_CHUNK_SIZE'])
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        await run_blocking(f.close)
+
+
+async def send_cached_entry(scope, send, meta, download_name=None):
+    etag = f'"{meta["digest"]}"'
+    headers = {
+        'Content-Type': meta['content_type'],
+        'ETag': etag,
+        'Last-Modified': http_date(meta['stored_at']),
+        'Cache-Control': f"public, max-age={max(0, round(meta['expires_at'] - time.time()))}",
+    }
+    if download_name is not None:
+        headers['Content-Disposition'] = f'attachment; filename={download_name}'
+
+    # Same If-None-Match / If-Modified-Since rules as send_file in app.send_cached_file
+    environ = {'REQUEST_METHOD': scope.get('method', 'GET'),
+               'HTTP_IF_NONE_MATCH': request_header(scope, 'if-none-match') or '',
+               'HTTP_IF_MODIFIED_SINCE': request_header(scope, 'if-modified-since') or ''}
+    if not is_resource_modified(environ, etag=meta['digest'], last_modified=datetime.fromtimestamp(meta['stored_at'], timezone.utc)):
+        await send_response(send, 304, headers)
+        return
+
+    headers['Content-Length'] = await run_blocking(os.path.getsize, meta['body_path'])
+    await send_stream(send, 200, headers, file_chunks(meta['body_path']))
+
+
+async def limited_chunks(resp, max_bytes):
+    sent = 0
+    async for chunk in resp.aiter_bytes(flask_app.config['PROXY_CHUNK_SIZE']):
+        sent += len(chunk)
+        if sent > max_bytes:
+            raise IOError(f"Proxy body exceeded {max_bytes} bytes: {resp.url}")
+        # Same global bucket as app.stream_limited, waited on without blocking the loop
+        wait = core.bandwidth.global_bucket.reserve(len(chunk))
+        if wait:
+            await asyncio.sleep(wait)
+        yield chunk
+
+
+async def chunks_into_cache(url, resp, meta, content_length=None):
+    """
+    Async counterpart of app.stream_into_cache
+    """
+    tmp_path = await run_blocking(core.proxy_cache.new_temp_path)
+    digest = hashlib.sha256()
+    received = 0
+    try:
+        f = await run_blocking(open, tmp_path, 'wb')
+        try:
+            async for chunk in limited_chunks(resp, flask_app.config['PROXY_MAX_BODY_BYTES']):
+                await run_blocking(f.write, chunk)
+                digest.update(chunk)
+                received += len(chunk)
+                yield chunk
+        finally:
+            await run_blocking(f.close)
+        if content_length is None or received == content_length:
+            meta['digest'] = digest.hexdigest()[:32]
+            # Takes the cache lock and may evict entries
+            await run_blocking(core.proxy_cache.store, url, tmp_path, meta)
+    finally:
+        await run_blocking(remove_if_exists, tmp_path)
+
+
+def remove_if_exists(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+async def proxy_route(scope, receive, send, download_name=None):
+    """
+    Async counterpart of app.serve_proxied_image, sharing its disk cache
+    """
+    url = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('url', [None])[0]
+    if not url:
+        await send_text(send, "URL required", 400)
+        return
+
+    # Timed like app.serve_proxied_image: until the response can start
+    started = time.monotonic()
+    proxy_cache = core.proxy_cache
+    meta = await run_blocking(proxy_cache.lookup, url)
+    if meta and meta['expires_at'] > time.time():
+        proxy_cache.count('hits')
+        await run_blocking(proxy_cache.touch, url)
+        core.observe_stage('proxy', time.monotonic() - started)
+        await send_cached_entry(scope, send, meta, download_name)
+        return
+
+    async with host_slot(url):
+        try:
+            resp = await http_get_stream(url, headers=proxy_conditional_headers(meta))
+        except httpx.HTTPError as e:
+            await send_text(send, str(e), 500)
+            return
+        finally:
+            core.observe_stage('proxy', time.monotonic() - started)
+
+        try:
+            if meta and resp.status_code == 304:
+                proxy_cache.count('revalidated')
+                meta['expires_at'] = time.time() + (proxy_cache.lifetime(resp.headers) or 0)
+                await run_blocking(proxy_cache.save_meta, url, meta)
+                await send_cached_entry(scope, send, meta, download_name)
+                return
+
+            max_bytes = flask_app.config['PROXY_MAX_BODY_BYTES']
+            headers, content_length = proxy_passthrough_headers(resp.headers, download_name)
+            if content_length is not None and content_length > max_bytes:
+                await send_text(send, f"Upstream body too large ({content_length} bytes)", 502)
+                return
+            headers['Content-Type'] = resp.headers.get('Content-Type', 'image/jpeg')
+
+            if resp.status_code != 200:
+                await send_stream(send, resp.status_code, headers, limited_chunks(resp, max_bytes))
+                return
+
+            proxy_cache.count('misses')
+            lifetime = proxy_cache.lifetime(resp.headers)
+            if lifetime is None:
+                headers['Cache-Control'] = 'no-store'
+                await send_stream(send, 200, headers, limited_chunks(resp, max_bytes))
+                return
+
+            meta = new_proxy_meta(url, resp.headers, lifetime)
+            headers['Cache-Control'] = f'public, max-age={lifetime}'
+            await send_stream(send, 200, headers, chunks_into_cache(url, resp, meta, content_length))
+        finally:
+            await resp.aclose()
+
+
+# --- Metadata Routes ---
+async def fetch_title_route(scope, receive, send):
+    form = await read_form(scope, receive)
+    if form is None:
+        await send_text(send, "Request body too large", 413)
+        return
+    await send_json(send, await run_blocking(core.fetch_title_info, form.get('url')))
+
+
+async def fetch_instagram_info_route(scope, receive, send):
+    form = await read_form(scope, receive)
+    if form is None:
+        await send_text(send, "Request body too large", 413)
+        return
+    url = form.get('url')
+    if not url:
+        await send_json(send, {'success': False, 'message': 'URL is required'})
+        return
+    await send_json(send, await run_blocking(core.fetch_instagram_media_info, url))
+
+
+ASYNC_ROUTES = {
+    ('GET', '/proxy_image'): proxy_route,
+    ('GET', '/download_thumbnail_proxy'): lambda scope, receive, send: proxy_route(
+        scope, receive, send, download_name='thumbnail.jpg'),
+    ('POST', '/fetch_title'): fetch_title_route,
+    ('POST', '/fetch_instagram_info'): fetch_instagram_info_route,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _http_client is not None:
+                await _http_client.aclose()
+            blocking_executor.shutdown(wait=False)
+            wsgi_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    route = ASYNC_ROUTES.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+    if route is None:
+        await wsgi_application(scope, receive, send)
+        return
+    await route(scope, receive, send)
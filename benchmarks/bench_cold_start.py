@@ -0,0 +1,88 @@
+"""
+Measure cold-start cost of app.py: module import time and the latency of
+the first request to a few routes, each in a fresh interpreter.
+
+    python benchmarks/bench_cold_start.py --runs 10
+
+Runs with LAZY_IMPORTS=1 (heavy modules imported on first use) and
+LAZY_IMPORTS=0 (everything imported up front). The first /fetch_title
+request pays for importing yt_dlp in lazy mode; the URL is unroutable so
+no network is involved. Results are printed as JSON.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints one JSON object
+PROBE = r'''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+timings = {'import': imported - started}
+for name, method, path, data in ROUTES:
+    before = time.perf_counter()
+    getattr(client, method)(path, data=data)
+    timings[name] = time.perf_counter() - before
+timings['total'] = time.perf_counter() - started
+timings['modules'] = len(sys.modules)
+print(json.dumps(timings))
+'''
+
+ROUTES = [
+    ('first_get_status', 'get', '/get_status', None),
+    ('first_index', 'get', '/', None),
+    ('first_fetch_title', 'post', '/fetch_title', {'url': 'http://127.0.0.1:9/unreachable.mp4'}),
+]
+
+
+def run_once(lazy, env):
+    env = dict(env, LAZY_IMPORTS='1' if lazy else '0')
+    code = f'ROUTES = {ROUTES!r}\n' + PROBE
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    summary = {}
+    for key in samples[0]:
+        values = sorted(sample[key] for sample in samples)
+        if key == 'modules':
+            summary[key] = values[-1]
+            continue
+        summary[key] = {
+            'median_ms': round(statistics.median(values) * 1000, 1),
+            'p95_ms': round(values[min(len(values) - 1, int(0.95 * len(values)))] * 1000, 1),
+            'max_ms': round(values[-1] * 1000, 1),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters per mode')
+    parser.add_argument('--modes', nargs='+', default=['lazy', 'eager'], choices=['lazy', 'eager'])
+    args = parser.parse_args()
+
+    env = dict(os.environ, PROXY_CACHE_FOLDER=tempfile.mkdtemp(prefix='bench_cold_start_'))
+    results = {'runs': args.runs, 'python': sys.version.split()[0], 'modes': {}}
+    for mode in args.modes:
+        # One warm-up run so every mode starts with compiled bytecode on disk
+        run_once(mode == 'lazy', env)
+        samples = [run_once(mode == 'lazy', env) for _ in range(args.runs)]
+        results['modes'][mode] = summarize(samples)
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,395 @@
+"""
+Offline end-to-end benchmark of the download pipeline. A local media server
+stands in for the CDNs and a stub yt-dlp extractor / Instaloader Post point
+at it, so /start_download, /download_instagram, /download_instagram_files,
+/proxy_image and /get_status can be driven without YouTube or Instagram.
+
+    python benchmarks/bench_pipeline.py --concurrency 1 4 16 --media-size 8000000 --throttle 4000000
+
+Every scenario gets a fresh app.py server (werkzeug, threaded, like
+`python app.py`) so its peak RSS is its own. The media server answers
+Range requests and can add --latency before every response and --throttle
+each connection. Download scenarios submit a job and poll /get_status until
+it is done, so their latency is end to end. Results are printed as JSON.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# yt-dlp loads extractors from yt_dlp_plugins packages on sys.path; this one
+# answers http://127.0.0.1:<port>/watch/<id> with a progressive MP4 on the media server
+STUB_EXTRACTOR = r'''
+import os
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class BenchIE(InfoExtractor):
+    _VALID_URL = r'https?://127\.0\.0\.1:\d+/watch/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        media_url = os.environ['BENCH_MEDIA_URL']
+        size = int(os.environ['BENCH_MEDIA_SIZE'])
+        return {
+            'id': video_id,
+            'title': f'Bench {video_id}',
+            'duration': 60,
+            'thumbnail': f'{media_url}/media/20000/{video_id}.jpg',
+            'formats': [{
+                'format_id': '360p',
+                'url': f'{media_url}/media/{size}/{video_id}.mp4',
+                'ext': 'mp4',
+                'width': 640,
+                'height': 360,
+                'vcodec': 'avc1.4d401e',
+                'acodec': 'mp4a.40.2',
+                'filesize': size,
+            }],
+        }
+'''
+
+# Runs the app in the child interpreter with Post.from_shortcode stubbed out
+SERVER = r'''
+import datetime, hashlib, logging, os, sys
+import instaloader
+import app
+from werkzeug.serving import make_server
+
+MEDIA_URL = os.environ['BENCH_MEDIA_URL']
+SIZE = int(os.environ['BENCH_MEDIA_SIZE'])
+NODES = int(os.environ['BENCH_INSTAGRAM_FILES'])
+
+
+class StubNode:
+    def __init__(self, url):
+        self.is_video = True
+        self.video_url = url
+        self.display_url = url
+
+
+class StubPost:
+    """
+    The attributes app.resolve_instagram_post reads, as a sidecar of NODES videos
+    """
+    def __init__(self, shortcode):
+        self.shortcode = shortcode
+        self.typename = 'GraphSidecar'
+        self.is_video = False
+        self.video_url = None
+        self.url = f'{MEDIA_URL}/media/20000/{shortcode}.jpg'
+        self.caption = f'Bench post {shortcode}'
+        # Distinct per shortcode, since file names are derived from the date
+        offset = int(hashlib.md5(shortcode.encode()).hexdigest()[:8], 16)
+        self.date_utc = datetime.datetime(2020, 1, 1) + datetime.timedelta(seconds=offset)
+
+    def get_sidecar_nodes(self):
+        return [StubNode(f'{MEDIA_URL}/media/{SIZE}/{self.shortcode}_{index}.mp4') for index in range(NODES)]
+
+
+instaloader.Post.from_shortcode = classmethod(lambda cls, context, shortcode: StubPost(shortcode))
+logging.getLogger('werkzeug').setLevel(logging.ERROR)
+make_server('127.0.0.1', int(sys.argv[1]), app.app, threaded=True).serve_forever()
+'''
+
+# Synthetic media bytes; every file is a window onto this pattern
+PATTERN = bytes(range(256)) * 4096
+CHUNK_SIZE = 64 * 1024
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def start_media_server(port, latency, throttle):
+    """
+    /media/<size>/<name> serves <size> bytes with Range support. latency is
+    added before every response, throttle (bytes/s, 0 = off) paces each
+    connection.
+    """
+    async def write_body(writer, start, end):
+        position = start
+        while position <= end:
+            offset = position % len(PATTERN)
+            chunk = PATTERN[offset:offset + min(CHUNK_SIZE, end - position + 1, len(PATTERN) - offset)]
+            writer.write(chunk)
+            await writer.drain()
+            position += len(chunk)
+            if throttle:
+                await asyncio.sleep(len(chunk) / throttle)
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                method, path = request_line.decode('latin-1').split()[:2]
+                await asyncio.sleep(latency)
+
+                match = re.match(r'/media/(\d+)/[\w.-]+?\.(\w+)$', path.split('?')[0])
+                if not match:
+                    writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+                    await writer.drain()
+                    continue
+                size, ext = int(match[1]), match[2]
+                content_type = 'image/jpeg' if ext == 'jpg' else 'video/mp4'
+                start, end, status = 0, size - 1, '200 OK'
+                requested = re.match(r'bytes=(\d+)-(\d*)', headers.get('range', ''))
+                if requested:
+                    start = int(requested[1])
+                    end = min(int(requested[2]), size - 1) if requested[2] else size - 1
+                    status = '206 Partial Content'
+                head = [f'HTTP/1.1 {status}', f'Content-Type: {content_type}', 'Accept-Ranges: bytes',
+                        'Cache-Control: public, max-age=3600', f'Content-Length: {end - start + 1}']
+                if requested:
+                    head.append(f'Content-Range: bytes {start}-{end}/{size}')
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+                if method != 'HEAD':
+                    await write_body(writer, start, end)
+                else:
+                    await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # Clients drop ranged connections early; connections still open at shutdown are cancelled
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', port, backlog=4096)
+
+
+def start_app(port, env):
+    return subprocess.Popen([sys.executable, '-c', SERVER, str(port)], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def peak_rss_mb(pid):
+    """
+    High-water mark of the process' resident set (Linux only)
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+async def wait_until_ready(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(base_url + '/get_status')
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f'{base_url} did not start')
+
+
+async def wait_for_job(client, base_url, job_id, poll_interval):
+    while True:
+        response = await client.get(f'{base_url}/get_status', params={'job_id': job_id})
+        job = response.json()
+        if job['state'] not in ('queued', 'running'):
+            return job
+        await asyncio.sleep(poll_interval)
+
+
+# --- Scenarios ---
+# Each one performs operation number `index` and returns the media bytes it moved (None = failed)
+async def scenario_start_download(client, ctx, index):
+    response = await client.post(f"{ctx['base_url']}/start_download", data={
+        'url': f"{ctx['media_url']}/watch/{ctx['run_id']}-{index}",
+        'quality': '360p', 'mode': 'Video', 'platform': 'bench',
+        'download_folder': os.path.join(ctx['folder'], f'op-{index}'),
+    })
+    job = await wait_for_job(client, ctx['base_url'], response.json()['job_id'], ctx['poll_interval'])
+    return ctx['media_size'] if job['state'] == 'finished' else None
+
+
+async def scenario_download_instagram(client, ctx, index):
+    response = await client.post(f"{ctx['base_url']}/download_instagram", data={
+        'url': f"https://www.instagram.com/p/B{ctx['run_id']}{index}/",
+        'download_folder': os.path.join(ctx['folder'], f'op-{index}'),
+    })
+    job = await wait_for_job(client, ctx['base_url'], response.json()['job_id'], ctx['poll_interval'])
+    result = job.get('result') or {}
+    return ctx['media_size'] * ctx['instagram_files'] if job['state'] == 'finished' and result.get('success') else None
+
+
+async def scenario_download_instagram_files(client, ctx, index):
+    urls = [f"{ctx['media_url']}/media/{ctx['media_size']}/{ctx['run_id']}-{index}-{n}.mp4"
+            for n in range(ctx['instagram_files'])]
+    response = await client.post(f"{ctx['base_url']}/download_instagram_files", json={
+        'urls': urls, 'download_folder': os.path.join(ctx['folder'], f'op-{index}'),
+    })
+    job = await wait_for_job(client, ctx['base_url'], response.json()['job_id'], ctx['poll_interval'])
+    files = (job.get('result') or {}).get('files') or []
+    return ctx['media_size'] * len(files) if job['state'] == 'finished' and len(files) == len(urls) else None
+
+
+async def scenario_proxy_image(client, ctx, index):
+    # A limited set of images so the proxy cache sees hits as well as misses
+    name = f"{ctx['run_id']}-{index % ctx['proxy_distinct']}.jpg"
+    response = await client.get(f"{ctx['base_url']}/proxy_image",
+                                params={'url': f"{ctx['media_url']}/media/{ctx['proxy_size']}/{name}"})
+    return len(response.content) if response.status_code == 200 else None
+
+
+async def scenario_get_status(client, ctx, index):
+    response = await client.get(f"{ctx['base_url']}/get_status")
+    return 0 if response.status_code == 200 else None
+
+
+SCENARIOS = {
+    'start_download': scenario_start_download,
+    'download_instagram': scenario_download_instagram,
+    'download_instagram_files': scenario_download_instagram_files,
+    'proxy_image': scenario_proxy_image,
+    'get_status': scenario_get_status,
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 4)
+
+
+async def run_level(scenario, ctx, concurrency, rounds, timeout):
+    latencies = []
+    moved = 0
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        async def worker():
+            nonlocal moved, errors
+            for _ in range(rounds):
+                started = time.perf_counter()
+                try:
+                    size = await scenario(client, ctx, next(ctx['sequence']))
+                except (httpx.HTTPError, ValueError, KeyError):
+                    size = None
+                if size is None:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+                moved += size
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'concurrency': concurrency,
+        'operations': concurrency * rounds,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'operations_per_second': round(len(latencies) / elapsed, 2),
+        'megabytes_per_second': round(moved / elapsed / 1e6, 2),
+        'latency_p50': percentile(latencies, 0.50),
+        'latency_p95': percentile(latencies, 0.95),
+        'latency_p99': percentile(latencies, 0.99),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--rounds', type=int, default=3, help='operations per client at each level')
+    parser.add_argument('--media-size', type=int, default=4 * 1024 * 1024, help='bytes per downloaded file')
+    parser.add_argument('--instagram-files', type=int, default=3, help='files per Instagram post/batch')
+    parser.add_argument('--proxy-size', type=int, default=50 * 1024)
+    parser.add_argument('--proxy-distinct', type=int, default=16, help='distinct images behind /proxy_image')
+    parser.add_argument('--latency', type=float, default=0.05, help='media server delay in seconds')
+    parser.add_argument('--throttle', type=int, default=0, help='bytes/s per media connection, 0 = unthrottled')
+    parser.add_argument('--poll-interval', type=float, default=0.05, help='seconds between /get_status polls')
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    media_port = free_port()
+    media_server = await start_media_server(media_port, args.latency, args.throttle)
+    media_url = f'http://127.0.0.1:{media_port}'
+
+    # All app state (downloads, job state, index, proxy cache) lives in a scratch folder so runs
+    # neither touch the real /tmp/downloads nor pick up jobs left by earlier runs. It is set
+    # before app is imported, here and in the server children that inherit the environment.
+    scratch = tempfile.mkdtemp(prefix='bench_pipeline_')
+    os.environ.update(DOWNLOAD_FOLDER=os.path.join(scratch, 'downloads'),
+                      JOB_STATE_PATH=os.path.join(scratch, 'job_state.sqlite3'),
+                      DOWNLOAD_INDEX_PATH=os.path.join(scratch, 'download_index.sqlite3'),
+                      PROXY_CACHE_FOLDER=os.path.join(scratch, 'proxy_cache'))
+
+    # Downloads must land inside the app's DOWNLOAD_FOLDER (see secure_path)
+    sys.path.insert(0, ROOT)
+    from app import app as flask_app
+    plugin_dir = os.path.join(scratch, 'plugins', 'yt_dlp_plugins', 'extractor')
+    os.makedirs(plugin_dir)
+    with open(os.path.join(plugin_dir, 'bench.py'), 'w') as f:
+        f.write(STUB_EXTRACTOR)
+
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(filter(None, [os.path.join(scratch, 'plugins'), os.environ.get('PYTHONPATH')])),
+               BENCH_MEDIA_URL=media_url,
+               BENCH_MEDIA_SIZE=str(args.media_size),
+               BENCH_INSTAGRAM_FILES=str(args.instagram_files),
+               HTTP_MAX_CONNECTIONS_PER_HOST=str(max(args.concurrency) * 4))
+
+    results = {'media_size': args.media_size, 'latency': args.latency, 'throttle': args.throttle,
+               'rounds': args.rounds, 'python': sys.version.split()[0], 'scenarios': {}}
+    folder = os.path.join(flask_app.config['DOWNLOAD_FOLDER'], f'bench-{uuid.uuid4().hex[:8]}')
+    try:
+        for name in args.scenarios:
+            port = free_port()
+            server = start_app(port, env)
+            try:
+                ctx = {
+                    'base_url': f'http://127.0.0.1:{port}', 'media_url': media_url,
+                    'run_id': uuid.uuid4().hex[:8], 'folder': os.path.join(folder, name),
+                    'media_size': args.media_size, 'instagram_files': args.instagram_files,
+                    'proxy_size': args.proxy_size, 'proxy_distinct': args.proxy_distinct,
+                    'poll_interval': args.poll_interval,
+                    'sequence': itertools.count(),  # operation numbers, unique within the scenario
+                }
+                await wait_until_ready(ctx['base_url'])
+                levels = [await run_level(SCENARIOS[name], ctx, level, args.rounds, args.timeout)
+                          for level in args.concurrency]
+                results['scenarios'][name] = {'levels': levels, 'peak_rss_mb': peak_rss_mb(server.pid)}
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        media_server.close()
+        shutil.rmtree(folder, ignore_errors=True)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,161 @@
+"""
+Compare how many concurrent /proxy_image requests the sync deployment
+(gunicorn sync workers on app.py) and the async deployment (uvicorn on
+asgi.py) can hold against a slow upstream.
+
+    python benchmarks/bench_proxy_concurrency.py --concurrency 10 50 200 1000
+
+Both servers are started locally; the upstream is an in-process asyncio
+server that answers every request after --latency seconds. Results are
+printed as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def start_upstream(port, latency, body_size):
+    body = b'\xff' * body_size
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b'\r\n', b''):
+                    pass
+                await asyncio.sleep(latency)
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: image/jpeg\r\n'
+                             b'Cache-Control: no-store\r\n'
+                             b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # Connections still open at shutdown are cancelled
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', port, backlog=4096)
+
+
+def start_server(kind, port, workers, env):
+    if kind == 'sync':
+        command = ['gunicorn', '-k', 'sync', '-w', str(workers), '-b', f'127.0.0.1:{port}',
+                   '--backlog', '4096', '--timeout', '120', 'app:app']
+    else:
+        command = ['uvicorn', 'asgi:application', '--host', '127.0.0.1', '--port', str(port),
+                   '--workers', str(workers), '--backlog', '4096', '--log-level', 'warning']
+    return subprocess.Popen(command, cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_until_ready(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(base_url + '/get_status')
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f'{base_url} did not start')
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_level(base_url, upstream_url, concurrency, rounds, timeout):
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        async def one(index):
+            nonlocal errors
+            started = time.perf_counter()
+            try:
+                response = await client.get(f'{base_url}/proxy_image',
+                                            params={'url': f'{upstream_url}/{index}.jpg'})
+                if response.status_code != 200:
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - started)
+            except httpx.HTTPError:
+                errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(concurrency * rounds)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'concurrency': concurrency,
+        'requests': concurrency * rounds,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'latency_p50': percentile(latencies, 0.50),
+        'latency_p95': percentile(latencies, 0.95),
+        'latency_p99': percentile(latencies, 0.99),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 200, 1000])
+    parser.add_argument('--rounds', type=int, default=2, help='requests per client at each level')
+    parser.add_argument('--latency', type=float, default=0.2, help='upstream delay in seconds')
+    parser.add_argument('--body-size', type=int, default=50 * 1024)
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn/uvicorn worker processes')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--modes', nargs='+', default=['sync', 'async'], choices=['sync', 'async'])
+    args = parser.parse_args()
+
+    upstream_port = free_port()
+    upstream = await start_upstream(upstream_port, args.latency, args.body_size)
+    upstream_url = f'http://127.0.0.1:{upstream_port}'
+
+    env = dict(os.environ,
+               PROXY_CACHE_FOLDER=tempfile.mkdtemp(prefix='bench_proxy_cache_'),
+               # Measure the server, not the per-host cap on the upstream
+               HTTP_MAX_CONNECTIONS_PER_HOST=str(max(args.concurrency)))
+
+    results = {'latency': args.latency, 'body_size': args.body_size, 'workers': args.workers, 'modes': {}}
+    for mode in args.modes:
+        port = free_port()
+        server = start_server(mode, port, args.workers, env)
+        try:
+            base_url = f'http://127.0.0.1:{port}'
+            await wait_until_ready(base_url)
+            results['modes'][mode] = [await run_level(base_url, upstream_url, level, args.rounds, args.timeout)
+                                      for level in args.concurrency]
+        finally:
+            server.terminate()
+            server.wait()
+
+    upstream.close()
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,290 @@
+"""
+Direct media downloads (Instagram files, /stream copies): ranged, segmented
+transfers into .part files that survive a pause or cancel and are resumed
+from the saved segment positions.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from jobs import JobInterrupted
+
+def preallocate_file(path, size):
+    with open(path, 'wb') as f:
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass
+        f.truncate(size)
+
+def split_ranges(size, segments):
+    """
+    Split [0, size) into inclusive (start, end) byte ranges
+    """
+    segment_size = -(-size // segments)
+    return [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+
+def load_resume_state(part_path, size=None):
+    """
+    (size, segments) of an interrupted download into part_path, segments
+    being [start, end, position] lists, or None when nothing can be resumed
+    """
+    try:
+        with open(part_path + '.json', 'r') as f:
+            state = json.load(f)
+        on_disk = os.path.getsize(part_path)
+    except (OSError, ValueError):
+        return None
+    segments = state.get('segments')
+    if not segments or (size is not None and state.get('size') != size):
+        return None
+    if any(position > on_disk for _, _, position in segments):
+        return None
+    return state['size'], segments
+
+def save_resume_state(part_path, size, segments):
+    with open(part_path + '.json', 'w') as f:
+        json.dump({'size': size, 'segments': segments}, f)
+
+def discard_part(part_path):
+    for stale in (part_path, part_path + '.json'):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+# .part files being written right now (a download and a /stream tee may aim at the same file)
+_active_parts = set()
+_active_parts_lock = threading.Lock()
+
+def claim_part(part_path):
+    with _active_parts_lock:
+        if part_path in _active_parts:
+            return False
+        _active_parts.add(part_path)
+        return True
+
+def release_part(part_path):
+    with _active_parts_lock:
+        _active_parts.discard(part_path)
+
+def part_in_use(part_path):
+    with _active_parts_lock:
+        return part_path in _active_parts
+
+class TransferStop:
+    """
+    Shared by the segments and files of one transfer. The first JobInterrupted
+    raised by a progress callback is kept, and every other thread raises it
+    at its next chunk instead of running the callback (and its pause wait) again.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.error = None
+        self._lock = threading.Lock()
+
+    def set(self, error):
+        with self._lock:
+            if self.error is None:
+                self.error = error
+                self.event.set()
+
+    def check(self):
+        if self.event.is_set():
+            raise self.error
+
+class MediaDownloader:
+    """
+    Fetches files over the app's shared HTTP pools (http_get), pacing every
+    chunk with the bandwidth scheduler and reporting finished transfers to
+    on_transfer(extractor, size, seconds)
+    """
+    def __init__(self, config, http_get, bandwidth, on_transfer=None):
+        self.config = config
+        self.http_get = http_get
+        self.bandwidth = bandwidth
+        self.on_transfer = on_transfer
+
+    def probe(self, url, headers=None):
+        """
+        Return (size, accepts_ranges) for url using a one-byte ranged GET,
+        which CDNs answer more reliably than HEAD
+        """
+        probe_headers = dict(headers or {}, Range='bytes=0-0')
+        with self.http_get(url, headers=probe_headers, stream=True) as resp:
+            resp.raise_for_status()
+            if resp.status_code == 206:
+                # Content-Range: bytes 0-0/12345
+                total = resp.headers.get('Content-Range', '').rpartition('/')[2]
+                return (int(total) if total.isdigit() else None), True
+            length = resp.headers.get('Content-Length')
+            accepts_ranges = resp.headers.get('Accept-Ranges', '').lower() == 'bytes'
+            return (int(length) if length and length.isdigit() else None), accepts_ranges
+
+    def download_segment(self, url, path, segment, headers, on_bytes):
+        """
+        Fetch segment = [start, end, position] into path from position on,
+        retrying on errors. position is kept current so an interrupted segment
+        can be resumed.
+        """
+        start, end = segment[0], segment[1]
+        for attempt in range(self.config['SEGMENT_RETRIES'] + 1):
+            try:
+                segment_headers = dict(headers, Range=f'bytes={segment[2]}-{end}')
+                with self.http_get(url, headers=segment_headers, stream=True) as resp:
+                    if resp.status_code != 206:
+                        raise IOError(f"Server ignored range request (HTTP {resp.status_code})")
+                    with open(path, 'r+b') as f:
+                        f.seek(segment[2])
+                        for chunk in resp.iter_content(self.config['DOWNLOAD_BUFFER_SIZE']):
+                            f.write(chunk)
+                            segment[2] += len(chunk)
+                            on_bytes(len(chunk))
+                if segment[2] > end:
+                    return
+            except IOError as e:  # requests' exceptions are IOErrors too
+                if attempt == self.config['SEGMENT_RETRIES']:
+                    raise
+                print(f"⚠️ Retrying segment {segment[2]}-{end} of {url}: {e}")
+        raise IOError(f"Segment {start}-{end} ended early at byte {segment[2]}")
+
+    def download_file(self, url, path, headers=None, on_bytes=None, on_size=None, job=None, extractor='direct',
+                      stop=None):
+        """
+        Download url to path. Large files on servers that accept ranges are
+        fetched as concurrent segments written straight to their offsets in a
+        preallocated file; everything else is one streamed GET. Every chunk is
+        paced by the bandwidth scheduler (job's share when given). When a pause
+        or cancel interrupts a ranged download, the .part file is kept with
+        the position of each segment, and the next call continues from there.
+        stop (a TransferStop) is shared with the other files of a batch.
+        """
+        headers = dict(headers or {})
+        callback = on_bytes or (lambda n: None)
+        stop = stop or TransferStop()
+
+        def report_bytes(count):
+            try:
+                callback(count)
+            except JobInterrupted as e:
+                stop.set(e)  # the other segments stop at their next chunk
+                raise
+
+        def on_bytes(count):
+            stop.check()
+            self.bandwidth.consume(count, job)
+            report_bytes(count)
+
+        size, accepts_ranges = self.probe(url, headers)
+        if on_size and size:
+            on_size(size)
+
+        part_path = path + '.part'
+        if not claim_part(part_path):
+            raise IOError(f"{os.path.basename(path)} is being downloaded by another transfer")
+        resumable = bool(accepts_ranges and size)
+        segments = None
+        started = time.monotonic()
+        try:
+            with self.bandwidth.transfer(job):
+                if resumable:
+                    resume = load_resume_state(part_path, size)
+                    if resume:
+                        segments = resume[1]
+                        # Count what is already on disk before asking for the rest
+                        report_bytes(sum(position - start for start, _, position in segments))
+                    else:
+                        count = self.config['SEGMENTS_PER_FILE'] if size >= self.config['SEGMENT_MIN_SIZE'] else 1
+                        segments = [[start, end, start] for start, end in split_ranges(size, max(count, 1))]
+                        preallocate_file(part_path, size)
+                    pending = [segment for segment in segments if segment[2] <= segment[1]]
+                    if pending:
+                        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                            futures = [executor.submit(self.download_segment, url, part_path, segment, headers, on_bytes)
+                                       for segment in pending]
+                            for future in futures:
+                                future.result()
+                else:
+                    with self.http_get(url, headers=headers, stream=True) as resp:
+                        resp.raise_for_status()
+                        with open(part_path, 'wb') as f:
+                            for chunk in resp.iter_content(self.config['DOWNLOAD_BUFFER_SIZE']):
+                                f.write(chunk)
+                                on_bytes(len(chunk))
+                os.replace(part_path, path)
+                discard_part(part_path)
+        except JobInterrupted:
+            if resumable and segments is not None:
+                # Keep the .part; the resume asks for the missing bytes of each segment with Range
+                save_resume_state(part_path, size, segments)
+            else:
+                # Without ranges the server can only send the file from the start again
+                discard_part(part_path)
+            raise
+        except Exception:
+            discard_part(part_path)
+            raise
+        finally:
+            release_part(part_path)
+        size = os.path.getsize(path)
+        if self.on_transfer:
+            self.on_transfer(extractor, size, time.monotonic() - started)
+        return size
+
+    def download_files(self, items, headers=None, on_progress=None, job=None, extractor='direct'):
+        """
+        Download several (url, path) items at once. Returns one result dict per
+        item, in order; on_progress(percentage) reports the overall progress and
+        may raise DownloadPaused (or DownloadCancelled) to stop the whole batch.
+        """
+        progress_lock = threading.Lock()
+        file_sizes = [None] * len(items)
+        file_bytes = [0] * len(items)
+        stop = TransferStop()
+
+        def percentage():
+            # Caller holds progress_lock
+            fractions = [min(done / size, 1.0) if size else 0.0
+                         for done, size in zip(file_bytes, file_sizes)]
+            return sum(fractions) / len(items) * 100
+
+        def report(value):
+            # Outside progress_lock: on_progress may wait out a pause
+            if on_progress:
+                on_progress(value)
+
+        def fetch(index):
+            url, path = items[index]
+
+            def on_size(size):
+                file_sizes[index] = size
+
+            def on_bytes(count):
+                with progress_lock:
+                    file_bytes[index] += count
+                    value = percentage()
+                report(value)
+
+            try:
+                # Files still waiting for a slot do not start once the batch was interrupted
+                stop.check()
+                size = self.download_file(url, path, headers, on_bytes, on_size, job=job, extractor=extractor,
+                                          stop=stop)
+                with progress_lock:
+                    file_sizes[index] = file_bytes[index] = size
+                    value = percentage()
+                report(value)
+                return {'url': url, 'path': path, 'success': True, 'size': size}
+            except JobInterrupted as e:
+                stop.set(e)
+                raise
+            except Exception as e:
+                print(f"Error downloading {url}: {e}")
+                return {'url': url, 'path': path, 'success': False, 'error': str(e)}
+
+        if not items:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.config['PARALLEL_FILE_DOWNLOADS'], len(items))) as executor:
+            return list(executor.map(fetch, range(len(items))))
@@ -0,0 +1,258 @@
+"""
+Job system pieces that do not depend on the Flask app: the exceptions that
+stop a running job, and the backends that share job status between worker
+processes (JOB_STATE_BACKEND). The queue and the workers live in app.py.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+
+class JobInterrupted(Exception):
+    """
+    Raised from a progress callback to stop the job it belongs to
+    """
+
+class DownloadPaused(JobInterrupted):
+    """
+    Raised from a progress callback to give the worker back while paused
+    """
+    def __init__(self):
+        super().__init__("Download paused")
+
+class DownloadCancelled(JobInterrupted):
+    """
+    Raised from a progress callback once the job was cancelled
+    """
+    def __init__(self):
+        super().__init__("Download cancelled")
+
+class JobDetached(Exception):
+    """
+    Raised by a batch job once its items are queued as jobs of their own:
+    the worker is given back and the last item to stop completes the batch
+    """
+
+# Fields whose change is written to the backend at once instead of in the next batch
+JOB_STATE_IMMEDIATE_FIELDS = {'state', 'is_paused', 'finished_at', 'result'}
+
+class JobStateBackend:
+    """
+    Where the public status of jobs is shared between worker processes.
+    The process running a job is its owner: it writes the job's status
+    and applies pause requests other processes leave for it. A networked
+    store (Redis, a database server) would implement the same methods.
+    """
+    shared = True
+
+    def write(self, snapshots, owner):
+        """
+        Store job snapshots (job_snapshot() plus 'parent' and '_version') in one batch
+        """
+        raise NotImplementedError
+
+    def read(self, job_id):
+        """
+        Latest stored snapshot of job_id, or None
+        """
+        raise NotImplementedError
+
+    def latest_id(self):
+        """
+        ID of the most recently created top-level job, or None
+        """
+        raise NotImplementedError
+
+    def request_pause(self, job_id, paused):
+        """
+        Ask the owner of job_id to pause or resume it; False if the job is unknown
+        """
+        raise NotImplementedError
+
+    def take_pause_requests(self, owner):
+        """
+        {job_id: paused} requested for owner's jobs since the last call
+        """
+        raise NotImplementedError
+
+    def request_cancel(self, job_id):
+        """
+        Ask the owner of job_id to cancel it; False if the job is unknown or finished
+        """
+        raise NotImplementedError
+
+    def take_cancel_requests(self, owner):
+        """
+        IDs of owner's jobs cancelled from other processes since the last call
+        """
+        raise NotImplementedError
+
+    def prune(self, cutoff):
+        """
+        Drop jobs that finished before cutoff
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+class LocalJobState(JobStateBackend):
+    """
+    No sharing: every process only knows its own jobs (the jobs dict)
+    """
+    shared = False
+
+    def write(self, snapshots, owner):
+        pass
+
+    def read(self, job_id):
+        return None
+
+    def latest_id(self):
+        return None
+
+    def request_pause(self, job_id, paused):
+        return False
+
+    def take_pause_requests(self, owner):
+        return {}
+
+    def request_cancel(self, job_id):
+        return False
+
+    def take_cancel_requests(self, owner):
+        return []
+
+    def prune(self, cutoff):
+        pass
+
+    def stats(self):
+        return {'backend': 'local'}
+
+class SQLiteJobState(JobStateBackend):
+    """
+    Job status in a SQLite database in WAL mode, for workers on one host.
+    Readers never wait for the writer; each process writes its batches in
+    one transaction. A row is only replaced by a newer version from the
+    same owner, or by a new owner (a job restored by another process).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.batches = 0
+        self.rows_written = 0
+        self._local = threading.local()  # sqlite3 connections are per thread
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                parent TEXT,
+                owner TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                finished_at REAL,
+                snapshot TEXT NOT NULL,
+                pause_requested INTEGER,
+                cancel_requested INTEGER)''')
+            try:
+                # Databases created before cancel requests were shared
+                conn.execute('ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER')
+            except sqlite3.OperationalError:
+                pass
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_created ON jobs (parent, created_at)')
+            self._local.conn = conn
+        return conn
+
+    def write(self, snapshots, owner):
+        if not snapshots:
+            return
+        rows = [(snapshot['job_id'], snapshot.get('parent'), owner, snapshot['_version'], snapshot['created_at'],
+                 snapshot.get('finished_at'), json.dumps({key: value for key, value in snapshot.items()
+                                                          if not key.startswith('_')}))
+                for snapshot in snapshots]
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany('''INSERT INTO jobs (job_id, parent, owner, version, created_at, finished_at, snapshot)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?)
+                                  ON CONFLICT (job_id) DO UPDATE SET
+                                      owner=excluded.owner, version=excluded.version,
+                                      finished_at=excluded.finished_at, snapshot=excluded.snapshot
+                                  WHERE excluded.owner != jobs.owner OR excluded.version > jobs.version''', rows)
+        self.batches += 1
+        self.rows_written += len(rows)
+
+    def read(self, job_id):
+        row = self._connection().execute('SELECT owner, finished_at, snapshot FROM jobs WHERE job_id=?',
+                                         (job_id,)).fetchone()
+        if row is None:
+            return None
+        owner, finished_at, snapshot = row
+        snapshot = json.loads(snapshot)
+        if finished_at is None and not job_owner_alive(owner):
+            # Until a restarted worker restores it from its manifest
+            snapshot.update(is_downloading=False, message='Interrupted: the worker running this job exited')
+        return snapshot
+
+    def latest_id(self):
+        row = self._connection().execute(
+            'SELECT job_id FROM jobs WHERE parent IS NULL ORDER BY created_at DESC LIMIT 1').fetchone()
+        return row[0] if row else None
+
+    def request_pause(self, job_id, paused):
+        cursor = self._connection().execute('UPDATE jobs SET pause_requested=? WHERE job_id=? AND finished_at IS NULL',
+                                            (int(paused), job_id))
+        return cursor.rowcount > 0
+
+    def take_pause_requests(self, owner):
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            requests_ = conn.execute('SELECT job_id, pause_requested FROM jobs WHERE owner=? AND pause_requested IS NOT NULL',
+                                     (owner,)).fetchall()
+            if requests_:
+                conn.execute('UPDATE jobs SET pause_requested=NULL WHERE owner=? AND pause_requested IS NOT NULL', (owner,))
+        return {job_id: bool(paused) for job_id, paused in requests_}
+
+    def request_cancel(self, job_id):
+        cursor = self._connection().execute('UPDATE jobs SET cancel_requested=1 WHERE job_id=? AND finished_at IS NULL',
+                                            (job_id,))
+        return cursor.rowcount > 0
+
+    def take_cancel_requests(self, owner):
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            requests_ = conn.execute('SELECT job_id FROM jobs WHERE owner=? AND cancel_requested IS NOT NULL',
+                                     (owner,)).fetchall()
+            if requests_:
+                conn.execute('UPDATE jobs SET cancel_requested=NULL WHERE owner=? AND cancel_requested IS NOT NULL', (owner,))
+        return [job_id for job_id, in requests_]
+
+    def prune(self, cutoff):
+        self._connection().execute('DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?', (cutoff,))
+
+    def stats(self):
+        count = self._connection().execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+        return {'backend': 'sqlite', 'jobs': count, 'batches': self.batches, 'rows_written': self.rows_written}
+
+def job_owner_alive(owner):
+    """
+    False only when owner is a process on this host that has exited
+    """
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
@@ -0,0 +1,181 @@
+"""
+Disk cache for proxied images and thumbnails, shared by the Flask routes
+and the ASGI proxy, plus the header helpers both use to revalidate entries.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+class ProxyCache:
+    """
+    Content cache on disk keyed by URL hash. Each entry is <hash>.body plus
+    <hash>.json metadata; the metadata mtime is the LRU clock.
+    """
+    def __init__(self, folder, max_bytes, default_ttl):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl  # for responses without Cache-Control
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._total_bytes = None  # computed from disk on first use
+        self._lock = threading.Lock()
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, key + '.body'), os.path.join(self.folder, key + '.json')
+
+    def count(self, event):
+        """
+        Bump the hits/misses/revalidated counter; requests update these from many threads
+        """
+        with self._lock:
+            setattr(self, event, getattr(self, event) + 1)
+
+    def lookup(self, url):
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(body_path):
+            return None
+        meta['body_path'] = body_path
+        return meta
+
+    def touch(self, url):
+        try:
+            os.utime(self._paths(url)[1])
+        except OSError:
+            pass
+
+    def save_meta(self, url, meta):
+        meta_path = self._paths(url)[1]
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({key: value for key, value in meta.items() if key != 'body_path'}, f)
+        os.replace(tmp_path, meta_path)
+
+    def new_temp_path(self):
+        os.makedirs(self.folder, exist_ok=True)
+        return os.path.join(self.folder, uuid.uuid4().hex + '.tmp')
+
+    def store(self, url, tmp_path, meta):
+        """
+        Move a fully written temp file into the cache and return its metadata
+        """
+        body_path = self._paths(url)[0]
+        size = os.path.getsize(tmp_path)
+        with self._lock:
+            self._count_bytes()
+            old_size = os.path.getsize(body_path) if os.path.exists(body_path) else 0
+            os.replace(tmp_path, body_path)
+            self.save_meta(url, meta)
+            self._total_bytes += size - old_size
+        self.evict()
+        return dict(meta, body_path=body_path)
+
+    def _count_bytes(self):
+        if self._total_bytes is None:
+            self._total_bytes = 0
+            if os.path.isdir(self.folder):
+                for name in os.listdir(self.folder):
+                    if name.endswith('.body'):
+                        self._total_bytes += os.path.getsize(os.path.join(self.folder, name))
+
+    def evict(self):
+        """
+        Drop least recently used entries until the cache fits its byte budget
+        """
+        with self._lock:
+            self._count_bytes()
+            if self._total_bytes <= self.max_bytes:
+                return
+            entries = []
+            for name in os.listdir(self.folder):
+                if name.endswith('.json'):
+                    meta_path = os.path.join(self.folder, name)
+                    try:
+                        entries.append((os.path.getmtime(meta_path), meta_path))
+                    except OSError:
+                        pass
+            for _, meta_path in sorted(entries):
+                if self._total_bytes <= self.max_bytes:
+                    break
+                body_path = meta_path[:-len('.json')] + '.body'
+                try:
+                    size = os.path.getsize(body_path)
+                    os.remove(body_path)
+                    self._total_bytes -= size
+                except OSError:
+                    pass
+                try:
+                    os.remove(meta_path)
+                except OSError:
+                    pass
+
+    def lifetime(self, headers):
+        """
+        Seconds a response may be served without revalidation, or None when
+        it must not be stored at all
+        """
+        cache_control = headers.get('Cache-Control', '').lower()
+        if 'no-store' in cache_control:
+            return None
+        if 'no-cache' in cache_control:
+            return 0
+        # This cache is shared by every client, so s-maxage wins over max-age
+        match = re.search(r's-maxage=(\d+)', cache_control) or re.search(r'max-age=(\d+)', cache_control)
+        if match:
+            return int(match.group(1))
+        return self.default_ttl
+
+    def stats(self):
+        with self._lock:
+            self._count_bytes()
+            return {'bytes': self._total_bytes, 'max_bytes': self.max_bytes, 'hits': self.hits,
+                    'misses': self.misses, 'revalidated': self.revalidated}
+
+def proxy_conditional_headers(meta):
+    """
+    Validators for revalidating a stale cache entry against the origin
+    """
+    headers = {}
+    if meta:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    return headers
+
+def proxy_passthrough_headers(upstream_headers, download_name=None):
+    """
+    Response headers copied from the origin, plus its declared body length
+    """
+    content_length = upstream_headers.get('Content-Length')
+    content_length = int(content_length) if content_length and content_length.isdigit() else None
+    headers = {}
+    # HTTP clients decode compressed bodies, so the upstream length only holds for identity encoding
+    if content_length is not None and upstream_headers.get('Content-Encoding', 'identity') == 'identity':
+        headers['Content-Length'] = str(content_length)
+    if upstream_headers.get('Last-Modified'):
+        headers['Last-Modified'] = upstream_headers['Last-Modified']
+    if download_name is not None:
+        headers['Content-Disposition'] = f'attachment; filename={download_name}'
+    return headers, content_length
+
+def new_proxy_meta(url, upstream_headers, lifetime):
+    now = time.time()
+    return {
+        'url': url,
+        'content_type': upstream_headers.get('Content-Type', 'image/jpeg'),
+        'etag': upstream_headers.get('ETag'),
+        'last_modified': upstream_headers.get('Last-Modified'),
+        'stored_at': now,
+        'expires_at': now + lifetime,
+    }
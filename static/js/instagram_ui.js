@@ -146,7 +146,7 @@ async function downloadInstagramFiles(urls) {
         
         if (data.success) {
             // Start polling for status
-            startStatusPolling();
+            startStatusPolling(data.job_id);
         } else {
             alert('Error: ' + data.message);
             document.getElementById('status-message').innerText = "Download failed";
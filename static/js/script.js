@@ -1,5 +1,10 @@
 let isDownloading = false;
 let statusInterval = null;
+let statusEvents = null;
+let currentJobId = null;
+const fetchedTitles = {};
+// Platforms whose fetched URL is a playlist or channel (downloaded as a batch)
+const fetchedPlaylists = {};
 
 function playMusic() {
     const audio = document.getElementById('download-music');
@@ -53,10 +58,17 @@ async function fetchTitle(platform) {
         if (data.success) {
             document.getElementById(`${platform}-info`).style.display = 'flex';
             document.getElementById(`${platform}-title`).innerText = data.title;
+            fetchedTitles[platform] = data.title;
+            fetchedPlaylists[platform] = data.is_playlist;
             if (data.thumbnail) {
                 document.getElementById(`${platform}-thumbnail`).src = data.thumbnail;
             }
-            document.getElementById('status-message').innerText = "Video found!";
+            document.getElementById('status-message').innerText = data.is_playlist
+                ? `Playlist found (${data.playlist_count || '?'} videos)`
+                : "Video found!";
+            if (!data.is_playlist) {
+                showFormatInfo(platform, url);
+            }
         } else {
             alert('Error: ' + data.title);
             document.getElementById('status-message').innerText = "Error fetching info";
@@ -67,12 +79,33 @@ async function fetchTitle(platform) {
     }
 }
 
-async function startDownload(platform) {
-    if (isDownloading) {
-        alert('A download is already in progress');
-        return;
+// Show which format the server would download and roughly how big it is
+async function showFormatInfo(platform, url) {
+    const formData = new FormData();
+    formData.append('url', url);
+    formData.append('quality', document.getElementById(`${platform}-quality`).value);
+    formData.append('mode', document.getElementById(`${platform}-mode`).value);
+    formData.append('audio_format', document.getElementById(`${platform}-audio-format`).value);
+
+    try {
+        const response = await fetch('/format_info', { method: 'POST', body: formData });
+        const data = await response.json();
+        if (!data.success || !data.format) return;
+
+        const format = data.format;
+        const parts = [];
+        if (format.height) parts.push(`${format.height}p`);
+        if (format.ext) parts.push(format.ext);
+        if (format.estimated_size) parts.push(`~${(format.estimated_size / (1024 * 1024)).toFixed(1)} MB`);
+        if (parts.length) {
+            document.getElementById('status-message').innerText = `Video found! (${parts.join(', ')})`;
+        }
+    } catch (error) {
+        console.error('Error fetching format info:', error);
     }
+}
 
+async function startDownload(platform) {
     playMusic();
 
     const formData = new FormData();
@@ -98,9 +131,8 @@ async function startDownload(platform) {
             const data = await response.json();
             
             if (data.success) {
-                stopMusic();
-                document.getElementById('status-message').innerText = data.message;
-                alert(data.message);
+                // Returns right away; progress and the result arrive as job status
+                startStatusPolling(data.job_id);
             } else {
                 stopMusic();
                 alert('Error: ' + data.message);
@@ -116,6 +148,7 @@ async function startDownload(platform) {
         const url = document.getElementById(`${platform}-url`).value;
         const quality = document.getElementById(`${platform}-quality`).value;
         const mode = document.getElementById(`${platform}-mode`).value;
+        const audioFormat = document.getElementById(`${platform}-audio-format`).value;
         const folder = document.getElementById(`${platform}-folder`).value;
         
         if (!url) {
@@ -126,18 +159,21 @@ async function startDownload(platform) {
         formData.append('url', url);
         formData.append('quality', quality);
         formData.append('mode', mode);
+        formData.append('audio_format', audioFormat);
         formData.append('download_folder', folder);
         formData.append('platform', platform);
+        formData.append('title', fetchedTitles[platform] || '');
         
         try {
-            const response = await fetch('/start_download', {
+            const endpoint = fetchedPlaylists[platform] ? '/start_playlist_download' : '/start_download';
+            const response = await fetch(endpoint, {
                 method: 'POST',
                 body: formData
             });
             const data = await response.json();
             
             if (data.success) {
-                startStatusPolling();
+                startStatusPolling(data.job_id);
             } else {
                 stopMusic();
                 alert('Error: ' + data.message);
@@ -150,38 +186,72 @@ async function startDownload(platform) {
     }
 }
 
-function startStatusPolling() {
+function startStatusPolling(jobId) {
     isDownloading = true;
-    if (statusInterval) clearInterval(statusInterval);
-    
+    currentJobId = jobId || null;
+    stopStatusUpdates();
+
+    // Prefer server-pushed updates; fall back to polling if unavailable
+    if (currentJobId && window.EventSource) {
+        statusEvents = new EventSource(`/events/${encodeURIComponent(currentJobId)}`);
+        statusEvents.onmessage = (event) => handleStatus(JSON.parse(event.data));
+        statusEvents.addEventListener('done', () => stopStatusUpdates());
+        // The server ends each stream after a while; open a fresh one
+        statusEvents.addEventListener('reconnect', () => startStatusPolling(currentJobId));
+        statusEvents.onerror = () => {
+            if (!isDownloading) return;
+            console.log('Status stream unavailable, polling instead');
+            stopStatusUpdates();
+            pollStatus();
+        };
+        return;
+    }
+
+    pollStatus();
+}
+
+function pollStatus() {
     statusInterval = setInterval(async () => {
         try {
-            const response = await fetch('/get_status');
+            const query = currentJobId ? `?job_id=${encodeURIComponent(currentJobId)}` : '';
+            const response = await fetch('/get_status' + query);
             const data = await response.json();
             
-            updateStatusUI(data);
-            
-            if (!data.is_downloading) {
-                stopMusic();
-                
-                if (data.progress === 100) {
-                    isDownloading = false;
-                    clearInterval(statusInterval);
-                    setTimeout(() => {
-                         document.getElementById('status-message').innerText = "Download Finished!";
-                    }, 1000);
-                } else {
-                    // Download stopped but not 100% (Error or Cancelled)
-                    isDownloading = false;
-                    clearInterval(statusInterval);
-                }
-            }
+            handleStatus(data);
         } catch (error) {
             console.error('Error polling status:', error);
         }
     }, 1000);
 }
 
+function stopStatusUpdates() {
+    if (statusInterval) {
+        clearInterval(statusInterval);
+        statusInterval = null;
+    }
+    if (statusEvents) {
+        statusEvents.close();
+        statusEvents = null;
+    }
+}
+
+function handleStatus(data) {
+    updateStatusUI(data);
+
+    if (!data.is_downloading && data.state !== 'queued' && data.state !== 'paused') {
+        stopMusic();
+        isDownloading = false;
+        stopStatusUpdates();
+
+        if (data.progress === 100) {
+            setTimeout(() => {
+                 document.getElementById('status-message').innerText = "Download Finished!";
+            }, 1000);
+        }
+        // Otherwise the download stopped but not 100% (Error or Cancelled)
+    }
+}
+
 function updateStatusUI(data) {
     const progressBar = document.getElementById('progress-bar');
     const statusMessage = document.getElementById('status-message');
@@ -202,7 +272,9 @@ function updateStatusUI(data) {
 
 async function togglePause() {
     try {
-        const response = await fetch('/toggle_pause', { method: 'POST' });
+        const formData = new FormData();
+        if (currentJobId) formData.append('job_id', currentJobId);
+        const response = await fetch('/toggle_pause', { method: 'POST', body: formData });
         const data = await response.json();
         document.getElementById('status-message').innerText = data.message;
     } catch (error) {
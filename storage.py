@@ -0,0 +1,219 @@
+"""
+Disk space management for DOWNLOAD_FOLDER: quota, eviction of the least
+recently served downloads, orphaned intermediates and the admission of
+jobs by their estimated size.
+"""
+import os
+import re
+import shutil
+import threading
+import time
+
+# yt-dlp intermediates: partial downloads, fragment state, info JSON, ffmpeg temp outputs
+INTERMEDIATE_PATTERN = re.compile(r'(\.part(-Frag\d+(\.part)?|\.json)?|\.ytdl|\.info\.json|\.temp(\.\w+)?)$')
+THUMBNAIL_EXTS = {'.jpg', '.jpeg', '.png', '.webp'}
+# Files the app keeps in DOWNLOAD_FOLDER for itself
+INTERNAL_FILES = {'device_id.txt', 'first_run.txt'}
+
+def intermediate_stem(name):
+    """
+    'Title.f137.mp4.part' -> 'Title', so stray thumbnails can be matched to it
+    """
+    stem = os.path.splitext(INTERMEDIATE_PATTERN.sub('', name))[0]
+    return re.sub(r'\.f[\w-]+$', '', stem)
+
+class StorageManager:
+    """
+    Keeps DOWNLOAD_FOLDER within STORAGE_QUOTA_BYTES and the disk's free
+    space. The last serve time of a download is kept as its atime (set
+    explicitly, so noatime mounts work too); eviction deletes the least
+    recently served files first. Jobs reserve their estimated size when
+    they start, so concurrent jobs cannot overcommit the disk.
+    """
+    def __init__(self, folder, config, on_evict=None):
+        self.folder = folder
+        self.config = config  # the app's config; quota settings are read on every use
+        self.on_evict = on_evict  # called with the path of every evicted download
+        self.evicted = 0
+        self.evicted_bytes = 0
+        self.orphans_removed = 0
+        self._reserved = {}  # job_id -> bytes
+        self._last_sweep = 0
+        self._usage = 0
+        self._usage_at = None  # time.monotonic() of the last walk; None after a removal
+        self._lock = threading.RLock()
+
+    def _files(self, include_internal=True):
+        """
+        (path, stat) for every file under the folder. Without
+        include_internal, dot files/folders (job manifests, the download
+        index) and INTERNAL_FILES are skipped.
+        """
+        for root, dirnames, filenames in os.walk(self.folder):
+            if not include_internal:
+                dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            for name in filenames:
+                if not include_internal and (name.startswith('.') or name in INTERNAL_FILES):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    yield path, os.stat(path)
+                except OSError:
+                    continue  # removed while walking
+
+    def usage(self, max_age=0):
+        """
+        Bytes under the folder. With max_age, a total measured at most that
+        many seconds ago is good enough and the folder is not walked again.
+        """
+        with self._lock:
+            if max_age and self._usage_at is not None and time.monotonic() - self._usage_at < max_age:
+                return self._usage
+        usage = sum(stat.st_size for _, stat in self._files())
+        with self._lock:
+            self._usage, self._usage_at = usage, time.monotonic()
+        return usage
+
+    def available_bytes(self):
+        """
+        Bytes a new job may write: free disk space above STORAGE_MIN_FREE_BYTES,
+        capped by what is left of the quota
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        available = shutil.disk_usage(self.folder).free - self.config['STORAGE_MIN_FREE_BYTES']
+        quota = self.config['STORAGE_QUOTA_BYTES']
+        if quota:
+            available = min(available, quota - self.usage())
+        return available
+
+    def touch(self, path):
+        """
+        Record that path was just served (mtime, and with it ETags and the
+        download index, is left alone)
+        """
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_atime > 60:
+                os.utime(path, (time.time(), stat.st_mtime))
+        except OSError:
+            pass
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            with self._lock:
+                self._usage_at = None
+            return True
+        except OSError as e:
+            print(f"⚠️ Could not remove {path}: {e}")
+            return False
+
+    def evict(self, bytes_needed):
+        """
+        Delete finished downloads, least recently served first, until
+        bytes_needed are freed. Returns the bytes freed.
+        """
+        cutoff = time.time() - self.config['STORAGE_EVICT_MIN_AGE']
+        candidates = sorted(((max(stat.st_atime, stat.st_mtime), path, stat.st_size)
+                             for path, stat in self._files(include_internal=False)
+                             if not INTERMEDIATE_PATTERN.search(path)),
+                            key=lambda candidate: candidate[0])
+        freed = 0
+        with self._lock:
+            for last_used, path, size in candidates:
+                if freed >= bytes_needed or last_used > cutoff:
+                    break
+                if self._remove(path):
+                    if self.on_evict:
+                        self.on_evict(path)
+                    freed += size
+                    self.evicted += 1
+                    self.evicted_bytes += size
+                    print(f"🧹 Evicted {path} ({size} bytes)")
+        return freed
+
+    def sweep_orphans(self, force=False):
+        """
+        Remove intermediates nobody has written to for STORAGE_ORPHAN_AGE
+        (a running download keeps touching its .part/.ytdl files), plus the
+        thumbnails of abandoned downloads. Runs at most every STORAGE_SWEEP_INTERVAL.
+        """
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_sweep < self.config['STORAGE_SWEEP_INTERVAL']:
+                return 0
+            self._last_sweep = now
+
+        cutoff = now - self.config['STORAGE_ORPHAN_AGE']
+        files = list(self._files(include_internal=False))
+        orphans = [path for path, stat in files
+                   if INTERMEDIATE_PATTERN.search(path) and stat.st_mtime < cutoff]
+        # Only failed downloads leave thumbnails behind; an .info.json sits next to finished ones too
+        stems = {(os.path.dirname(path), intermediate_stem(os.path.basename(path)))
+                 for path in orphans if not path.endswith('.info.json')}
+        orphans += [path for path, stat in files
+                    if os.path.splitext(path)[1].lower() in THUMBNAIL_EXTS and stat.st_mtime < cutoff
+                    and (os.path.dirname(path), os.path.splitext(os.path.basename(path))[0]) in stems]
+        removed = sum(1 for path in orphans if self._remove(path))
+        if removed:
+            self.orphans_removed += removed
+            print(f"🧹 Removed {removed} orphaned intermediate file(s)")
+        return removed
+
+    def enforce(self):
+        """
+        Sweep orphans and, above the high watermark, evict down to the low one
+        """
+        self.sweep_orphans()
+        quota = self.config['STORAGE_QUOTA_BYTES']
+        if not quota:
+            return
+        usage = self.usage()
+        if usage > quota * self.config['STORAGE_HIGH_WATERMARK']:
+            self.evict(usage - quota * self.config['STORAGE_LOW_WATERMARK'])
+
+    def admit(self, job):
+        """
+        Decide whether job may start: 'start' (its estimated size is now
+        reserved), 'wait' (it would fit once running jobs stop holding
+        reservations) or 'reject' (it does not fit even after eviction)
+        """
+        return self.reserve(job['job_id'], job.get('_estimated_size') or self.config['STORAGE_DEFAULT_JOB_BYTES'])
+
+    def reserve(self, key, need):
+        """
+        Reserve need bytes under key (a job ID, or a .part path for /stream copies); same verdicts as admit
+        """
+        self.sweep_orphans()
+        with self._lock:
+            reserved = sum(self._reserved.values())
+            shortfall = need + reserved - self.available_bytes()
+            if shortfall > 0:
+                self.evict(shortfall)
+                shortfall = need + reserved - self.available_bytes()
+            if shortfall <= 0:
+                self._reserved[key] = need
+                return 'start'
+            return 'wait' if shortfall <= reserved else 'reject'
+
+    def release(self, job):
+        self.unreserve(job['job_id'])
+
+    def unreserve(self, key):
+        with self._lock:
+            self._reserved.pop(key, None)
+
+    def stats(self):
+        os.makedirs(self.folder, exist_ok=True)
+        with self._lock:
+            reserved = sum(self._reserved.values())
+        return {
+            # /metrics and the job listings ask often; admission and eviction always walk
+            'used_bytes': self.usage(max_age=self.config['STORAGE_STATS_TTL']),
+            'quota_bytes': self.config['STORAGE_QUOTA_BYTES'],
+            'free_bytes': shutil.disk_usage(self.folder).free,
+            'reserved_bytes': reserved,
+            'evicted': self.evicted,
+            'evicted_bytes': self.evicted_bytes,
+            'orphans_removed': self.orphans_removed,
+        }
@@ -0,0 +1,36 @@
+"""
+Shared test setup. Run from the repository root with:
+    python -m pytest -q
+
+All app state (downloads, job state, download index, proxy cache) goes to a
+scratch folder, set before app is imported so nothing touches /tmp/downloads.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STATE_DIR = tempfile.mkdtemp(prefix='udl_tests_')
+atexit.register(shutil.rmtree, STATE_DIR, True)
+os.environ.update(DOWNLOAD_FOLDER=os.path.join(STATE_DIR, 'downloads'),
+                  JOB_STATE_PATH=os.path.join(STATE_DIR, 'job_state.sqlite3'),
+                  DOWNLOAD_INDEX_PATH=os.path.join(STATE_DIR, 'download_index.sqlite3'),
+                  PROXY_CACHE_FOLDER=os.path.join(STATE_DIR, 'proxy_cache'))
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    app_module.app.config['TESTING'] = True
+    return app_module.app.test_client()
@@ -0,0 +1,30 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+asgi = pytest.importorskip('asgi')
+
+
+def test_wsgi_requests_run_concurrently():
+    released = threading.Event()
+
+    def wsgi_app(environ, start_response):
+        if environ['PATH_INFO'] == '/wait':
+            body = b'released' if released.wait(timeout=5) else b'timed out'
+        else:
+            released.set()
+            body = b'ok'
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [body]
+
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.PooledWsgiToAsgi(wsgi_app))
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            waiting = asyncio.ensure_future(client.get('/wait'))
+            await asyncio.sleep(0.1)  # /wait is parked on its thread before /release arrives
+            releasing = await client.get('/release')
+            return (await waiting).text, releasing.text
+
+    assert asyncio.run(run()) == ('released', 'ok')
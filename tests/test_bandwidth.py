@@ -0,0 +1,73 @@
+import pytest
+
+from app import BandwidthScheduler, TokenBucket
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(0)
+    assert bucket.reserve(10 ** 9) == 0.0
+
+
+def test_bucket_allows_one_second_of_burst():
+    bucket = TokenBucket(1000)
+    assert bucket.reserve(1000) == 0.0
+    assert bucket.reserve(500) == pytest.approx(0.5, abs=0.05)
+
+
+def test_chunks_larger_than_the_rate_overdraw():
+    bucket = TokenBucket(100)
+    assert bucket.reserve(300) == pytest.approx(2.0, abs=0.05)
+
+
+def test_lowering_the_rate_drops_saved_tokens():
+    bucket = TokenBucket(1000)
+    bucket.set_rate(10)
+    assert bucket.reserve(20) == pytest.approx(1.0, abs=0.05)
+
+
+@pytest.fixture
+def scheduler(app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'BANDWIDTH_LIMIT', 1000)
+    monkeypatch.setitem(app_module.app.config, 'JOB_BANDWIDTH_LIMIT', 0)
+    monkeypatch.setitem(app_module.app.config, 'FRAGMENT_CONCURRENCY', 8)
+    return BandwidthScheduler()
+
+
+def test_active_jobs_share_fairly(scheduler):
+    first, second = {}, {}
+    with scheduler.transfer({'job_id': 'a'}, first):
+        assert (first['ratelimit'], first['concurrent_fragment_downloads']) == (1000, 8)
+        with scheduler.transfer({'job_id': 'b'}, second):
+            assert (first['ratelimit'], second['ratelimit']) == (500, 500)
+            assert first['concurrent_fragment_downloads'] == second['concurrent_fragment_downloads'] == 4
+        assert first['ratelimit'] == 1000
+    assert scheduler.stats()['active_jobs'] == {}
+
+
+def test_capped_job_leaves_the_rest_to_others(scheduler):
+    first, second = {}, {}
+    scheduler.set_override('a', bandwidth_limit=100, fragment_concurrency=2)
+    with scheduler.transfer({'job_id': 'a'}, first), scheduler.transfer({'job_id': 'b'}, second):
+        assert (first['ratelimit'], second['ratelimit']) == (100, 900)
+        assert (first['concurrent_fragment_downloads'], second['concurrent_fragment_downloads']) == (2, 4)
+        scheduler.set_override('a', bandwidth_limit=None)
+        assert first['ratelimit'] == 500
+    scheduler.forget('a')
+    assert scheduler.stats()['overrides'] == {}
+
+
+def test_runtime_limit_change(app_module, scheduler):
+    params = {}
+    with scheduler.transfer({'job_id': 'a'}, params):
+        app_module.app.config['BANDWIDTH_LIMIT'] = 0
+        scheduler.rebalance()
+        assert params['ratelimit'] is None
+        assert scheduler.global_bucket.rate == 0
+
+
+def test_nested_transfers_share_one_entry(scheduler):
+    with scheduler.transfer({'job_id': 'a'}):
+        with scheduler.transfer({'job_id': 'a'}):
+            assert list(scheduler.stats()['active_jobs']) == ['a']
+        assert list(scheduler.stats()['active_jobs']) == ['a']
+    assert scheduler.stats()['active_jobs'] == {}
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from app import DownloadIndex, download_index_key, reuse_indexed_file
+
+KEY = ('Youtube', 'abc', 'Video', '720')
+
+
+@pytest.fixture
+def index(tmp_path):
+    return DownloadIndex(str(tmp_path / 'index' / 'downloads.sqlite3'))
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / 'Clip.mp4'
+    path.write_bytes(b'video data')
+    return str(path)
+
+
+def test_hit_after_record(index, video):
+    assert index.lookup(KEY) is None
+    recorded = index.record(KEY, video, 'Clip')
+    entry = index.lookup(KEY)
+    assert (entry['path'], entry['size'], entry['checksum']) == (video, 10, recorded['checksum'])
+    assert (index.hits, index.misses) == (1, 1)
+
+
+def test_deleted_file_drops_the_row(index, video):
+    index.record(KEY, video)
+    os.remove(video)
+    assert index.lookup(KEY) is None
+    with open(video, 'wb') as f:
+        f.write(b'video data')
+    assert index.lookup(KEY) is None  # the row is gone, not just skipped
+
+
+def test_changed_file_drops_the_row(index, video):
+    index.record(KEY, video)
+    with open(video, 'wb') as f:
+        f.write(b'other data')  # same size, new content
+    os.utime(video, (1, 1))
+    assert index.lookup(KEY) is None
+
+
+def test_touched_file_is_still_valid(index, video):
+    index.record(KEY, video)
+    os.utime(video, (1, 1))
+    assert index.lookup(KEY)['mtime'] == 1
+
+
+def test_forget_path_and_prune(index, video, tmp_path):
+    other = tmp_path / 'Other.mp4'
+    other.write_bytes(b'x')
+    index.record(KEY, video)
+    index.record(('Youtube', 'def', 'Video', '720'), str(other))
+    index.forget_path(video)
+    assert index.lookup(KEY) is None
+    os.remove(other)
+    assert index.prune() == 1
+
+
+def test_key():
+    info = {'extractor_key': 'Youtube', 'id': 'abc'}
+    assert download_index_key(info, 'Video', '720') == KEY
+    # Audio files depend on the audio format only
+    assert download_index_key(info, 'Audio', '720', 'opus') == ('Youtube', 'abc', 'Audio', 'opus')
+    assert download_index_key({'id': 'abc'}, 'Video', '720') is None
+
+
+def test_reuse_links_into_another_folder(index, video, tmp_path):
+    entry = index.record(KEY, video)
+    target = reuse_indexed_file(entry, str(tmp_path / 'elsewhere'))
+    assert target == str(tmp_path / 'elsewhere' / 'Clip.mp4')
+    with open(target, 'rb') as f:
+        assert f.read() == b'video data'
+    assert reuse_indexed_file(entry, str(tmp_path)) == video
+
+
+def test_repeat_request_finishes_at_once(app_module, client, monkeypatch, video, tmp_path):
+    info = {'extractor_key': 'Youtube', 'id': 'repeat1', 'title': 'Clip'}
+    monkeypatch.setattr(app_module, 'extract_video_info', lambda url: dict(info))
+    monkeypatch.setattr(app_module, 'secure_path', lambda folder: folder)
+    app_module.download_index.record(download_index_key(info, 'Video', '720'), video)
+
+    response = client.post('/start_download', data={'url': 'https://youtube.com/watch?v=repeat1',
+                                                     'quality': '720p', 'mode': 'Video', 'platform': 'youtube',
+                                                     'download_folder': str(tmp_path)})
+    job = app_module.get_job(response.get_json()['job_id'])
+    assert job['state'] == 'finished'
+    assert job['result']['reused']
+    assert job['current_file'] == 'Clip.mp4'
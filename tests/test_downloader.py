@@ -0,0 +1,166 @@
+import os
+import re
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from downloader import MediaDownloader, claim_part, load_resume_state, release_part, split_ranges
+from jobs import DownloadPaused
+
+BODY = os.urandom(64 * 1024)
+CONFIG = {
+    'SEGMENT_RETRIES': 0,
+    'DOWNLOAD_BUFFER_SIZE': 1024,
+    'SEGMENTS_PER_FILE': 4,
+    'SEGMENT_MIN_SIZE': 16 * 1024,
+    'PARALLEL_FILE_DOWNLOADS': 2,
+}
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers, body):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(f'HTTP {self.status_code}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def origin(accept_ranges=True):
+    """
+    http_get stand-in serving BODY, with or without Range support
+    """
+    def http_get(url, headers=None, **kwargs):
+        match = re.match(r'bytes=(\d+)-(\d*)', (headers or {}).get('Range', ''))
+        if not accept_ranges or not match:
+            return FakeResponse(200, {'Content-Length': str(len(BODY))}, BODY)
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(BODY) - 1
+        return FakeResponse(206, {'Content-Range': f'bytes {start}-{end}/{len(BODY)}'}, BODY[start:end + 1])
+    return http_get
+
+
+class Unlimited:
+    def consume(self, count, job=None):
+        pass
+
+    @contextmanager
+    def transfer(self, job=None):
+        yield
+
+
+def pause_after(limit):
+    received = [0]
+
+    def on_bytes(count):
+        received[0] += count
+        if received[0] >= limit:
+            raise DownloadPaused()
+    return on_bytes
+
+
+def test_split_ranges():
+    assert split_ranges(10, 3) == [(0, 3), (4, 7), (8, 9)]
+    assert split_ranges(10, 1) == [(0, 9)]
+
+
+def test_segmented_download(tmp_path):
+    path = str(tmp_path / 'clip.mp4')
+    transfers = []
+    downloader = MediaDownloader(CONFIG, origin(), Unlimited(), lambda *args: transfers.append(args))
+    assert downloader.download_file('https://cdn/clip.mp4', path) == len(BODY)
+    with open(path, 'rb') as f:
+        assert f.read() == BODY
+    assert not os.path.exists(path + '.part')
+    assert transfers[0][:2] == ('direct', len(BODY))
+
+
+def test_paused_download_resumes_from_its_part(tmp_path):
+    path = str(tmp_path / 'clip.mp4')
+    downloader = MediaDownloader(CONFIG, origin(), Unlimited())
+    with pytest.raises(DownloadPaused):
+        downloader.download_file('https://cdn/clip.mp4', path, on_bytes=pause_after(len(BODY) // 2))
+    size, segments = load_resume_state(path + '.part', len(BODY))
+    assert size == len(BODY) and len(segments) == 4
+
+    reported = []
+    downloader.download_file('https://cdn/clip.mp4', path, on_bytes=reported.append)
+    with open(path, 'rb') as f:
+        assert f.read() == BODY
+    assert sum(reported) == len(BODY)  # bytes kept from the first run are reported up front
+    assert not os.path.exists(path + '.part') and not os.path.exists(path + '.part.json')
+
+
+def test_without_ranges_a_pause_starts_over(tmp_path):
+    path = str(tmp_path / 'clip.mp4')
+    downloader = MediaDownloader(CONFIG, origin(accept_ranges=False), Unlimited())
+    with pytest.raises(DownloadPaused):
+        downloader.download_file('https://cdn/clip.mp4', path, on_bytes=pause_after(1024))
+    assert not os.path.exists(path + '.part')
+    downloader.download_file('https://cdn/clip.mp4', path)
+    with open(path, 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_claimed_part_is_not_downloaded_twice(tmp_path):
+    path = str(tmp_path / 'clip.mp4')
+    assert claim_part(path + '.part')
+    try:
+        with pytest.raises(IOError):
+            MediaDownloader(CONFIG, origin(), Unlimited()).download_file('https://cdn/clip.mp4', path)
+    finally:
+        release_part(path + '.part')
+
+
+def test_download_files_reports_failures_per_item(tmp_path):
+    def http_get(url, headers=None, **kwargs):
+        if 'missing' in url:
+            return FakeResponse(404, {}, b'')
+        return origin()(url, headers)
+
+    items = [('https://cdn/a.mp4', str(tmp_path / 'a.mp4')), ('https://cdn/missing.mp4', str(tmp_path / 'b.mp4'))]
+    progress = []
+    results = MediaDownloader(CONFIG, http_get, Unlimited()).download_files(items, on_progress=progress.append)
+    assert [result['success'] for result in results] == [True, False]
+    assert progress[-1] == pytest.approx(50)
+
+
+def test_pause_stops_the_whole_batch_at_once(tmp_path):
+    requested = set()
+    paused = []
+
+    def http_get(url, headers=None, **kwargs):
+        requested.add(url)
+        return origin()(url, headers)
+
+    def on_progress(percentage):
+        # Like wait_if_paused: hold the transfer for a while, then give the worker back
+        if percentage > 10:
+            paused.append(percentage)
+            time.sleep(0.3)
+            raise DownloadPaused()
+
+    config = dict(CONFIG, PARALLEL_FILE_DOWNLOADS=2)
+    items = [(f'https://cdn/{index}.mp4', str(tmp_path / f'{index}.mp4')) for index in range(4)]
+    started = time.monotonic()
+    with pytest.raises(DownloadPaused):
+        MediaDownloader(config, http_get, Unlimited()).download_files(items, on_progress=on_progress)
+    # Waits overlap instead of queueing behind a lock, and files not yet started stay untouched
+    assert time.monotonic() - started < 1.5
+    assert len(paused) <= 2 * config['SEGMENTS_PER_FILE']
+    assert requested == {'https://cdn/0.mp4', 'https://cdn/1.mp4'}
+    for _, path in items[:2]:
+        assert load_resume_state(path + '.part', len(BODY)) is not None
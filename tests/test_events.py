@@ -0,0 +1,34 @@
+import sys
+import types
+
+
+def test_sync_worker_is_refused(client):
+    response = client.get('/events/unknown-job', environ_overrides={'wsgi.multithread': False})
+    assert response.status_code == 503
+
+
+def test_threaded_worker_streams(client):
+    response = client.get('/events/unknown-job', environ_overrides={'wsgi.multithread': True})
+    assert response.status_code == 404  # past the worker check
+
+
+def test_gevent_worker_streams(client, monkeypatch):
+    monkey = types.ModuleType('gevent.monkey')
+    monkey.is_module_patched = lambda name: name == 'threading'
+    monkeypatch.setitem(sys.modules, 'gevent.monkey', monkey)
+    response = client.get('/events/unknown-job', environ_overrides={'wsgi.multithread': False})
+    assert response.status_code == 404
+
+
+def test_eventlet_worker_streams(client, monkeypatch):
+    patcher = types.ModuleType('eventlet.patcher')
+    patcher.is_monkey_patched = lambda name: name == 'thread'
+    monkeypatch.setitem(sys.modules, 'eventlet.patcher', patcher)
+    response = client.get('/events/unknown-job', environ_overrides={'wsgi.multithread': False})
+    assert response.status_code == 404
+
+
+def test_config_flag_allows_any_worker(app_module, client, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'SSE_ALLOW_ANY_WORKER', True)
+    response = client.get('/events/unknown-job', environ_overrides={'wsgi.multithread': False})
+    assert response.status_code == 404
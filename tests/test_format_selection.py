@@ -0,0 +1,68 @@
+from app import estimate_format_size, select_format
+
+
+def video(format_id, height, ext='mp4', vcodec='avc1', tbr=1000, **extra):
+    return dict(format_id=format_id, height=height, ext=ext, vcodec=vcodec, acodec='none', tbr=tbr, **extra)
+
+
+def audio(format_id, ext='m4a', acodec='mp4a.40.2', abr=128, **extra):
+    return dict(format_id=format_id, ext=ext, vcodec='none', acodec=acodec, abr=abr, **extra)
+
+
+def muxed(format_id, height, ext='mp4', **extra):
+    return dict(format_id=format_id, height=height, ext=ext, vcodec='avc1', acodec='mp4a.40.2', **extra)
+
+
+INFO = {'duration': 100, 'formats': [
+    muxed('18', 360),
+    video('134', 360), video('136', 720), video('137', 1080), video('313', 2160, ext='webm', vcodec='vp9'),
+    audio('140'), audio('251', ext='webm', acodec='opus', abr=160),
+    {'format_id': 'sb0', 'ext': 'mhtml', 'vcodec': 'none', 'acodec': 'none'},
+]}
+
+
+def test_height_is_capped():
+    plan = select_format(INFO, 'Video', '720')
+    assert plan['format'] == '136+140'
+    assert plan['height'] == 720
+    assert not plan['progressive']
+
+
+def test_progressive_format_skips_the_merge():
+    plan = select_format(INFO, 'Video', '360')
+    assert plan['format'] == '18'
+    assert plan['progressive']
+
+
+def test_mp4_streams_are_preferred():
+    info = {'formats': [video('webm720', 720, ext='webm', vcodec='vp9', tbr=2000), video('mp4720', 720),
+                        audio('140'), audio('251', ext='webm', acodec='opus', abr=160)]}
+    plan = select_format(info, 'Video', '720')
+    assert plan['format'] == 'mp4720+140'
+    assert plan['ext'] == 'mp4'
+
+
+def test_no_cap_takes_the_tallest():
+    assert select_format(INFO, 'Video', 'best')['format'] == '313+140'
+
+
+def test_nothing_under_the_cap_takes_the_smallest():
+    info = {'formats': [video('720', 720), video('1080', 1080), audio('140')]}
+    assert select_format(info, 'Video', '240')['format'] == '720+140'
+
+
+def test_audio_follows_the_requested_codec():
+    assert select_format(INFO, 'Audio', 'best', 'opus')['format'] == '251'
+    assert select_format(INFO, 'Audio', 'best', 'm4a')['format'] == '140'
+
+
+def test_estimated_size():
+    info = {'duration': 10, 'formats': [video('136', 720, filesize=5000), audio('140', tbr=128)]}
+    plan = select_format(info, 'Video', '720')
+    assert plan['estimated_size'] == 5000 + 128 * 1000 // 8 * 10
+    assert estimate_format_size({'filesize_approx': 42}, None) == 42
+    assert estimate_format_size({}, 10) is None
+
+
+def test_without_formats_yt_dlp_decides():
+    assert select_format({'url': 'https://example.com/a.mp4'}, 'Video', '720') is None
@@ -0,0 +1,67 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'x' * 100
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def small_pool(app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'HTTP_MAX_CONNECTIONS_PER_HOST', 1)
+    monkeypatch.setitem(app_module.app.config, 'HTTP_POOL_TIMEOUT', 0.2)
+    app_module.reset_http_adapter()
+    yield
+    app_module.reset_http_adapter()
+
+
+def test_full_pool_fails_after_the_pool_timeout(app_module, origin, small_pool):
+    held = app_module.http_get(origin, stream=True)  # keeps the only connection
+    result = {}
+
+    def second():
+        started = time.monotonic()
+        try:
+            app_module.http_get(origin)
+        except app_module.requests.exceptions.RequestException as e:
+            result['error'] = e
+        result['elapsed'] = time.monotonic() - started
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert isinstance(result['error'], app_module.requests.exceptions.ConnectionError)
+    assert result['elapsed'] < 2
+
+    held.close()
+    assert app_module.http_get(origin).content == b'x' * 100
+
+
+def test_connection_is_reused(app_module, origin, small_pool):
+    for _ in range(3):
+        assert app_module.http_get(origin).status_code == 200
+    pool = next(stats for stats in app_module.get_http_pool_stats()['pools'] if origin.startswith(stats['host']))
+    assert (pool['connections_opened'], pool['requests']) == (1, 3)
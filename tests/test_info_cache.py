@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+import types
+
+import pytest
+
+from app import InfoCache, info_cache_key, normalize_url
+
+
+def test_hit_after_miss():
+    cache = InfoCache(max_entries=4, ttl=60)
+    calls = []
+    extract = lambda: calls.append(1) or {'id': 'a'}
+    assert cache.get_or_extract('k', extract) == {'id': 'a'}
+    assert cache.get_or_extract('k', extract) == {'id': 'a'}
+    assert len(calls) == 1
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 1)
+
+
+def test_expired_entry_is_extracted_again():
+    cache = InfoCache(max_entries=4, ttl=60)
+    cache._entries['k'] = (time.time() - 1, {'id': 'old'})
+    assert cache.peek('k') is None
+    assert cache.get_or_extract('k', lambda: {'id': 'new'}) == {'id': 'new'}
+
+
+def test_ttl_for_can_shorten_or_skip():
+    cache = InfoCache(max_entries=4, ttl=60, ttl_for=lambda info: info['ttl'])
+    cache.put('short', {'ttl': 5})
+    cache.put('none', {'ttl': 0})
+    assert cache.peek('short')[0] <= time.time() + 5
+    assert cache.peek('none') is None
+
+
+def test_least_recently_used_entry_goes():
+    cache = InfoCache(max_entries=2, ttl=60)
+    cache.put('a', {'id': 'a'})
+    cache.put('b', {'id': 'b'})
+    cache.get_or_extract('a', lambda: pytest.fail('a is cached'))
+    cache.put('c', {'id': 'c'})
+    assert cache.peek('b') is None
+    assert cache.peek('a') and cache.peek('c')
+
+
+def test_concurrent_misses_share_one_extraction():
+    cache = InfoCache(max_entries=4, ttl=60)
+    started = threading.Event()
+    finish = threading.Event()
+    calls = []
+
+    def extract():
+        calls.append(1)
+        started.set()
+        finish.wait(5)
+        return {'id': 'a'}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_extract('k', extract)))
+               for _ in range(4)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    finish.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert results == [{'id': 'a'}] * 4
+
+
+def test_failed_extraction_is_not_cached():
+    cache = InfoCache(max_entries=4, ttl=60)
+
+    def fail():
+        raise ValueError('unavailable')
+
+    with pytest.raises(ValueError):
+        cache.get_or_extract('k', fail)
+    assert cache.get_or_extract('k', lambda: {'id': 'a'}) == {'id': 'a'}
+
+
+def test_normalized_urls_share_a_key():
+    assert normalize_url('https://www.YouTube.com/watch?v=abc&si=share&utm_source=x') == \
+        normalize_url('https://youtube.com/watch?v=abc')
+    assert normalize_url('https://m.example.com/a/') == 'https://example.com/a'
+    assert info_cache_key('https://youtube.com/watch?v=abc', {'quiet': True}) != \
+        info_cache_key('https://youtube.com/watch?v=abc', {'quiet': False})
+
+
+class FakeYoutubeDL:
+    """
+    Counts extractions; process_ie_result "downloads" by writing the file
+    """
+    extracted = 0
+    processed = []
+    folder = None
+
+    def __init__(self, params=None):
+        self.params = dict(params or {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=False):
+        FakeYoutubeDL.extracted += 1
+        return {'id': 'clip1', 'extractor_key': 'Fake', 'title': 'Clip', 'ext': 'mp4',
+                'webpage_url': url, 'formats': []}
+
+    def process_ie_result(self, info, download=True):
+        FakeYoutubeDL.processed.append(info)
+        with open(self.prepare_filename(info), 'wb') as f:
+            f.write(b'video')
+        return info
+
+    def prepare_filename(self, info):
+        return os.path.join(self.folder, 'Clip.mp4')
+
+    def add_post_processor(self, *args, **kwargs):
+        pass
+
+
+def test_download_reuses_the_extracted_info(app_module, monkeypatch, tmp_path):
+    FakeYoutubeDL.folder = str(tmp_path)
+    monkeypatch.setattr(app_module, 'yt_dlp', types.SimpleNamespace(YoutubeDL=FakeYoutubeDL))
+    url = f'https://fake.example.com/watch?v=clip1&t={time.time()}'
+
+    info = app_module.extract_video_info(url)  # e.g. /get_title
+    info['title'] = 'changed by the caller'  # callers get a private copy
+    job = app_module.new_job('info-cache-test', 'video')
+    app_module.download_video(job, url, '720p', 'Video', str(tmp_path))
+
+    assert FakeYoutubeDL.extracted == 1
+    assert len(FakeYoutubeDL.processed) == 1
+    assert FakeYoutubeDL.processed[0]['title'] == 'Clip'
+    assert job['current_file'] == 'Clip.mp4'
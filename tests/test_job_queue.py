@@ -0,0 +1,80 @@
+import queue
+import threading
+import time
+
+import pytest
+
+
+def noop(job):
+    pass
+
+
+@pytest.fixture
+def held_queue(app_module, monkeypatch):
+    """
+    A job queue no worker reads from, to look at the order jobs come out in
+    """
+    monkeypatch.setattr(app_module, 'job_queue', queue.PriorityQueue())
+    monkeypatch.setattr(app_module, 'start_job_workers', lambda: None)
+    submitted = []
+    yield submitted
+    for job in submitted:
+        app_module.cancel_job(job)
+
+
+def test_lower_priority_comes_out_first(app_module, held_queue):
+    for title, priority in (('late', 5), ('urgent', 1), ('later', 5)):
+        held_queue.append(app_module.submit_job(noop, kind='test', title=title, priority=priority))
+    order = [app_module.get_job(app_module.job_queue.get()[2])['title'] for _ in range(3)]
+    assert order == ['urgent', 'late', 'later']
+
+
+def test_default_priority(app_module, held_queue):
+    job = app_module.submit_job(noop, kind='test')
+    held_queue.append(job)
+    assert job['_priority'] == app_module.app.config['DEFAULT_JOB_PRIORITY']
+    assert job['state'] == 'queued'
+
+
+def test_job_runs_and_finishes(app_module):
+    job = app_module.submit_job(noop, kind='test')
+    assert job['_done'].wait(5)
+    assert job['state'] == 'finished'
+    assert job['finished_at'] is not None
+
+
+def test_pause_gives_the_worker_back_and_resume_requeues(app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'PAUSE_PARK_SECONDS', 0.05)
+    release = threading.Event()
+
+    def pausable(job):
+        while not release.wait(0.01):
+            app_module.wait_if_paused(job)
+
+    job = app_module.submit_job(pausable, kind='test')
+    deadline = time.time() + 5
+    while job['state'] != 'running' and time.time() < deadline:
+        time.sleep(0.01)
+
+    app_module.set_job_paused(job, True)
+    deadline = time.time() + 5
+    while (job['state'] != 'paused' or job['is_downloading']) and time.time() < deadline:
+        time.sleep(0.01)
+    assert (job['state'], job['is_downloading']) == ('paused', False)
+
+    # The worker is free again: other jobs run while this one is parked
+    other = app_module.submit_job(noop, kind='test')
+    assert other['_done'].wait(5)
+
+    release.set()
+    app_module.set_job_paused(job, False)
+    assert job['_done'].wait(5)
+    assert job['state'] == 'finished'
+
+
+def test_cancel_queued_job(app_module, held_queue):
+    job = app_module.submit_job(noop, kind='test')
+    assert app_module.cancel_job(job)
+    assert job['state'] == 'cancelled'
+    assert job['_done'].is_set()
+    assert not app_module.cancel_job(job)
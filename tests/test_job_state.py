@@ -0,0 +1,101 @@
+import os
+import socket
+import time
+
+import pytest
+
+from jobs import LocalJobState, SQLiteJobState
+
+OWNER = f'{socket.gethostname()}:{os.getpid()}'
+OTHER_OWNER = 'other-host:1234'
+
+
+def snapshot(job_id, version=1, parent=None, created_at=None, finished_at=None, **fields):
+    return dict({'job_id': job_id, 'parent': parent, '_version': version, 'state': 'running', 'progress': 0,
+                 'created_at': time.time() if created_at is None else created_at, 'finished_at': finished_at},
+                **fields)
+
+
+@pytest.fixture
+def sqlite_state(tmp_path):
+    return SQLiteJobState(str(tmp_path / 'state' / 'jobs.sqlite3'))
+
+
+def test_local_backend_shares_nothing():
+    state = LocalJobState()
+    state.write([snapshot('a')], OWNER)
+    assert not state.shared
+    assert state.read('a') is None
+    assert state.latest_id() is None
+    assert state.request_pause('a', True) is False
+    assert state.take_pause_requests(OWNER) == {}
+    assert state.request_cancel('a') is False
+    assert state.take_cancel_requests(OWNER) == []
+
+
+def test_write_and_read(sqlite_state):
+    sqlite_state.write([snapshot('a', progress=40, title='Clip')], OWNER)
+    stored = sqlite_state.read('a')
+    assert (stored['progress'], stored['title'], stored['parent']) == (40, 'Clip', None)
+    assert '_version' not in stored
+    assert sqlite_state.read('missing') is None
+
+
+def test_older_versions_do_not_overwrite(sqlite_state):
+    sqlite_state.write([snapshot('a', version=5, progress=50)], OWNER)
+    sqlite_state.write([snapshot('a', version=4, progress=40)], OWNER)
+    assert sqlite_state.read('a')['progress'] == 50
+    sqlite_state.write([snapshot('a', version=6, progress=60)], OWNER)
+    assert sqlite_state.read('a')['progress'] == 60
+
+
+def test_new_owner_takes_over(sqlite_state):
+    sqlite_state.write([snapshot('a', version=9, progress=90)], OTHER_OWNER)
+    # A restored job starts counting versions again in its new process
+    sqlite_state.write([snapshot('a', version=1, progress=10)], OWNER)
+    assert sqlite_state.read('a')['progress'] == 10
+
+
+def test_latest_id_skips_children(sqlite_state):
+    sqlite_state.write([snapshot('old', created_at=100), snapshot('new', created_at=200),
+                        snapshot('item', parent='new', created_at=300)], OWNER)
+    assert sqlite_state.latest_id() == 'new'
+
+
+def test_pause_requests_reach_the_owner_once(sqlite_state):
+    sqlite_state.write([snapshot('mine'), snapshot('theirs')], OWNER)
+    sqlite_state.write([snapshot('theirs')], OTHER_OWNER)
+    assert sqlite_state.request_pause('mine', True)
+    assert sqlite_state.request_pause('theirs', True)
+    assert not sqlite_state.request_pause('missing', True)
+    assert sqlite_state.take_pause_requests(OWNER) == {'mine': True}
+    assert sqlite_state.take_pause_requests(OWNER) == {}
+    assert sqlite_state.take_pause_requests(OTHER_OWNER) == {'theirs': True}
+
+
+def test_cancel_requests_reach_the_owner_once(sqlite_state):
+    sqlite_state.write([snapshot('running'), snapshot('done', finished_at=time.time())], OWNER)
+    assert sqlite_state.request_cancel('running')
+    assert not sqlite_state.request_cancel('done')
+    assert sqlite_state.take_cancel_requests(OTHER_OWNER) == []
+    assert sqlite_state.take_cancel_requests(OWNER) == ['running']
+    assert sqlite_state.take_cancel_requests(OWNER) == []
+
+
+def test_unfinished_job_of_an_exited_worker(sqlite_state):
+    dead_owner = f'{socket.gethostname()}:{2 ** 22 + 1}'  # above the default pid_max
+    sqlite_state.write([snapshot('orphan')], dead_owner)
+    stored = sqlite_state.read('orphan')
+    assert stored['is_downloading'] is False
+    assert 'Interrupted' in stored['message']
+
+
+def test_prune(sqlite_state):
+    now = time.time()
+    sqlite_state.write([snapshot('old', finished_at=now - 100), snapshot('recent', finished_at=now),
+                        snapshot('running')], OWNER)
+    sqlite_state.prune(now - 50)
+    assert sqlite_state.read('old') is None
+    assert sqlite_state.read('recent') is not None
+    assert sqlite_state.read('running') is not None
+    assert sqlite_state.stats()['jobs'] == 2
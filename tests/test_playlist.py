@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+ENTRIES = [{'url': f'https://example.com/watch?v={index}', 'id': str(index), 'ie_key': 'Example',
+            'title': f'Item {index}'} for index in range(5)]
+
+
+@pytest.fixture
+def playlist(app_module, monkeypatch, tmp_path):
+    running = set()
+    seen = {'max_running': 0, 'admitted': []}
+    lock = threading.Lock()
+    release = threading.Event()
+    release.set()
+
+    def download_video(job, url, *args):
+        with lock:
+            running.add(job['job_id'])
+            seen['max_running'] = max(seen['max_running'], len(running))
+        try:
+            while not release.wait(0.01):
+                app_module.wait_if_paused(job)
+                app_module.wait_if_paused(job['_parent'])
+            time.sleep(0.05)
+            app_module.update_job(job, progress=100)
+        finally:
+            with lock:
+                running.discard(job['job_id'])
+
+    admit = app_module.storage.admit
+
+    def recording_admit(job):
+        seen['admitted'].append(job['job_id'])
+        return admit(job)
+
+    monkeypatch.setattr(app_module, 'expand_playlist', lambda url: iter(ENTRIES))
+    monkeypatch.setattr(app_module, 'download_video', download_video)
+    monkeypatch.setattr(app_module.storage, 'admit', recording_admit)
+    monkeypatch.setitem(app_module.app.config, 'PAUSE_PARK_SECONDS', 0.1)
+
+    def submit(concurrency=2):
+        return app_module.submit_job(app_module.download_playlist, kind='playlist',
+                                     args=('https://example.com/list', 'best', 'video', str(tmp_path),
+                                           None, concurrency, False, 'mp3'))
+
+    return submit, seen, release
+
+
+def test_items_are_queued_jobs(app_module, playlist):
+    submit, seen, _ = playlist
+    job = submit(concurrency=2)
+    assert job['_done'].wait(10)
+
+    assert job['state'] == 'finished'
+    assert job['result'] == {'total': 5, 'completed': 5, 'skipped': 0, 'failed': 0}
+    assert seen['max_running'] <= 2
+    children = set(job['_children'])
+    # Every item went through storage admission in a queue worker, as did the batch itself
+    assert children | {job['job_id']} == set(seen['admitted'])
+    assert all(child['state'] == 'finished' for child in job['_children'].values())
+
+
+def test_pause_and_resume_batch(app_module, playlist):
+    submit, seen, release = playlist
+    release.clear()
+    job = submit(concurrency=2)
+    deadline = time.time() + 5
+    while not seen['max_running'] and time.time() < deadline:
+        time.sleep(0.01)
+
+    app_module.set_job_paused(job, True)
+    deadline = time.time() + 5
+    while job['state'] != 'paused' and time.time() < deadline:
+        time.sleep(0.01)
+    assert job['state'] == 'paused'
+    assert not job['_done'].is_set()
+
+    release.set()
+    app_module.set_job_paused(job, False)
+    assert job['_done'].wait(10)
+    assert job['result']['completed'] == 5
+
+
+def test_cancel_batch(app_module, playlist):
+    submit, seen, release = playlist
+    release.clear()
+    job = submit(concurrency=2)
+    deadline = time.time() + 5
+    while not seen['max_running'] and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert app_module.cancel_job(job)
+    assert job['_done'].wait(5)
+    assert job['state'] == 'cancelled'
+    assert all(child['state'] == 'cancelled' for child in job['_children'].values())
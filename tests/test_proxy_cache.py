@@ -0,0 +1,141 @@
+import os
+import time
+
+import pytest
+
+from proxy_cache import ProxyCache, new_proxy_meta, proxy_conditional_headers
+
+URL = 'https://cdn.example.com/thumb.jpg'
+
+
+def store(cache, url, body, lifetime=60, headers=None):
+    tmp_path = cache.new_temp_path()
+    with open(tmp_path, 'wb') as f:
+        f.write(body)
+    meta = new_proxy_meta(url, headers or {'Content-Type': 'image/jpeg'}, lifetime)
+    meta['digest'] = 'd' * 32
+    return cache.store(url, tmp_path, meta)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ProxyCache(str(tmp_path / 'cache'), max_bytes=1000, default_ttl=300)
+
+
+def test_store_and_lookup(cache):
+    stored = store(cache, URL, b'x' * 100)
+    meta = cache.lookup(URL)
+    assert meta['body_path'] == stored['body_path']
+    with open(meta['body_path'], 'rb') as f:
+        assert f.read() == b'x' * 100
+    assert cache.lookup('https://cdn.example.com/other.jpg') is None
+    assert cache.stats()['bytes'] == 100
+
+
+def test_lifetime(cache):
+    assert cache.lifetime({'Cache-Control': 'no-store'}) is None
+    assert cache.lifetime({'Cache-Control': 'no-cache'}) == 0
+    assert cache.lifetime({'Cache-Control': 'public, max-age=120'}) == 120
+    assert cache.lifetime({'Cache-Control': 'max-age=60, s-maxage=600'}) == 600
+    assert cache.lifetime({}) == 300
+
+
+def test_expiry(cache):
+    store(cache, URL, b'x', lifetime=60)
+    assert cache.lookup(URL)['expires_at'] > time.time()
+    store(cache, URL, b'x', lifetime=0)
+    assert cache.lookup(URL)['expires_at'] <= time.time()
+
+
+def test_conditional_headers():
+    meta = new_proxy_meta(URL, {'ETag': '"v1"', 'Last-Modified': 'Wed, 01 Jan 2025 00:00:00 GMT'}, 60)
+    assert proxy_conditional_headers(meta) == {'If-None-Match': '"v1"',
+                                               'If-Modified-Since': 'Wed, 01 Jan 2025 00:00:00 GMT'}
+    assert proxy_conditional_headers(None) == {}
+
+
+def test_evicts_least_recently_used(cache):
+    for index in range(2):
+        store(cache, f'{URL}?{index}', b'x' * 400)
+        os.utime(cache._paths(f'{URL}?{index}')[1], (index, index))  # the metadata mtime is the LRU clock
+    cache.touch(f'{URL}?0')
+    store(cache, f'{URL}?2', b'x' * 400)  # over max_bytes: the least recently used entry goes
+    assert cache.lookup(f'{URL}?0') is not None
+    assert cache.lookup(f'{URL}?1') is None
+    assert cache.lookup(f'{URL}?2') is not None
+    assert cache.stats()['bytes'] == 800
+
+
+def test_counters(cache):
+    cache.count('hits')
+    cache.count('hits')
+    cache.count('revalidated')
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['revalidated']) == (2, 0, 1)
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, body=b''):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+        self.url = URL
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def proxied(app_module, tmp_path, monkeypatch):
+    cache = ProxyCache(str(tmp_path / 'proxied'), max_bytes=10 ** 6, default_ttl=300)
+    monkeypatch.setattr(app_module, 'proxy_cache', cache)
+    requests_seen = []
+
+    def serve(url, origin):
+        def http_get(url, **kwargs):
+            requests_seen.append(kwargs.get('headers') or {})
+            return origin
+
+        monkeypatch.setattr(app_module, 'http_get', http_get)
+        with app_module.app.test_request_context('/proxy_image'):
+            response = app_module.serve_proxied_image(url)
+            response.direct_passthrough = False
+            return response, response.get_data()
+
+    return cache, serve, requests_seen
+
+
+def test_miss_then_fresh_hit(proxied):
+    cache, serve, requests_seen = proxied
+    origin = FakeResponse(200, {'Content-Type': 'image/jpeg', 'Cache-Control': 'max-age=60', 'ETag': '"v1"'}, b'jpeg')
+    response, body = serve(URL, origin)
+    assert (response.status_code, body) == (200, b'jpeg')
+
+    response, body = serve(URL, None)  # fresh: the origin is not asked
+    assert (response.status_code, body) == (200, b'jpeg')
+    assert len(requests_seen) == 1
+    assert (cache.stats()['misses'], cache.stats()['hits']) == (1, 1)
+
+
+def test_stale_entry_is_revalidated(proxied):
+    cache, serve, requests_seen = proxied
+    origin = FakeResponse(200, {'Content-Type': 'image/jpeg', 'Cache-Control': 'no-cache', 'ETag': '"v1"'}, b'jpeg')
+    serve(URL, origin)
+    assert cache.lookup(URL)['expires_at'] <= time.time()
+
+    response, body = serve(URL, FakeResponse(304, {'Cache-Control': 'max-age=60'}))
+    assert (response.status_code, body) == (200, b'jpeg')
+    assert requests_seen[-1]['If-None-Match'] == '"v1"'
+    assert cache.stats()['revalidated'] == 1
+    assert cache.lookup(URL)['expires_at'] > time.time()
+
+
+def test_no_store_is_not_cached(proxied):
+    cache, serve, _ = proxied
+    response, body = serve(URL, FakeResponse(200, {'Cache-Control': 'no-store'}, b'jpeg'))
+    assert body == b'jpeg'
+    assert cache.lookup(URL) is None
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+from werkzeug.http import http_date
+
+BODY = bytes(range(256)) * 40  # 10240 bytes
+
+
+@pytest.fixture
+def download(app_module):
+    folder = app_module.app.config['DOWNLOAD_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, 'clip.mp4')
+    with open(path, 'wb') as f:
+        f.write(BODY)
+    os.utime(path, (1700000000, 1700000000))
+    yield path
+    os.remove(path)
+
+
+def test_full_file(client, download):
+    resp = client.get('/downloads/clip.mp4')
+    assert resp.status_code == 200
+    assert resp.data == BODY
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    assert resp.headers['Content-Length'] == str(len(BODY))
+    assert 'attachment' in resp.headers['Content-Disposition']
+    assert resp.headers['ETag'] == f'"1700000000-{len(BODY)}"'
+
+
+def test_range(client, download):
+    resp = client.get('/downloads/clip.mp4', headers={'Range': 'bytes=100-199'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == f'bytes 100-199/{len(BODY)}'
+    assert resp.headers['Content-Length'] == '100'
+    assert resp.data == BODY[100:200]
+
+
+def test_open_ended_and_suffix_ranges(client, download):
+    resp = client.get('/downloads/clip.mp4', headers={'Range': 'bytes=10000-'})
+    assert resp.status_code == 206
+    assert resp.data == BODY[10000:]
+
+    resp = client.get('/downloads/clip.mp4', headers={'Range': 'bytes=-40'})
+    assert resp.status_code == 206
+    assert resp.data == BODY[-40:]
+
+
+def test_unsatisfiable_range(client, download):
+    resp = client.get('/downloads/clip.mp4', headers={'Range': f'bytes={len(BODY)}-'})
+    assert resp.status_code == 416
+    assert resp.headers['Content-Range'] == f'bytes */{len(BODY)}'
+
+
+def test_multiple_ranges_get_the_whole_file(client, download):
+    resp = client.get('/downloads/clip.mp4', headers={'Range': 'bytes=0-9,20-29'})
+    assert resp.status_code == 200
+    assert resp.data == BODY
+
+
+def test_if_none_match_and_if_modified_since(client, download):
+    etag = client.get('/downloads/clip.mp4').headers['ETag']
+    assert client.get('/downloads/clip.mp4', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/downloads/clip.mp4', headers={'If-None-Match': '"other"'}).status_code == 200
+    assert client.get('/downloads/clip.mp4', headers={'If-Modified-Since': http_date(1700000000)}).status_code == 304
+    assert client.get('/downloads/clip.mp4', headers={'If-Modified-Since': http_date(1600000000)}).status_code == 200
+
+
+def test_if_range(client, download):
+    etag = client.get('/downloads/clip.mp4').headers['ETag']
+
+    resp = client.get('/downloads/clip.mp4', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert resp.status_code == 206
+    assert resp.data == BODY[:10]
+
+    resp = client.get('/downloads/clip.mp4', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert resp.status_code == 200
+    assert resp.data == BODY
+
+    resp = client.get('/downloads/clip.mp4', headers={'Range': 'bytes=0-9', 'If-Range': http_date(1700000000)})
+    assert resp.status_code == 206
+
+    resp = client.get('/downloads/clip.mp4', headers={'Range': 'bytes=0-9', 'If-Range': http_date(1600000000)})
+    assert resp.status_code == 200
+
+
+def test_missing_file(client):
+    assert client.get('/downloads/nothing.mp4').status_code == 404
@@ -0,0 +1,109 @@
+import os
+import time
+
+import pytest
+
+from storage import StorageManager
+
+
+@pytest.fixture
+def config():
+    return {
+        'STORAGE_QUOTA_BYTES': 1000,
+        'STORAGE_MIN_FREE_BYTES': 0,
+        'STORAGE_DEFAULT_JOB_BYTES': 300,
+        'STORAGE_EVICT_MIN_AGE': 60,
+        'STORAGE_ORPHAN_AGE': 3600,
+        'STORAGE_SWEEP_INTERVAL': 0,
+        'STORAGE_HIGH_WATERMARK': 0.9,
+        'STORAGE_LOW_WATERMARK': 0.7,
+        'STORAGE_STATS_TTL': 60,
+    }
+
+
+@pytest.fixture
+def folder(tmp_path):
+    return str(tmp_path / 'downloads')
+
+
+def job(job_id, estimated_size=None):
+    return {'job_id': job_id, '_estimated_size': estimated_size}
+
+
+def write_file(path, size, age=0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    then = time.time() - age
+    os.utime(path, (then, then))
+
+
+def test_admit_reserves_until_release(config, folder):
+    storage = StorageManager(folder, config)
+    assert storage.admit(job('a', 600)) == 'start'
+    assert storage.stats()['reserved_bytes'] == 600
+    # Fits once 'a' releases its reservation
+    assert storage.admit(job('b', 600)) == 'wait'
+    storage.release(job('a'))
+    assert storage.admit(job('b', 600)) == 'start'
+
+
+def test_admit_rejects_what_never_fits(config, folder):
+    storage = StorageManager(folder, config)
+    assert storage.admit(job('big', 2000)) == 'reject'
+    assert storage.stats()['reserved_bytes'] == 0
+
+
+def test_admit_uses_default_size(config, folder):
+    storage = StorageManager(folder, config)
+    assert storage.admit(job('unknown')) == 'start'
+    assert storage.stats()['reserved_bytes'] == 300
+
+
+def test_admit_evicts_least_recently_served(config, folder):
+    evicted = []
+    storage = StorageManager(folder, config, on_evict=evicted.append)
+    write_file(os.path.join(folder, 'old.mp4'), 400, age=7200)
+    write_file(os.path.join(folder, 'older.mp4'), 400, age=7200)
+    os.utime(os.path.join(folder, 'old.mp4'), (time.time() - 3600, time.time() - 7200))  # served an hour ago
+    assert storage.admit(job('a', 500)) == 'start'
+    assert evicted == [os.path.join(folder, 'older.mp4')]
+    assert os.path.exists(os.path.join(folder, 'old.mp4'))
+
+
+def test_recent_and_internal_files_are_not_evicted(config, folder):
+    storage = StorageManager(folder, config)
+    write_file(os.path.join(folder, 'new.mp4'), 500)
+    write_file(os.path.join(folder, 'device_id.txt'), 100, age=7200)
+    write_file(os.path.join(folder, '.jobs', 'job.json'), 100, age=7200)
+    write_file(os.path.join(folder, 'clip.mp4.part'), 100)
+    assert storage.admit(job('a', 500)) == 'reject'
+    assert sorted(os.listdir(folder)) == ['.jobs', 'clip.mp4.part', 'device_id.txt', 'new.mp4']
+
+
+def test_orphaned_intermediates_are_swept(config, folder):
+    storage = StorageManager(folder, config)
+    write_file(os.path.join(folder, 'Title.f137.mp4.part'), 10, age=7200)
+    write_file(os.path.join(folder, 'Title.webp'), 10, age=7200)
+    write_file(os.path.join(folder, 'Running.mp4.part'), 10)
+    assert storage.sweep_orphans(force=True) == 2
+    assert os.listdir(folder) == ['Running.mp4.part']
+
+
+def test_stats_reuse_a_recent_usage_total(config, folder):
+    storage = StorageManager(folder, config)
+    write_file(os.path.join(folder, 'a.mp4'), 100)
+    assert storage.stats()['used_bytes'] == 100
+    write_file(os.path.join(folder, 'b.mp4'), 100)
+    assert storage.stats()['used_bytes'] == 100  # not walked again within STORAGE_STATS_TTL
+    assert storage.usage() == 200  # admission and eviction always measure
+    assert storage.stats()['used_bytes'] == 200
+
+
+def test_removing_a_file_invalidates_the_total(config, folder):
+    config['STORAGE_EVICT_MIN_AGE'] = 0
+    storage = StorageManager(folder, config)
+    write_file(os.path.join(folder, 'a.mp4'), 100, age=10)
+    assert storage.stats()['used_bytes'] == 100
+    assert storage.evict(100) == 100
+    assert storage.stats()['used_bytes'] == 0
@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+
+import pytest
+
+BODY = bytes(range(256)) * 40
+
+
+class Upstream:
+    """
+    Fake streamed requests response; pulled counts the chunks handed out
+    """
+    def __init__(self, body, status_code=200, headers=None, chunk_size=1024):
+        self.body = body
+        self.status_code = status_code
+        self.headers = {'Content-Length': str(len(body))} if headers is None else headers
+        self.chunk_size = chunk_size
+        self.pulled = 0
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), self.chunk_size):
+            self.pulled += 1
+            yield self.body[start:start + self.chunk_size]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def streamed(app_module, monkeypatch):
+    video_id = f'stream{time.monotonic_ns()}'
+    info = {'id': video_id, 'extractor_key': 'Fake', 'title': video_id, 'duration': 1,
+            'formats': [{'format_id': '18', 'height': 360, 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a.40.2',
+                         'url': 'https://cdn.example.com/18.mp4', 'protocol': 'https', 'filesize': len(BODY)}]}
+    monkeypatch.setattr(app_module, 'extract_video_info', lambda url: info)
+    origin = {'responses': [], 'headers': []}
+
+    def http_get(url, headers=None, stream=False, **kwargs):
+        origin['headers'].append(headers or {})
+        return origin['responses'].pop(0)
+
+    monkeypatch.setattr(app_module, 'http_get', http_get)
+    path = os.path.join(app_module.app.config['DOWNLOAD_FOLDER'], f'{video_id}.mp4')
+    return f'/stream?url=https://fake.example.com/{video_id}&quality=360p', path, origin
+
+
+def test_stream_is_teed_to_disk_and_indexed(app_module, client, streamed):
+    url, path, origin = streamed
+    origin['responses'].append(Upstream(BODY))
+    response = client.get(url + '&tee=1')
+    assert response.data == BODY
+    assert response.headers['Content-Length'] == str(len(BODY))
+    with open(path, 'rb') as f:
+        assert f.read() == BODY
+    assert not os.path.exists(path + '.part')
+
+    # The next request is answered from the kept copy without going upstream
+    response = client.get(url)
+    assert response.data == BODY
+    assert len(origin['headers']) == 1
+
+
+def test_without_tee_nothing_is_written(client, streamed):
+    url, path, origin = streamed
+    origin['responses'].append(Upstream(BODY))
+    assert client.get(url + '&tee=0').data == BODY
+    assert not os.path.exists(path) and not os.path.exists(path + '.part')
+
+
+def test_upstream_is_read_as_the_client_reads(client, streamed):
+    url, path, origin = streamed
+    upstream = Upstream(BODY)
+    origin['responses'].append(upstream)
+    response = client.get(url + '&tee=1')
+    chunks = iter(response.response)
+    first = next(chunks)
+    assert first == BODY[:len(first)]
+    assert upstream.pulled <= 2  # nothing is buffered ahead of the client
+    response.close()
+
+    # Cut short: the .part is kept for the next stream of the file
+    assert not os.path.exists(path)
+    assert os.path.getsize(path + '.part') == upstream.pulled * upstream.chunk_size
+
+
+def test_cut_short_stream_is_resumed(client, streamed):
+    url, path, origin = streamed
+    origin['responses'].append(Upstream(BODY))
+    response = client.get(url + '&tee=1')
+    next(iter(response.response))
+    response.close()
+    kept = os.path.getsize(path + '.part')
+
+    rest = BODY[kept:]
+    origin['responses'].append(Upstream(rest, 206, {'Content-Length': str(len(rest)),
+                                                    'Content-Range': f'bytes {kept}-{len(BODY) - 1}/{len(BODY)}'}))
+    response = client.get(url + '&tee=1')
+    assert response.data == BODY
+    assert origin['headers'][-1]['Range'] == f'bytes={kept}-'
+    with open(path, 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_client_range_is_passed_through_untouched(client, streamed):
+    url, path, origin = streamed
+    origin['responses'].append(Upstream(BODY[:100], 206, {'Content-Length': '100',
+                                                          'Content-Range': f'bytes 0-99/{len(BODY)}'}))
+    response = client.get(url + '&tee=1', headers={'Range': 'bytes=0-99'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 0-99/{len(BODY)}'
+    assert origin['headers'][-1]['Range'] == 'bytes=0-99'
+    assert not os.path.exists(path + '.part')
+
+
+def test_closing_an_ffmpeg_stream_stops_the_process(app_module):
+    command = [sys.executable, '-c', 'import sys\nwhile True: sys.stdout.buffer.write(b"x" * 65536)']
+    chunks = app_module.ffmpeg_chunks(command)
+    assert next(chunks)
+    started = time.monotonic()
+    chunks.close()  # the client went away
+    assert time.monotonic() - started < 5
+
+
+def test_failed_ffmpeg_stream_raises(app_module):
+    command = [sys.executable, '-c', 'import sys; sys.stderr.write("bad input"); sys.exit(1)']
+    with pytest.raises(IOError, match='bad input'):
+        list(app_module.ffmpeg_chunks(command))